@@ -20,12 +20,17 @@ const int RELAY_PINS[NUM_RELAYS] = {
 // Define LED pins here: const int NUM_LEDS = 8;
 const int LED_PINS[NUM_LEDS] = {10};
 
+// TTL outputs for external rigs ('T' command), one per digital_analog_outputs event
+const int NUM_TTL = 5;
+const int TTL_PINS[NUM_TTL] = {30, 31, 32, 33, 34};
+
 // Create sensor objects
 CapacitiveSensor* sensors[NUM_SENSORS];
 
 // ------------------- STATE -------------------
 bool relayControlEnabled = false;
 bool relayActive[NUM_RELAYS] = { false };
+int pendingSeq = -1;  // sequence number of the command being executed (-1 = not sequenced)
 
 void setup() {
   Serial.begin(115200);
@@ -40,6 +45,11 @@ void setup() {
     digitalWrite(LED_PINS[i], LOW);  // default OFF
   } 
 
+  for (int i = 0; i < NUM_TTL; i++) {
+    pinMode(TTL_PINS[i], OUTPUT);
+    digitalWrite(TTL_PINS[i], LOW);
+  }
+
   for (int i = 0; i < NUM_SENSORS; i++) {
     sensors[i] = new CapacitiveSensor(sendPins[i], receivePins[i]);
   }
@@ -52,6 +62,13 @@ void loop() {
   if (Serial.available()) {
     char c = Serial.read();
 
+    // '#' <0x80 | seq> <command>: acknowledged with "ack:<seq>" once applied
+    if (c == '#') {
+      while (Serial.available() < 2) {}
+      pendingSeq = Serial.read() & 0x7F;
+      c = Serial.read();
+    }
+
     if (c == 'r') {
       relayControlEnabled = true;
     }
@@ -117,13 +134,39 @@ void loop() {
 
       if (rewardChannel == '1') {
         pwmReward1 = pwmVal;
-        Serial.print("PWM1 set to ");
-        Serial.println(pwmReward1);
       }
       else if (rewardChannel == '2') {
         pwmReward2 = pwmVal;
-        Serial.print("PWM2 set to ");
-        Serial.println(pwmReward2);
+      }
+    }
+
+    else if (c == 'B') {
+      // Bulk state: <LED mask><relay mask>, bit 0 = LED/relay 1.
+      // All pins are switched in one block, so the ports change together.
+      while (Serial.available() < 2) {}
+      byte ledMask = Serial.read();
+      byte relayMask = Serial.read();
+
+      noInterrupts();
+      for (int i = 0; i < NUM_LEDS; i++) {
+        digitalWrite(LED_PINS[i], (ledMask >> i) & 1 ? HIGH : LOW);
+      }
+      for (int i = 0; i < NUM_RELAYS; i++) {
+        relayActive[i] = (relayMask >> i) & 1;
+        if (!relayActive[i]) {
+          digitalWrite(RELAY_PINS[i], HIGH);  // OFF (active LOW)
+        }
+      }
+      interrupts();
+    }
+
+    else if (c == 'T') {
+      // TTL edge: <channel '1'..'9'><level '0'/'1'>
+      while (Serial.available() < 2) {}
+      int ttlIndex = Serial.read() - '1';
+      int level = Serial.read() - '0';
+      if (ttlIndex >= 0 && ttlIndex < NUM_TTL) {
+        digitalWrite(TTL_PINS[ttlIndex], level ? HIGH : LOW);
       }
     }
 
@@ -134,12 +177,14 @@ void loop() {
 
       if (relayIndex >= 0 && relayIndex < NUM_RELAYS && (rewardGroup == 1 || rewardGroup == 2)) {
         RELAY_TO_REWARD[relayIndex] = rewardGroup;
-        Serial.print("Mapped Relay ");
-        Serial.print(relayIndex + 1);
-        Serial.print(" to Reward ");
-        Serial.println(rewardGroup);
       }
     }
+
+    if (pendingSeq >= 0) {
+      Serial.print("ack:");
+      Serial.println(pendingSeq);
+      pendingSeq = -1;
+    }
   }
 
   // Relay activation logic based on reward group
@@ -0,0 +1,382 @@
+# arduino_emulator.py
+"""
+Virtual lickport boards for running the host without hardware.
+
+Each VirtualArduino opens a pseudo-terminal and speaks the same single-byte
+protocol as Arduino Code/arduinocode*.cpp, so the host connects to it with a
+plain serial.Serial(<pty path>). Sensor reads return synthetic capacitive
+traces with Poisson-distributed lick bouts; response latency, jitter, noise
+and garbage injection are configurable for stress tests.
+
+pty is POSIX only; on Windows use a virtual COM pair (e.g. com0com) instead.
+
+Usage:
+    python arduino_emulator.py --boards 2 --sensors 2,1 [--latency 0.001] [--garbage 0.01]
+    MULTIPORT_SER1_PORT=/dev/pts/N MULTIPORT_SER2_PORT=/dev/pts/M python main_gui.py
+"""
+import argparse
+import math
+import os
+import random
+import select
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+    import pty
+    import termios
+    import tty
+except ImportError:  # Windows
+    pty = None
+    tty = None
+
+
+class VirtualArduino:
+    def __init__(self, name="board", num_sensors=2, num_relays=8, num_leds=1, num_ttl=5,
+                 latency=0.0, jitter=0.0, read_time_per_sensor=0.0,
+                 baseline=400.0, noise=20.0, lick_rate=0.2, lick_amplitude=1500.0,
+                 lick_duration=0.04, bout_length=5, lick_interval=0.14,
+                 garbage_rate=0.0, ack_drop_rate=0.0, boot_delay=0.0, seed=None):
+        """
+        latency / jitter:      base and gaussian extra delay (s) before every reply
+        read_time_per_sensor:  extra delay (s) per sensor on 's', like capacitiveSensor(80)
+        lick_rate:             lick bouts per second per sensor (Poisson)
+        garbage_rate:          probability that a reply line is corrupted
+        ack_drop_rate:         probability that an acknowledgement is not sent
+        """
+        if pty is None:
+            raise RuntimeError("VirtualArduino needs pty support (POSIX). Use a virtual COM pair on Windows.")
+        self.name = name
+        self.num_sensors = int(num_sensors)
+        self.num_relays = int(num_relays)
+        self.num_leds = int(num_leds)
+        self.num_ttl = int(num_ttl)
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.read_time_per_sensor = float(read_time_per_sensor)
+        self.baseline = float(baseline)
+        self.noise = float(noise)
+        self.lick_rate = float(lick_rate)
+        self.lick_amplitude = float(lick_amplitude)
+        self.lick_duration = float(lick_duration)
+        self.bout_length = int(bout_length)
+        self.lick_interval = float(lick_interval)
+        self.garbage_rate = float(garbage_rate)
+        self.ack_drop_rate = float(ack_drop_rate)
+        self.boot_delay = float(boot_delay)
+        self.rng = random.Random(seed)
+
+        # firmware state (mirrors the globals in arduinocode*.cpp)
+        self.relay_control_enabled = False
+        self.relay_active = [False] * self.num_relays
+        self.relay_on = [False] * self.num_relays
+        self.relay_to_reward = [0] * self.num_relays
+        self.led_on = [False] * self.num_leds
+        self.pwm_reward = {1: 255, 2: 255}
+        self.ttl_level = [0] * self.num_ttl
+        self.ttl_edges = []                 # (perf_counter time, channel, level) of every applied 'T'
+
+        self.command_counts = {}
+        self.lines_sent = 0
+        self.garbage_sent = 0
+        self.acks_dropped = 0
+
+        self._master = None
+        self._slave = None
+        self.port = None
+        self._thread = None
+        self._running = threading.Event()
+        self._rx = bytearray()
+        self._packet_mode = False
+        self._t0 = None
+        self._licks = [[] for _ in range(self.num_sensors)]       # pending lick onsets (s)
+        self._next_bout = [0.0] * self.num_sensors
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(**cfg)
+
+    # ---------- Lifecycle ----------
+    def start(self):
+        """Opens the pty, sends READY and returns the device path for serial.Serial."""
+        if self._running.is_set():
+            return self.port
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        tty.setraw(self._master)
+        # packet mode: the host's input flush when it opens the port shows up here (see _run)
+        self._packet_mode = _enable_packet_mode(self._master)
+        self.port = os.ttyname(self._slave)
+        self._t0 = time.perf_counter()
+        for i in range(self.num_sensors):
+            self._next_bout[i] = self._draw_bout_gap()
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name=f"Emu-{self.name}", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._running.clear()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+
+    def reset(self):
+        """Simulates the board reset that happens when the host opens the port (called from _run)."""
+        self._rx.clear()
+        self.relay_control_enabled = False
+        self.relay_active = [False] * self.num_relays
+        self.relay_on = [False] * self.num_relays
+        self.led_on = [False] * self.num_leds
+        if self.boot_delay:
+            time.sleep(self.boot_delay)
+        self._t0 = time.perf_counter()
+        self._send_line("READY", allow_garbage=False)
+
+    def millis(self):
+        return int((time.perf_counter() - self._t0) * 1000) & 0xFFFFFFFF
+
+    # ---------- I/O loop ----------
+    def _run(self):
+        if self.boot_delay:
+            time.sleep(self.boot_delay)
+        self._send_line("READY", allow_garbage=False)
+        while self._running.is_set():
+            try:
+                ready, _, _ = select.select([self._master], [], [], 0.05)
+            except (OSError, ValueError):
+                break
+            if not ready:
+                continue
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                break
+            if self._packet_mode:
+                # every read starts with a status byte: TIOCPKT_DATA (0) or control flags
+                status, data = data[0], data[1:]
+                if status & termios.TIOCPKT_FLUSHREAD:
+                    # serial.Serial() flushes its input when it opens the port; READY sent
+                    # before that is lost, so the board "resets" and sends it again
+                    self.reset()
+                    continue
+            if not data:
+                continue
+            self._rx.extend(data)
+            self._consume()
+
+    def _consume(self):
+        """Executes every complete command in the receive buffer, keeping partial ones."""
+        while self._rx:
+            # '#' <0x80 | seq> <command> is acknowledged with 'ack:<seq>' after execution
+            seq, start = None, 0
+            if self._rx[0] == ord("#"):
+                if len(self._rx) < 3:
+                    return
+                seq, start = self._rx[1] & 0x7F, 2
+            c = chr(self._rx[start])
+            needed = start + {"L": 2, "l": 2, "P": 3, "M": 3, "B": 3, "T": 3}.get(c, 1)
+            if len(self._rx) < needed:
+                return  # firmware blocks on Serial.available() until the rest arrives
+            args = bytes(self._rx[start + 1:needed])
+            del self._rx[:needed]
+            self.command_counts[c] = self.command_counts.get(c, 0) + 1
+            self._execute(c, args)
+            self._update_relays()
+            if seq is not None:
+                if self.ack_drop_rate and self.rng.random() < self.ack_drop_rate:
+                    self.acks_dropped += 1
+                else:
+                    self._reply(f"ack:{seq}")
+
+    def _execute(self, c, args):
+        if c == "r":
+            self.relay_control_enabled = True
+        elif c == "i":
+            self.relay_control_enabled = False
+            self.relay_active = [False] * self.num_relays
+            self.relay_on = [False] * self.num_relays
+            self.led_on = [False] * self.num_leds
+        elif "1" <= c <= "8":
+            idx = ord(c) - ord("1")
+            if idx < self.num_relays:
+                self.relay_active[idx] = True
+        elif c == "s":
+            self._delay(self.read_time_per_sensor * self.num_sensors)
+            now = time.perf_counter() - self._t0
+            values = ",".join(str(self._sensor_value(i, now)) for i in range(self.num_sensors))
+            self._reply(f"ts:{self.millis()} cs:{values}")
+        elif c in ("L", "l"):
+            idx = args[0] - ord("1")
+            if 0 <= idx < self.num_leds:
+                self.led_on[idx] = (c == "L")
+        elif c == "P":
+            channel, value = chr(args[0]), max(0, min(255, args[1]))
+            if channel in ("1", "2"):
+                self.pwm_reward[int(channel)] = value
+        elif c == "B":
+            # bulk state: LED mask and selected-relay mask, applied together
+            led_mask, relay_mask = args[0], args[1]
+            self.led_on = [bool(led_mask >> i & 1) for i in range(self.num_leds)]
+            self.relay_active = [bool(relay_mask >> i & 1) for i in range(self.num_relays)]
+            self.relay_on = [on and active for on, active in zip(self.relay_on, self.relay_active)]
+        elif c == "T":
+            idx = args[0] - ord("1")
+            if 0 <= idx < self.num_ttl:
+                self.ttl_level[idx] = 1 if args[1] != ord("0") else 0
+                self.ttl_edges.append((time.perf_counter(), idx + 1, self.ttl_level[idx]))
+        elif c == "M":
+            idx = args[0] - ord("1")
+            group = args[1] - ord("0")
+            if 0 <= idx < self.num_relays and group in (1, 2):
+                self.relay_to_reward[idx] = group
+
+    def _update_relays(self):
+        if not self.relay_control_enabled:
+            return
+        for i in range(self.num_relays):
+            if self.relay_active[i]:
+                group = self.relay_to_reward[i]
+                self.relay_on[i] = group in (1, 2) and self.pwm_reward[group] > 0
+
+    # ---------- Synthetic signal ----------
+    def _draw_bout_gap(self):
+        if self.lick_rate <= 0:
+            return math.inf
+        return self.rng.expovariate(self.lick_rate)
+
+    def _sensor_value(self, i, now):
+        # schedule new lick bouts up to now
+        while self._next_bout[i] <= now:
+            onset = self._next_bout[i]
+            for k in range(max(1, self.bout_length)):
+                self._licks[i].append(onset + k * self.lick_interval)
+            self._next_bout[i] = onset + self.bout_length * self.lick_interval + self._draw_bout_gap()
+        licks = self._licks[i]
+        while licks and licks[0] + self.lick_duration < now:
+            licks.pop(0)
+
+        value = self.baseline + self.rng.gauss(0.0, self.noise)
+        if licks and licks[0] <= now:
+            # half-sine contact pulse
+            phase = (now - licks[0]) / self.lick_duration
+            value += self.lick_amplitude * math.sin(math.pi * min(1.0, phase))
+        return max(0, int(value))
+
+    # ---------- Output ----------
+    def _delay(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def _reply(self, line):
+        extra = self.rng.gauss(0.0, self.jitter) if self.jitter else 0.0
+        self._delay(self.latency + max(0.0, extra))
+        self._send_line(line)
+
+    def _send_line(self, line, allow_garbage=True):
+        if allow_garbage and self.garbage_rate and self.rng.random() < self.garbage_rate:
+            line = self._corrupt(line)
+            self.garbage_sent += 1
+        try:
+            os.write(self._master, (line + "\r\n").encode("latin-1"))
+            self.lines_sent += 1
+        except OSError:
+            pass
+
+    def _corrupt(self, line):
+        kind = self.rng.randrange(4)
+        if kind == 0 and len(line) > 2:
+            return line[:self.rng.randrange(1, len(line))]                      # truncated
+        if kind == 1:
+            return "".join(chr(self.rng.randrange(33, 127)) for _ in range(self.rng.randrange(1, 20)))
+        if kind == 2:
+            return line.replace(",", ",,", 1) if "," in line else line + ","   # malformed list
+        return "\x00\xff" + line                                                  # line noise
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "port": self.port,
+            "relay_control_enabled": self.relay_control_enabled,
+            "relay_active": list(self.relay_active),
+            "relay_on": list(self.relay_on),
+            "relay_to_reward": list(self.relay_to_reward),
+            "led_on": list(self.led_on),
+            "pwm_reward": dict(self.pwm_reward),
+            "ttl_level": list(self.ttl_level),
+            "command_counts": dict(self.command_counts),
+            "lines_sent": self.lines_sent,
+            "garbage_sent": self.garbage_sent,
+            "acks_dropped": self.acks_dropped,
+        }
+
+
+def _enable_packet_mode(fd):
+    """Best effort: TIOCPKT on the pty master (False where it is not supported)."""
+    try:
+        fcntl.ioctl(fd, termios.TIOCPKT, struct.pack("i", 1))
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+def start_emulated_boards(configs):
+    """Starts one VirtualArduino per config dict and returns them (ports in .port)."""
+    boards = []
+    for i, cfg in enumerate(configs):
+        cfg = dict(cfg)
+        cfg.setdefault("name", f"board{i + 1}")
+        board = VirtualArduino.from_config(cfg)
+        board.start()
+        boards.append(board)
+    return boards
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emulate lickport Arduinos on pseudo-terminals.")
+    parser.add_argument("--boards", type=int, default=2)
+    parser.add_argument("--sensors", default="2,1", help="Sensors per board, comma separated")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--read-time", type=float, default=0.0, help="Seconds per sensor read")
+    parser.add_argument("--noise", type=float, default=20.0)
+    parser.add_argument("--lick-rate", type=float, default=0.2)
+    parser.add_argument("--garbage", type=float, default=0.0)
+    parser.add_argument("--ack-drop", type=float, default=0.0, help="Probability of a lost acknowledgement")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    sensors = [int(s) for s in args.sensors.split(",")]
+    configs = []
+    for i in range(args.boards):
+        configs.append({
+            "num_sensors": sensors[i] if i < len(sensors) else sensors[-1],
+            "latency": args.latency, "jitter": args.jitter,
+            "read_time_per_sensor": args.read_time, "noise": args.noise,
+            "lick_rate": args.lick_rate, "garbage_rate": args.garbage,
+            "ack_drop_rate": args.ack_drop,
+            "seed": None if args.seed is None else args.seed + i,
+        })
+    boards = start_emulated_boards(configs)
+    for b in boards:
+        print(f"[EMULATOR] {b.name}: {b.num_sensors} sensors on {b.port}")
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for b in boards:
+            b.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+# arena.py
+"""
+Several arenas (rigs) driven from one host.
+
+An Arena bundles everything one rig needs: its own devices and topology (from
+its own arena config), sensor buffers, recording flags, session paths, Engine
+and TrialController. Nothing is shared with the shared_states module or with
+other arenas, so their sessions cannot interfere.
+
+ArenaSupervisor runs several arenas at once, either as threads in this
+process or as one process per arena (optionally pinned to CPU cores), and
+aggregates their status.
+
+Usage:
+    python arena.py <rigs.json> [--processes] [--status-hz 1]
+
+rigs.json:
+    {"arenas": [
+        {"name": "rig1", "config": "Config/arena_rig1.json",
+         "mouse_file": "...", "protocol_file": "...", "cpus": [2, 3]},
+        ...
+    ]}
+Optional per-arena keys: session, overwrite, reward1_relay, reward2_relay,
+hz, track, skip_handshake, handshake_timeout.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import shared_states
+from device_registry import DeviceRegistry, load_arena_config
+from engine import Engine
+from position_tracker import PositionStream, PositionTracker
+from pose_inference import PoseProvider
+from session_files import prepare_session, open_sensor_csv, close_sensor_csv, open_pose_csv, close_pose_csv
+from topology import Topology
+from trial_functionality import TrialController
+
+
+class ArenaState:
+    """
+    Per-arena counterpart of the shared_states module: the attributes Engine,
+    TrialController, hardware and session_files read and write.
+    """
+    MAX_POINTS = 200
+    CSV_FLUSH_EVERY_N = 60
+    GUI_PUSH_PERIOD = shared_states.GUI_PUSH_PERIOD
+    GUI_BUFFER_LEN = shared_states.GUI_BUFFER_LEN
+
+    def __init__(self, name, arena_config):
+        self.name = name
+        self.arena_config = arena_config
+        self.devices = DeviceRegistry.from_config(arena_config)
+        self.topology = Topology.from_config(arena_config)
+        self.sensor_mapping = self.topology.sensor_mapping()
+        self.remembered_relays = {"1": None, "2": None}
+
+        self.timestamps = {}
+        self.data_buffers = {}
+        self.gui_time_buffers = [deque(maxlen=self.GUI_BUFFER_LEN) for _ in range(self.topology.n_ports)]
+        self.gui_plot_buffers = [deque(maxlen=self.GUI_BUFFER_LEN) for _ in range(self.topology.n_ports)]
+        self.sensor_history = {}
+        self.camera_lock = threading.Lock()
+        self.last_camera_frame = None
+        self.position_stream = PositionStream()
+        self.output_scheduler = None
+        self.frame_recorder = None
+        self.dashboard = None
+        self.profiler = None
+
+        self.is_recording = False
+        self.current_session_path = None
+        self.current_session_name = None
+        self.current_mouse_file = None
+        self.current_mouse_data = {}
+        self.current_protocol = None
+        self.protocol_file_path = None
+        self.csv_file = None
+        self.csv_writer = None
+        self.pose_csv_file = None
+        self.pose_csv_writer = None
+
+
+class Arena:
+    def __init__(self, name, config=None, camera=None, target_hz=30, track=True):
+        """
+        config: arena config dict or path to one (default: Config/arena.json).
+        camera: optional frame callable for this arena's Engine.
+        track:  run a PositionTracker on this arena's camera frames.
+        """
+        if config is None or isinstance(config, str):
+            config = load_arena_config(config)
+        self.name = name
+        self.state = ArenaState(name, config)
+        self.camera = camera
+        self.target_hz = target_hz
+        self.track = track
+        self.engine = None
+        self.controller = None
+        self.protocol = None
+        self.session_path = None
+        self._t_start = None
+        self._last = (time.perf_counter(), 0)
+        self._rate = 0.0
+
+    # ---------- Setup ----------
+    def connect(self, timeout=5.0):
+        """Opens this arena's boards and waits for READY on all of them in parallel."""
+        ready = self.state.devices.handshake_all(timeout)
+        print(f"[ARENA {self.name}] Boards ready: {ready}")
+        return ready
+
+    def prepare_session(self, mouse_file, protocol_file, **kwargs):
+        self.session_path, self.protocol = prepare_session(mouse_file, protocol_file, state=self.state, **kwargs)
+        print(f"[ARENA {self.name}] Session folder: {self.session_path}")
+        return self.session_path
+
+    # ---------- Run ----------
+    def start(self):
+        if self.protocol is None:
+            raise RuntimeError(f"Arena {self.name}: prepare_session() first")
+        self.controller = TrialController(headless=True, state=self.state)
+        self.controller.load_protocol(self.protocol)
+        pose = PoseProvider.from_config(self.state.arena_config)
+        self.engine = Engine(target_hz=self.target_hz, camera=self.camera, state=self.state,
+                             tracker=PositionTracker() if self.track else None, pose=pose)
+        open_sensor_csv(self.session_path, self.state)
+        open_pose_csv(self.session_path, self.state, n_keypoints=pose.n_keypoints if pose else 1)
+        self.state.is_recording = True
+        self.engine.start()
+        self.controller.start_session()
+        self._t_start = time.perf_counter()
+        self._last = (self._t_start, 0)
+        self._rate = 0.0
+
+    @property
+    def running(self):
+        c = self.controller
+        return c is not None and c.thread is not None and c.thread.is_alive()
+
+    def stop(self):
+        if self.controller is not None and self.controller.session_running:
+            self.controller.stop_session()
+        self.state.is_recording = False
+        if self.engine is not None:
+            self.engine.stop()
+        close_sensor_csv(self.state)
+        close_pose_csv(self.state)
+
+    def close(self):
+        self.stop()
+        self.state.devices.close_all()
+
+    def status(self):
+        """Snapshot of this arena's progress; rate is measured since the last call."""
+        now = time.perf_counter()
+        c, e = self.controller, self.engine
+        processed = e.stats.processed if e else 0
+        if now - self._last[0] >= 0.2:  # too short a window gives meaningless rates
+            self._rate = (processed - self._last[1]) / (now - self._last[0])
+            self._last = (now, processed)
+        return {
+            "name": self.name,
+            "running": self.running,
+            "session": self.state.current_session_name,
+            "elapsed_s": now - self._t_start if self._t_start else 0.0,
+            "trial": c.current_trial_index if c else 0,
+            "trial_target": c.trial_count_target if c else None,
+            "phase": c.current_phase if c else None,
+            "rate_hz": self._rate,
+            "samples": processed,
+            "acq_drops": e.stats.acq_drops if e else 0,
+            "writer_drops": e.stats.writer_drops if e else 0,
+        }
+
+
+# ---------- Supervisor ----------
+def pin_to_cpus(cpus):
+    """Pins the calling process to the given CPU cores (Linux natively, elsewhere via psutil)."""
+    if not cpus:
+        return False
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, set(cpus))
+        else:
+            import psutil
+            psutil.Process().cpu_affinity(list(cpus))
+        return True
+    except ImportError:
+        print(f"[ARENA] psutil not installed, cannot pin to CPUs {cpus}.")
+    except (OSError, ValueError) as e:
+        print(f"[ARENA] Could not pin to CPUs {cpus}: {e}")
+    return False
+
+def _arena_from_spec(spec):
+    arena = Arena(spec["name"], spec.get("config"), target_hz=spec.get("hz", 30),
+                  track=spec.get("track", True))
+    arena.prepare_session(spec["mouse_file"], spec["protocol_file"],
+                          session=spec.get("session"), overwrite=spec.get("overwrite", False),
+                          reward1_relay=spec.get("reward1_relay"), reward2_relay=spec.get("reward2_relay"))
+    if not spec.get("skip_handshake"):
+        arena.connect(spec.get("handshake_timeout", 5.0))
+    return arena
+
+def _run_arena_process(spec, status_q, stop_event, status_period):
+    """Entry point of one arena process: runs the session and reports status until done."""
+    pin_to_cpus(spec.get("cpus"))
+    arena = None
+    try:
+        arena = _arena_from_spec(spec)
+        arena.start()
+        while arena.running and not stop_event.is_set():
+            status_q.put(arena.status())
+            stop_event.wait(status_period)
+    except Exception as e:
+        print(f"[ARENA {spec.get('name')}] Failed: {e}")
+    finally:
+        if arena is not None:
+            arena.close()
+            status_q.put(arena.status())
+
+
+class ArenaSupervisor:
+    """
+    Runs several arenas concurrently.
+
+    mode='thread':  all arenas in this process (each with its own Engine and
+                    trial threads). Cheap, but arenas share the GIL.
+    mode='process': one process per arena, pinned to spec['cpus'] if given.
+                    Recommended for timing-critical rigs.
+    """
+    def __init__(self, specs, mode="thread", status_hz=1.0):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown supervisor mode: {mode}")
+        names = [s["name"] for s in specs]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Arena names must be unique: {names}")
+        self.specs = specs
+        self.mode = mode
+        self.status_period = 1.0 / max(0.1, status_hz)
+        self.arenas = {}       # thread mode: name -> Arena
+        self.processes = {}    # process mode: name -> Process
+        self.latest = {s["name"]: {"name": s["name"], "running": True} for s in specs}
+        self._ctx = multiprocessing.get_context("spawn")
+        self._status_q = None
+        self._stop_event = None
+
+    def start(self):
+        if self.mode == "thread":
+            for spec in self.specs:
+                arena = _arena_from_spec(spec)
+                self.arenas[arena.name] = arena
+            for arena in self.arenas.values():
+                arena.start()
+            return
+        self._status_q = self._ctx.Queue()
+        self._stop_event = self._ctx.Event()
+        for spec in self.specs:
+            p = self._ctx.Process(target=_run_arena_process, name=f"Arena-{spec['name']}",
+                                  args=(spec, self._status_q, self._stop_event, self.status_period))
+            p.start()
+            self.processes[spec["name"]] = p
+
+    def poll(self):
+        """Returns the latest status of every arena ({name: status})."""
+        if self.mode == "thread":
+            for name, arena in self.arenas.items():
+                self.latest[name] = arena.status()
+        else:
+            while True:
+                try:
+                    st = self._status_q.get_nowait()
+                except queue.Empty:
+                    break
+                self.latest[st["name"]] = st
+            for name, p in self.processes.items():
+                if not p.is_alive():
+                    self.latest[name]["running"] = False
+        return dict(self.latest)
+
+    @property
+    def running(self):
+        if self.mode == "thread":
+            return any(a.running for a in self.arenas.values())
+        return any(p.is_alive() for p in self.processes.values())
+
+    def stop(self):
+        if self.mode == "thread":
+            for arena in self.arenas.values():
+                arena.close()
+            return
+        if self._stop_event is not None:
+            self._stop_event.set()
+        for p in self.processes.values():
+            p.join(timeout=10.0)
+            if p.is_alive():
+                print(f"[ARENA] {p.name} did not stop, terminating.")
+                p.terminate()
+        self.poll()
+
+    def run(self, print_status=True):
+        """Starts all arenas and blocks until every session ended (or Ctrl+C)."""
+        self.start()
+        try:
+            while self.running:
+                time.sleep(self.status_period)
+                status = self.poll()
+                if print_status:
+                    for st in status.values():
+                        print(format_status(st))
+        except KeyboardInterrupt:
+            print("\n[ARENA] Interrupted, stopping all arenas.")
+        finally:
+            self.stop()
+        return self.poll()
+
+
+def format_status(st):
+    if "trial" not in st:
+        return f"[ARENA {st['name']}] {'starting' if st.get('running') else 'failed to start'}"
+    target = st.get("trial_target") or "-"
+    phase = st.get("phase") or ("done" if not st.get("running") else "-")
+    return (f"[ARENA {st['name']}] {st['elapsed_s']:7.1f}s | trial {st['trial']}/{target} | "
+            f"{phase:<16} | {st['rate_hz']:6.1f} Hz | drops {st['acq_drops']}/{st['writer_drops']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run several arenas from one host.")
+    parser.add_argument("rigs_file", help="JSON file with an 'arenas' list")
+    parser.add_argument("--processes", action="store_true", help="One process per arena (CPU pinning via 'cpus')")
+    parser.add_argument("--status-hz", type=float, default=1.0, help="Status refresh rate")
+    args = parser.parse_args(argv)
+
+    with open(args.rigs_file, "r") as f:
+        specs = json.load(f)["arenas"]
+    supervisor = ArenaSupervisor(specs, mode="process" if args.processes else "thread",
+                                 status_hz=args.status_hz)
+    final = supervisor.run()
+    print("[ARENA] All sessions finished:")
+    for st in final.values():
+        print(format_status(st))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
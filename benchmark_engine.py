@@ -0,0 +1,270 @@
+# benchmark_engine.py
+"""
+End-to-end benchmark of the acquisition pipeline.
+
+Runs Engine headlessly against emulated boards (arduino_emulator.VirtualArduino)
+and a synthetic camera over a matrix of acquisition rates, sensor counts and
+frame sizes, and reports per case:
+  - achieved sample rate
+  - tick jitter percentiles (deviation of the acquisition tick interval)
+  - end-to-end sample latency (tick start -> sample processed)
+  - acquisition / writer queue drops
+  - CPU time per Engine thread
+  - memory (RSS) growth
+
+Results are written as JSON and can be compared against a stored baseline:
+    python benchmark_engine.py --out results.json
+    python benchmark_engine.py --rates 30,1000 --sensors 2,64 --frames 200x200 --duration 2
+    python benchmark_engine.py --baseline baseline.json --threshold 0.15
+    python benchmark_engine.py --save-baseline baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from collections import deque
+
+import numpy as np
+import serial
+
+import shared_states as S
+from arduino_emulator import VirtualArduino
+from engine import Engine
+from topology import Topology, MAX_PORTS_PER_BOARD
+
+DEFAULT_RATES = [30, 100, 250, 500, 1000]
+DEFAULT_SENSORS = [2, 8, 16, 32, 64]
+DEFAULT_FRAMES = ["200x200", "640x480", "1920x1080"]
+
+# metric name -> True if higher is better
+METRIC_DIRECTIONS = {
+    "achieved_hz": True,
+    "jitter_p50_ms": False,
+    "jitter_p99_ms": False,
+    "latency_p50_ms": False,
+    "latency_p99_ms": False,
+    "acq_drops": False,
+    "writer_drops": False,
+    "cpu_total_s": False,
+    "rss_growth_mb": False,
+}
+
+
+class SyntheticCamera:
+    """Cycles through a few pre-generated noise frames of the given size."""
+    def __init__(self, width, height, n_frames=8, seed=0):
+        rng = np.random.default_rng(seed)
+        self.frames = [rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8) for _ in range(n_frames)]
+        self._i = 0
+
+    def __call__(self):
+        frame = self.frames[self._i]
+        self._i = (self._i + 1) % len(self.frames)
+        return frame
+
+
+def _rss_bytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+def _percentile_ms(values, q):
+    if len(values) == 0:
+        return None
+    return float(np.percentile(np.asarray(values), q) * 1000.0)
+
+def _fmt_ms(value):
+    return "n/a" if value is None else f"{value:.2f} ms"
+
+def _parse_frame_size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def run_case(rate_hz, n_sensors, frame_size, duration=3.0, warmup=0.5, board_cfg=None):
+    """Runs one benchmark case and returns its metrics dict."""
+    # one emulated board per 8 sensors, as on the rig
+    n_boards = max(1, -(-n_sensors // MAX_PORTS_PER_BOARD))
+    device_cfgs = {}
+    for i in range(n_boards):
+        ports = list(range(i * MAX_PORTS_PER_BOARD + 1, min(n_sensors, (i + 1) * MAX_PORTS_PER_BOARD) + 1))
+        device_cfgs[f"bench{i + 1}"] = {"ports": ports, "sensors": ports}
+    topology = Topology(device_cfgs)
+    cfg = dict(board_cfg or {})
+    boards = [VirtualArduino(name=name, num_sensors=len(dc["sensors"]), **cfg)
+              for name, dc in device_cfgs.items()]
+    ports = [b.start() for b in boards]
+
+    saved = {k: getattr(S, k) for k in ("topology", "sensor_mapping", "timestamps", "data_buffers",
+                                       "gui_time_buffers", "gui_plot_buffers", "is_recording",
+                                       "current_session_path")}
+    engine = None
+    try:
+        for name, port in zip(topology.boards, ports):
+            ser = serial.Serial(port, 115200, timeout=1)
+            S.devices.set(name, ser)
+            ser.readline()  # READY
+        S.topology = topology
+        S.sensor_mapping = topology.sensor_mapping()
+        S.timestamps, S.data_buffers = {}, {}
+        S.gui_time_buffers = [deque(maxlen=S.GUI_BUFFER_LEN) for _ in range(topology.n_ports)]
+        S.gui_plot_buffers = [deque(maxlen=S.GUI_BUFFER_LEN) for _ in range(topology.n_ports)]
+        S.is_recording = True
+        S.current_session_path = None
+
+        rows_written = [0]
+        camera = SyntheticCamera(*_parse_frame_size(frame_size))
+        engine = Engine(target_hz=rate_hz, camera=camera, trace=True,
+                        row_sink=lambda rows: rows_written.__setitem__(0, rows_written[0] + len(rows)))
+
+        engine.start()
+        time.sleep(warmup)
+        stats = engine.stats
+        ticks0, processed0 = stats.ticks, stats.processed
+        mark = time.perf_counter()
+        rss0 = _rss_bytes()
+        time.sleep(duration)
+        elapsed = time.perf_counter() - mark
+        processed = stats.processed - processed0
+        ticks = stats.ticks - ticks0
+        rss1 = _rss_bytes()
+        engine.stop()
+
+        tick_times = np.asarray([t for t in stats.tick_times if t >= mark])
+        intervals = np.diff(tick_times) if len(tick_times) > 1 else np.zeros(0)
+        jitter = np.abs(intervals - 1.0 / rate_hz)
+
+        done = dict(stats.done_times)
+        latencies = [done[ts] - t0 for (t0, ts) in stats.sample_times if t0 >= mark and ts in done]
+
+        cpu = dict(stats.thread_cpu)
+        return {
+            "rate_hz": rate_hz,
+            "sensors": n_sensors,
+            "frame": frame_size,
+            "duration_s": elapsed,
+            "ticks": ticks,
+            "achieved_hz": processed / elapsed if elapsed > 0 else 0.0,
+            "jitter_p50_ms": _percentile_ms(jitter, 50),
+            "jitter_p95_ms": _percentile_ms(jitter, 95),
+            "jitter_p99_ms": _percentile_ms(jitter, 99),
+            "jitter_max_ms": float(jitter.max() * 1000.0) if len(jitter) else None,
+            "latency_p50_ms": _percentile_ms(latencies, 50),
+            "latency_p95_ms": _percentile_ms(latencies, 95),
+            "latency_p99_ms": _percentile_ms(latencies, 99),
+            "acq_drops": stats.acq_drops,
+            "writer_drops": stats.writer_drops,
+            "rows_written": rows_written[0],
+            "cpu_s": cpu,
+            "cpu_total_s": float(sum(cpu.values())),
+            "rss_growth_mb": (rss1 - rss0) / 1e6,
+        }
+    finally:
+        if engine is not None:
+            engine.stop()
+        for name in topology.boards:
+            S.devices.close(name)
+        for k, v in saved.items():
+            setattr(S, k, v)
+        for b in boards:
+            b.stop()
+
+
+def run_matrix(rates, sensors, frames, duration=3.0, board_cfg=None):
+    results = []
+    for rate in rates:
+        for n in sensors:
+            for frame in frames:
+                print(f"[BENCH] {rate} Hz, {n} sensors, {frame} ...", flush=True)
+                res = run_case(rate, n, frame, duration=duration, board_cfg=board_cfg)
+                print(f"[BENCH]   {res['achieved_hz']:.1f} Hz achieved, "
+                      f"jitter p99 {_fmt_ms(res['jitter_p99_ms'])}, latency p99 {_fmt_ms(res['latency_p99_ms'])}, "
+                      f"drops {res['acq_drops']}/{res['writer_drops']}, cpu {res['cpu_total_s']:.2f}s")
+                results.append(res)
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "duration_s": duration,
+        },
+        "results": results,
+    }
+
+
+def _case_key(res):
+    return (res["rate_hz"], res["sensors"], res["frame"])
+
+def compare_to_baseline(current, baseline, threshold=0.10):
+    """
+    Returns a list of regressions: metrics that got worse than the baseline by
+    more than `threshold` (relative). Cases missing from the baseline are skipped.
+    """
+    base_by_key = {_case_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    for res in current.get("results", []):
+        base = base_by_key.get(_case_key(res))
+        if base is None:
+            continue
+        for metric, higher_is_better in METRIC_DIRECTIONS.items():
+            new, old = res.get(metric), base.get(metric)
+            if new is None or old is None:
+                continue
+            if higher_is_better:
+                worse = new < old * (1.0 - threshold)
+            else:
+                # absolute floor keeps near-zero metrics (drops, sub-ms jitter) from flapping
+                worse = new > old * (1.0 + threshold) and (new - old) > 1e-3
+            if worse:
+                regressions.append({"case": _case_key(res), "metric": metric, "baseline": old, "current": new})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Engine acquisition pipeline.")
+    parser.add_argument("--rates", default=",".join(map(str, DEFAULT_RATES)))
+    parser.add_argument("--sensors", default=",".join(map(str, DEFAULT_SENSORS)))
+    parser.add_argument("--frames", default=",".join(DEFAULT_FRAMES))
+    parser.add_argument("--duration", type=float, default=3.0, help="Measured seconds per case")
+    parser.add_argument("--latency", type=float, default=0.0, help="Emulated board reply latency (s)")
+    parser.add_argument("--out", help="Write results JSON here")
+    parser.add_argument("--baseline", help="Compare against this results JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative regression threshold")
+    parser.add_argument("--save-baseline", help="Write results JSON as new baseline")
+    args = parser.parse_args(argv)
+
+    results = run_matrix(
+        rates=[int(r) for r in args.rates.split(",")],
+        sensors=[int(n) for n in args.sensors.split(",")],
+        frames=args.frames.split(","),
+        duration=args.duration,
+        board_cfg={"latency": args.latency},
+    )
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=4)
+            print(f"[BENCH] Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        if regressions:
+            for r in regressions:
+                print(f"[BENCH] REGRESSION {r['case']} {r['metric']}: {r['baseline']:.4g} -> {r['current']:.4g}")
+            return 1
+        print(f"[BENCH] No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
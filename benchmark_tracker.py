@@ -0,0 +1,125 @@
+# benchmark_tracker.py
+"""
+Benchmark of position_tracker.PositionTracker on synthetic video.
+
+A dark elliptical "animal" moves over a textured, noisy arena floor (with
+pauses) and the tracker runs on every frame in this thread. Reported per
+frame size: per-frame time percentiles, CPU-bound frame rate, whether the
+camera rate is sustained on one core, detection rate and position error
+against the ground truth.
+
+    python benchmark_tracker.py
+    python benchmark_tracker.py --sizes 640x480,1920x1080 --frames 600 --scale 0.25 --fps 60
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from position_tracker import PositionTracker
+
+DEFAULT_SIZES = ["640x480", "1280x720", "1920x1080"]
+
+
+class SyntheticArenaVideo:
+    """Yields (frame, (x_px, y_px)) for a moving dark ellipse on a noisy floor."""
+    def __init__(self, width, height, n_noise=8, seed=0):
+        rng = np.random.default_rng(seed)
+        self.w, self.h = width, height
+        self.floor = rng.integers(140, 200, size=(height, width, 3), dtype=np.uint8)
+        self.noise = [rng.integers(-6, 7, size=(height, width, 1), dtype=np.int16) for _ in range(n_noise)]
+        self.radius = (max(4, width // 22), max(3, height // 28))
+        self.rng = rng
+
+    def frames(self, n):
+        w, h = self.w, self.h
+        rx, ry = self.radius
+        x, y = w * 0.3, h * 0.5
+        heading = 0.0
+        speed = w / 250.0
+        for i in range(n):
+            # random walk with occasional pauses, reflected at the walls
+            if self.rng.random() < 0.01:
+                speed = 0.0 if speed else w / 250.0
+            heading += self.rng.normal(0.0, 0.15)
+            x += speed * np.cos(heading)
+            y += speed * np.sin(heading)
+            if not rx <= x <= w - rx:
+                heading = np.pi - heading
+                x = min(max(x, rx), w - rx)
+            if not ry <= y <= h - ry:
+                heading = -heading
+                y = min(max(y, ry), h - ry)
+
+            frame = np.clip(self.floor + self.noise[i % len(self.noise)], 0, 255).astype(np.uint8)
+            x0, x1 = max(0, int(x - rx)), min(w, int(x + rx) + 1)
+            y0, y1 = max(0, int(y - ry)), min(h, int(y + ry) + 1)
+            yy, xx = np.mgrid[y0:y1, x0:x1]
+            body = ((xx - x) / rx) ** 2 + ((yy - y) / ry) ** 2 <= 1.0
+            frame[y0:y1, x0:x1][body] = 35
+            yield frame, (x, y)
+
+
+def run_case(frame_size, n_frames=600, scale=0.25, fps=60.0):
+    w, h = (int(v) for v in frame_size.lower().split("x"))
+    video = SyntheticArenaVideo(w, h)
+    tracker = PositionTracker(scale=scale)
+    times, errors, confidences = [], [], []
+    detected = 0
+    cpu0 = time.thread_time()
+    for frame, (gx, gy) in video.frames(n_frames):
+        t0 = time.perf_counter()
+        pos = tracker.update(frame)
+        times.append(time.perf_counter() - t0)
+        if tracker.background is None:
+            continue  # warm-up
+        if pos is not None:
+            detected += 1
+            errors.append(float(np.hypot(pos[0] * w - gx, pos[1] * h - gy)))
+            confidences.append(pos[2])
+    cpu = time.thread_time() - cpu0
+    tracked = len(times) - tracker.warmup_frames * tracker.warmup_stride
+    t = np.asarray(times) * 1000.0
+    p99 = float(np.percentile(t, 99))
+    return {
+        "frame": frame_size,
+        "scale": scale,
+        "frames": n_frames,
+        "time_p50_ms": float(np.percentile(t, 50)),
+        "time_p99_ms": p99,
+        "max_fps": 1000.0 / float(np.mean(t)),
+        "cpu_per_frame_ms": 1000.0 * cpu / n_frames,
+        "sustains_fps": p99 < 1000.0 / fps,
+        "detection_rate": detected / tracked if tracked > 0 else 0.0,
+        "error_mean_px": float(np.mean(errors)) if errors else None,
+        "error_p95_px": float(np.percentile(errors, 95)) if errors else None,
+        "confidence_mean": float(np.mean(confidences)) if confidences else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CPU position tracker on synthetic video.")
+    parser.add_argument("--sizes", default=",".join(DEFAULT_SIZES))
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--scale", type=float, default=0.25)
+    parser.add_argument("--fps", type=float, default=60.0, help="Camera rate that must be sustained")
+    parser.add_argument("--out", help="Write results JSON here")
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes.split(","):
+        res = run_case(size, n_frames=args.frames, scale=args.scale, fps=args.fps)
+        err = "n/a" if res["error_mean_px"] is None else f"{res['error_mean_px']:.1f}px"
+        print(f"[BENCH] {size} @ scale {args.scale}: p50 {res['time_p50_ms']:.2f} ms, p99 {res['time_p99_ms']:.2f} ms "
+              f"({res['max_fps']:.0f} fps max, {'OK' if res['sustains_fps'] else 'TOO SLOW'} for {args.fps:g} fps), "
+              f"detected {res['detection_rate']:.0%}, error {err}")
+        results.append(res)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"[BENCH] Results written to {args.out}")
+    return 0 if all(r["sustains_fps"] for r in results) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
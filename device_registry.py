@@ -0,0 +1,255 @@
+# device_registry.py
+# Serial devices defined in Config/arena.json, opened on first use.
+# pyserial itself is only imported when the first port is opened.
+import json
+import os
+import threading
+import time
+
+from logging_setup import get_logger
+from serial_dispatcher import BoardDispatcher, BoardReader, ACK_TIMEOUT, ACK_RETRIES
+
+log = get_logger("devices")
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Config", "arena.json")
+
+
+def load_arena_config(path=None):
+    """Loads the arena config (MULTIPORT_CONFIG overrides the default path)."""
+    path = path or os.environ.get("MULTIPORT_CONFIG", DEFAULT_CONFIG_PATH)
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        log.warning("[WARNING] Arena config not found: %s", path)
+        return {}
+
+
+class DeviceRegistry:
+    """
+    Lazily opened serial devices keyed by name ('ser1', 'ser2', ...).
+
+    get() opens a device on first access and caches it; a port that failed to
+    open returns None until reopen() is called, so hot paths never retry.
+    The port of a device can be overridden with MULTIPORT_<NAME>_PORT.
+    """
+    def __init__(self, device_cfgs):
+        self.configs = {}
+        for name, cfg in (device_cfgs or {}).items():
+            cfg = dict(cfg)
+            cfg["port"] = os.environ.get(f"MULTIPORT_{name.upper()}_PORT", cfg.get("port"))
+            self.configs[name] = cfg
+        self._devices = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+        self.ready = {}                    # name -> READY received
+        self.timings = {}                  # name -> seconds until READY (or timeout)
+        self.handshake_done = threading.Event()
+        # bulk output state ('B' command, see hardware.set_outputs): name -> (led_mask, relay_mask)
+        self.output_masks = {}             # last masks the host asked for
+        self.acked_masks = {}              # last masks the board acknowledged
+        self._dispatchers = {}             # name -> BoardDispatcher (writer thread, started on first use)
+        self._readers = {}                 # name -> BoardReader (reader thread, started with the writer)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("devices", {}))
+
+    @property
+    def names(self):
+        return list(self.configs.keys())
+
+    def get(self, name):
+        dev = self._devices.get(name)
+        if dev is not None or name in self._failed:
+            return dev
+        with self._lock:
+            if name in self._devices or name in self._failed:
+                return self._devices.get(name)
+            return self._open(name)
+
+    def set(self, name, device):
+        """Installs an already opened device (e.g. a port to an emulator)."""
+        self._stop_dispatcher(name)
+        with self._lock:
+            self._devices[name] = device
+            self._failed.discard(name)
+
+    def name_of(self, device):
+        for name, dev in self._devices.items():
+            if dev is device:
+                return name
+        return None
+
+    # ---- I/O (one writer and one reader thread per device, see serial_dispatcher.py) ----
+    def _dispatcher(self, name):
+        disp = self._dispatchers.get(name)
+        if disp is None:
+            dev = self.get(name)
+            if dev is None:
+                return None
+            with self._lock:
+                disp = self._dispatchers.get(name)
+                if disp is None:
+                    cfg = self.configs.get(name, {})
+                    disp = BoardDispatcher(name, dev, cfg.get("ack_timeout", ACK_TIMEOUT),
+                                           cfg.get("ack_retries", ACK_RETRIES))
+                    self._readers[name] = BoardReader(name, dev, disp)
+                    self._dispatchers[name] = disp
+        return disp
+
+    def submit(self, name, data, on_ack=None):
+        """
+        Queues raw bytes for a device; False if the device is not available.
+        on_ack(t) runs on the reader thread once the board acknowledged the command.
+        """
+        disp = self._dispatcher(name)
+        if disp is None:
+            return False
+        disp.submit(data, on_ack=on_ack)
+        return True
+
+    def read_sensor_line(self, name):
+        """Next sensor reply of a device ('' on timeout or if the device is not available)."""
+        if self._dispatcher(name) is None:
+            return ""
+        return self._readers[name].read_line(self.configs.get(name, {}).get("timeout", 1))
+
+    def discard_sensor_lines(self, name):
+        reader = self._readers.get(name)
+        if reader is not None:
+            reader.discard_lines()
+
+    def wait_acked(self, timeout=1.0):
+        """Waits until every command written so far was acknowledged (or given up)."""
+        return all(d.wait_acked(timeout) for d in list(self._dispatchers.values()))
+
+    def flush(self, timeout=1.0):
+        """Waits until all queued writes went out."""
+        return all(d.flush(timeout) for d in list(self._dispatchers.values()))
+
+    def dispatch_stats(self):
+        """{name: {class: queueing delay, round-trip and retry stats}}"""
+        return {name: d.stats_dict() for name, d in list(self._dispatchers.items())}
+
+    def _stop_dispatcher(self, name):
+        """Stops the writer; the reader ends once the device is closed (see close())."""
+        with self._lock:
+            disp = self._dispatchers.pop(name, None)
+            reader = self._readers.pop(name, None)
+        if disp is not None:
+            disp.stop()
+        if reader is not None:
+            reader.stop()
+        return reader
+
+    def is_open(self, name):
+        return self._devices.get(name) is not None
+
+    def _open(self, name):
+        import serial
+        cfg = self.configs[name]
+        try:
+            dev = serial.Serial(cfg["port"], cfg.get("baudrate", 115200), timeout=cfg.get("timeout", 1))
+        except (serial.SerialException, OSError) as e:
+            log.warning("[WARNING] Could not open %s (%s): %s", name, cfg["port"], e)
+            self._failed.add(name)
+            return None
+        self._devices[name] = dev
+        return dev
+
+    def reopen(self, name):
+        self.close(name)
+        with self._lock:
+            self._failed.discard(name)
+        return self.get(name)
+
+    def close(self, name):
+        reader = self._stop_dispatcher(name)
+        with self._lock:
+            dev = self._devices.pop(name, None)
+            self.output_masks.pop(name, None)
+            self.acked_masks.pop(name, None)
+        if dev is not None:
+            try:
+                dev.close()
+            except Exception:
+                pass
+        if reader is not None:
+            reader.join()
+
+    def close_all(self):
+        for name in list(self._devices.keys()):
+            self.close(name)
+
+    # ---- READY handshake ----
+    def _handshake(self, name, timeout):
+        t0 = time.perf_counter()
+        ready = False
+        dev = self.get(name)
+        reader = self._readers.get(name)
+        if reader is not None:
+            # the reader thread owns the port already
+            ready = reader.ready.wait(timeout)
+        elif dev is not None:
+            # the board resets when the port opens and prints READY once booted
+            while time.perf_counter() - t0 < timeout:
+                try:
+                    line = dev.readline().decode("utf-8", errors="replace").strip()
+                except Exception as e:
+                    log.error("[ERROR] Handshake read failed on %s: %s", name, e)
+                    break
+                if line == "READY":
+                    ready = True
+                    break
+        self.ready[name] = ready
+        self.timings[name] = time.perf_counter() - t0
+        if ready:
+            log.info("[INFO] %s is ready (%.0f ms).", dev.port, 1000 * self.timings[name])
+        elif dev is not None:
+            log.error("[ERROR] %s did not send READY signal.", dev.port)
+
+    def handshake_all(self, timeout=5.0):
+        """Opens every device and waits for READY on all of them in parallel."""
+        self.handshake_done.clear()
+        threads = [threading.Thread(target=self._handshake, args=(name, timeout),
+                                    name=f"Handshake-{name}", daemon=True)
+                   for name in self.names]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.handshake_done.set()
+        return dict(self.ready)
+
+    def handshake_all_async(self, timeout=5.0):
+        """Runs handshake_all in the background; wait on handshake_done."""
+        self.handshake_done.clear()
+        t = threading.Thread(target=self.handshake_all, args=(timeout,), name="DeviceHandshake", daemon=True)
+        t.start()
+        return t
+
+
+class RecordingDeviceRegistry(DeviceRegistry):
+    """
+    Stands in for the serial devices where nothing may reach the hardware
+    (session replay): no port is ever opened, commands are kept in `sent` and
+    acknowledged at once, stamped with `clock` (default perf_counter).
+    """
+    def __init__(self, clock=None):
+        super().__init__({})
+        self.clock = clock or time.perf_counter
+        self.sent = []                     # (clock time, name, bytes) of every command
+
+    def get(self, name):
+        return None
+
+    def submit(self, name, data, on_ack=None):
+        t = self.clock()
+        self.sent.append((t, name, bytes(data)))
+        if on_ack is not None:
+            on_ack(t)
+        return True
+
+    def read_sensor_line(self, name):
+        return ""
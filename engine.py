@@ -1,15 +1,81 @@
 # engine.py
-import threading, time, os, queue, cv2
+import threading, time, os, queue
 from collections import deque
-import shared_states as S
-from shared_states import camera_lock, last_camera_frame
-from utils import clean_serial_line, parse_sensor_line, get_camera_frame
+import shared_states
+from hardware import read_sensor_lines, get_camera_frame
+from logging_setup import get_logger
+from recording_policy import FrameRecorder
+from history_pyramid import HistoryPyramid
+
+class EngineStats:
+    """
+    Counters and timing logs filled by the Engine threads.
+    Timing logs are bounded deques and only recorded when trace=True.
+    """
+    def __init__(self, trace=False, maxlen=200000):
+        self.trace = trace
+        self.ticks = 0
+        self.processed = 0
+        self.acq_drops = 0
+        self.writer_drops = 0
+        self.tick_times = deque(maxlen=maxlen)     # acquisition tick start (perf_counter)
+        self.sample_times = deque(maxlen=maxlen)   # (tick start, sample tstamp)
+        self.done_times = deque(maxlen=maxlen)     # (sample tstamp, processing done)
+        self.thread_cpu = {}                       # thread name -> CPU seconds at exit
 
 class Engine:
-    def __init__(self, target_hz=30):
+    def __init__(self, target_hz=30, source=None, row_sink=None, camera=None, trace=False, state=None,
+                 tracker=None, pose=None, recorder=None):
+        """
+        source:   optional acquisition source replacing the live camera/serial
+                  reads (e.g. session_replay.ReplaySource). Must provide
+                  read() -> (t, frame, [(ts, vals) per board]) or None
+                  once exhausted (boards in state.topology.boards order). Sources with self_paced=True handle their
+                  own timing, sources with lossless=True never drop packets.
+        row_sink: optional callable receiving flushed CSV row batches instead
+                  of state.csv_writer.
+        camera:   optional callable returning the next frame (default: hardware.get_camera_frame).
+        trace:    record per-tick timing logs in self.stats (benchmarks).
+        state:    object holding the buffers, flags and devices this Engine
+                  uses (default: the shared_states module; one
+                  arena.ArenaState per arena when several run side by side).
+        tracker:  optional position_tracker.PositionTracker run on every frame;
+                  positions go to state.position_stream and, while recording,
+                  to pose_estimation.csv.
+        pose:     optional pose_inference.PoseProvider fed with every frame.
+                  Its keypoints (not the tracker's) are written to
+                  pose_estimation.csv; without a tracker, keypoint 1 also
+                  feeds state.position_stream. Stopped with the Engine.
+        recorder: optional recording_policy.FrameRecorder deciding which
+                  frames are written (default: from the arena config's
+                  "recording" section). Published as state.frame_recorder
+                  so the TrialController can trigger event windows.
+
+        An Engine may run before the recording starts (armed): data then
+        only goes to the memory buffers, and the last recorder.pre_roll_s
+        seconds of rows and frames are written once state.is_recording
+        turns True.
+        """
+        self.state = state if state is not None else shared_states
+        self.logger = get_logger("engine", self.state)
         self.frame_period = 1.0 / float(target_hz)
+        self.source = source
+        self.self_paced = bool(getattr(source, "self_paced", False))
+        self.lossless = bool(getattr(source, "lossless", False))
+        self.row_sink = row_sink
+        self.camera = camera or get_camera_frame
+        self.tracker = tracker
+        self.pose = pose
+        if pose is not None:
+            pose.on_result = self._on_pose
+        self.recorder = recorder or FrameRecorder.from_config(getattr(self.state, "arena_config", None))
+        self.state.frame_recorder = self.recorder
+        self.pre_roll_s = self.recorder.pre_roll_s
+        self.pre_roll = deque()                    # (t, writer entry) held while not recording
+        self.stats = EngineStats(trace=trace)
         self.running = threading.Event()
-        self.acq_q = queue.Queue(maxsize=256)      # (t, frame, ser_vals1, ser_vals2)
+        self.source_exhausted = threading.Event()
+        self.acq_q = queue.Queue(maxsize=256)      # (t, frame, [(ts, vals) per board])
         self.writer_q = queue.Queue(maxsize=1024)  # rows / frames to persist
         self.threads = []
 
@@ -25,6 +91,10 @@ class Engine:
         for t in self.threads:
             t.join(timeout=2.0)
         self.threads.clear()
+        if self.pose is not None:
+            self.pose.stop()
+        if self.recorder.frames_seen:
+            self.logger.info("%s", self.recorder.format_summary())
 
     # ---------- Threads ----------
     def _start_threads(self):
@@ -34,38 +104,73 @@ class Engine:
         self.threads.extend([t1, t2, t3])
         for t in self.threads: t.start()
 
+    def wait_until_drained(self, timeout=None):
+        """Block until the source is exhausted and all queued packets were processed."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not (self.source_exhausted.is_set() and self.acq_q.unfinished_tasks == 0):
+            if deadline is not None and time.perf_counter() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def flush_writer(self, timeout=2.0):
+        """Block until the writer has written everything queued so far (the CSVs can then be closed)."""
+        if not self.running.is_set():
+            return True
+        done = threading.Event()
+        self.writer_q.put(("flush", done))
+        return done.wait(timeout)
+
     def _acquisition_loop(self):
+        S = self.state
+        stats = self.stats
         next_tick = time.perf_counter()
         while self.running.is_set():
             now = time.perf_counter()
-            if now < next_tick:
-                time.sleep(next_tick - now)
-                continue
-            next_tick += self.frame_period
+            if not self.self_paced:
+                if now < next_tick:
+                    time.sleep(next_tick - now)
+                    continue
+                next_tick += self.frame_period
 
-            # --- Camera (non-blocking) ---
-            frame = get_camera_frame()
+            item = self._read_live() if self.source is None else self.source.read()
+            if item is None:
+                self.source_exhausted.set()
+                break
+            stats.ticks += 1
+            if stats.trace:
+                stats.tick_times.append(now)
+                stats.sample_times.append((now, item[0]))
 
+            frame = item[1]
             # Store latest camera frame in shared state
             if frame is not None:
-                with camera_lock:
+                with S.camera_lock:
                     S.last_camera_frame = frame.copy()
-            
-            # --- Sensor data request ---
-            if S.ser1: S.ser1.write(b's')
-            if S.ser2: S.ser2.write(b's')
-
-            line1 = clean_serial_line(S.ser1.readline().decode('utf-8')) if S.ser1 else ""
-            line2 = clean_serial_line(S.ser2.readline().decode('utf-8')) if S.ser2 else ""
-            ts1, vals1 = parse_sensor_line(line1)
-            ts2, vals2 = parse_sensor_line(line2)
-
-            tstamp = time.perf_counter()
-            item = (tstamp, frame, (ts1, vals1), (ts2, vals2))
-            try:
-                self.acq_q.put_nowait(item)
-            except queue.Full:
-                pass
+
+            if self.lossless:
+                while self.running.is_set():
+                    try:
+                        self.acq_q.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+            else:
+                try:
+                    self.acq_q.put_nowait(item)
+                except queue.Full:
+                    stats.acq_drops += 1
+        stats.thread_cpu["AcqThread"] = time.thread_time()
+
+    def _read_live(self):
+        # --- Camera (non-blocking) ---
+        frame = self.camera()
+
+        # --- Sensor data request (all boards in parallel) ---
+        readings = read_sensor_lines(self.state)
+
+        tstamp = time.perf_counter()
+        return (tstamp, frame, readings)
 
     def _processing_loop(self):
         """
@@ -74,95 +179,180 @@ class Engine:
           - downsampled GUI buffers
           - disk batches (writer_q)
         """
-        # local helpers for GUI-thin buffers
-        # deques for last ~2s at 10Hz: 20 pts
-        gui_len = 200  # points per sensor for GUI (tune)
-        if not hasattr(S, "gui_plot_buffers"):
-            S.gui_plot_buffers = [deque(maxlen=gui_len) for _ in range(16)]
-            S.gui_time_buffers = [deque(maxlen=gui_len) for _ in range(16)]
+        S = self.state
+        topology = S.topology
+        n_cols = topology.n_ports
+
+        # GUI buffers: every GUI_PUSH_PERIOD bucket of full-rate samples becomes
+        # its min and max point (in time order), so short lick peaks always show
+        # and the buffers cover a fixed time span at any acquisition rate
+        gui_push_period = S.GUI_PUSH_PERIOD
+        buckets = {}    # sensor_id -> [t of min, min, t of max, max]
+        # whole-session history per sensor (zoomable plots), filled once per bucket
+        history = S.sensor_history = {}
+
+        # per board: [(column, timestamps deque, data deque, bucket, history appends)] in reply order
+        routes = []
+        for columns in topology.sensor_columns:
+            board_route = []
+            for sensor_id in columns:
+                if sensor_id not in S.timestamps:
+                    S.timestamps[sensor_id] = deque(maxlen=S.MAX_POINTS)
+                    S.data_buffers[sensor_id] = deque(maxlen=S.MAX_POINTS)
+                buckets[sensor_id] = [None, float("inf"), None, float("-inf")]
+                history[sensor_id] = pyramid = HistoryPyramid()
+                board_route.append((sensor_id, S.timestamps[sensor_id], S.data_buffers[sensor_id],
+                                    buckets[sensor_id], pyramid.pending_t.append, pyramid.pending_v.append))
+            routes.append(board_route)
+        bucket_start = None
+
+        tracker = self.tracker
+        pose = self.pose
+        recorder = self.recorder
 
-        # downsample accumulation
-        last_gui_push = 0.0
-        gui_push_period = 0.1  # 10 Hz to GUI
+        was_recording = False
+        pre_roll = self.pre_roll_s > 0.0
 
         while self.running.is_set():
             try:
-                tstamp, frame, s1, s2 = self.acq_q.get(timeout=0.1)
+                tstamp, frame, readings = self.acq_q.get(timeout=0.1)
             except queue.Empty:
                 continue
 
-            (ts1, vals1) = s1
-            (ts2, vals2) = s2
-
             # --- Update ring buffers for full-resolution data (acq rate) ---
-            # Use your mapping; keep existing MAX_POINTS
-            if ts1 and vals1:
-                for i, val in enumerate(vals1):
-                    sensor_id = S.sensor_mapping["ser1"][i] - 1
-                    # initialize buffers if missing
-                    if sensor_id not in S.timestamps:
-                        S.timestamps[sensor_id] = deque(maxlen=S.MAX_POINTS)
-                        S.data_buffers[sensor_id] = deque(maxlen=S.MAX_POINTS)
-                        S.gui_time_buffers[sensor_id] = deque(maxlen=200)
-                        S.gui_plot_buffers[sensor_id] = deque(maxlen=200)
-                    
-                    S.timestamps[sensor_id].append(tstamp)
-                    S.data_buffers[sensor_id].append(val)
-            if ts2 and vals2:
-                for i, val in enumerate(vals2):
-                    sensor_id = S.sensor_mapping["ser2"][i] - 1
-                    # initialize buffers if missing
-                    if sensor_id not in S.timestamps:
-                        S.timestamps[sensor_id] = deque(maxlen=S.MAX_POINTS)
-                        S.data_buffers[sensor_id] = deque(maxlen=S.MAX_POINTS)
-                        S.gui_time_buffers[sensor_id] = deque(maxlen=200)
-                        S.gui_plot_buffers[sensor_id] = deque(maxlen=200)
-                    
-                    S.timestamps[sensor_id].append(tstamp)
-                    S.data_buffers[sensor_id].append(val)
-
-            # --- Prepare disk rows if recording ---
-            if S.is_recording:
-                # combine 16 values (fill zeros if missing)
-                combined = [0]*16
-                if vals1:
-                    for i, v in enumerate(vals1):
-                        if i < 8: combined[i] = v
-                if vals2:
-                    for i, v in enumerate(vals2):
-                        idx = i + 8
-                        if idx < 16: combined[idx] = v
-                self._enqueue_csv_row((tstamp, combined))
-
-                if S.current_session_path and frame is not None:
-                    self._enqueue_frame((tstamp, frame))
-            # --- Build thin GUI buffers at ~10 Hz ---
-            now = time.perf_counter()
-            if now - last_gui_push >= gui_push_period:
-                last_gui_push = now
-                for sensor_id in S.timestamps.keys():
-                    if S.timestamps[sensor_id]:
-                        S.gui_time_buffers[sensor_id].append(S.timestamps[sensor_id][-1])
-                        S.gui_plot_buffers[sensor_id].append(S.data_buffers[sensor_id][-1])
+            recording = S.is_recording
+            if recording != was_recording:
+                was_recording = recording
+                if recording:
+                    self._begin_recording(tstamp)
+                else:
+                    recorder.clear()
+                    self.pre_roll.clear()
+            keep = recording or pre_roll
+            combined = [0] * n_cols if keep else None
+            for board_route, (ts, vals) in zip(routes, readings):
+                if not (ts and vals):
+                    continue
+                for (sensor_id, t_buf, d_buf, bucket, hist_t, hist_v), val in zip(board_route, vals):
+                    t_buf.append(tstamp)
+                    d_buf.append(val)
+                    hist_t(tstamp)
+                    hist_v(val)
+                    if val < bucket[1]:
+                        bucket[0] = tstamp
+                        bucket[1] = val
+                    if val > bucket[3]:
+                        bucket[2] = tstamp
+                        bucket[3] = val
+                    if keep:
+                        combined[sensor_id] = val
 
-            # TODO: DLC live processing + trial controller could go here,
-            # using the same tstamp for synchronization.
+            # --- Prepare disk rows if recording (or held for the pre-roll) ---
+            if keep:
+                # one column per port (zeros where a port has no sensor)
+                self._persist(tstamp, ("csv", (tstamp, combined)), recording)
+            if S.current_session_path and frame is not None:
+                if recording:
+                    for item in recorder.add(tstamp, frame):
+                        self._enqueue_frame(item)
+                else:
+                    recorder.hold(tstamp, frame)
 
-    def _enqueue_csv_row(self, row):
+            # --- Animal position (same tstamp as the sensor row) ---
+            if tracker is not None and frame is not None:
+                pos = tracker.update(frame)
+                if pos is not None:
+                    S.position_stream.push(tstamp, *pos)
+                    if keep and pose is None:
+                        self._persist(tstamp, ("pose", (tstamp, *pos)), recording)
+
+            # --- Pose inference (results arrive in _on_pose) ---
+            if pose is not None and frame is not None:
+                pose.submit(tstamp, frame)
+            # --- Min/max GUI points once per GUI_PUSH_PERIOD of samples ---
+            if bucket_start is None:
+                bucket_start = tstamp
+            elif tstamp - bucket_start >= gui_push_period:
+                bucket_start = tstamp
+                for sensor_id, bucket in buckets.items():
+                    self._push_gui_bucket(S.gui_time_buffers[sensor_id], S.gui_plot_buffers[sensor_id], bucket)
+                    history[sensor_id].flush()
+
+            self.stats.processed += 1
+            if self.stats.trace:
+                self.stats.done_times.append((tstamp, time.perf_counter()))
+            self.acq_q.task_done()
+        self.stats.thread_cpu["ProcThread"] = time.thread_time()
+
+    @staticmethod
+    def _push_gui_bucket(t_buf, v_buf, bucket):
+        t_min, v_min, t_max, v_max = bucket
+        if t_min is None:
+            return
+        if t_max < t_min:
+            t_min, v_min, t_max, v_max = t_max, v_max, t_min, v_min
+        t_buf.append(t_min)
+        v_buf.append(v_min)
+        t_buf.append(t_max)
+        v_buf.append(v_max)
+        bucket[:] = (None, float("inf"), None, float("-inf"))
+
+    def _on_pose(self, t, keypoints):
+        # called from the PoseProvider result thread with the frame's tstamp
+        S = self.state
+        if self.tracker is None:
+            S.position_stream.push(t, *keypoints[0])
+        recording = S.is_recording
+        if recording or self.pre_roll_s > 0.0:
+            self._persist(t, ("pose", (t, *keypoints.ravel().tolist())), recording)
+
+    def _persist(self, t, entry, recording):
+        """Queues a writer entry, or holds it for the pre-roll while not recording."""
+        if recording:
+            self._enqueue_writer(entry)
+            return
+        pre_roll = self.pre_roll
+        pre_roll.append((t, entry))
         try:
-            self.writer_q.put_nowait(("csv", row))
-        except queue.Full:
-            pass
+            while pre_roll[0][0] < t - self.pre_roll_s:
+                pre_roll.popleft()
+        except IndexError:
+            pass    # emptied by the other producer (pose results)
+
+    def _begin_recording(self, t):
+        """Writes the held pre-roll (rows and frames of the last pre_roll_s seconds before t)."""
+        start = t - self.pre_roll_s
+        held = [entry for ti, entry in list(self.pre_roll) if ti >= start]
+        self.pre_roll.clear()
+        for entry in held:
+            self._enqueue_writer(entry)
+        frames = self.recorder.begin(t) if self.state.current_session_path else []
+        for item in frames:
+            self._enqueue_frame(item)
+        if held or frames:
+            self.logger.info("[ENGINE] Recording started with %.2f s pre-roll (%d rows, %d frames).",
+                     self.pre_roll_s, len(held), len(frames))
+
+    def _enqueue_csv_row(self, row):
+        self._enqueue_writer(("csv", row))
 
     def _enqueue_frame(self, frame_tuple):
+        self._enqueue_writer(("frame", frame_tuple))
+
+    def _enqueue_writer(self, entry):
+        if self.lossless:
+            self.writer_q.put(entry)
+            return
         try:
-            self.writer_q.put_nowait(("frame", frame_tuple))
+            self.writer_q.put_nowait(entry)
         except queue.Full:
-            pass
+            self.stats.writer_drops += 1
 
     def _writer_loop(self):
+        S = self.state
         # flush in batches
         batch_rows = []
+        pose_rows = []
         last_flush = time.perf_counter()
         FLUSH_PERIOD = 1.0
 
@@ -171,9 +361,11 @@ class Engine:
                 kind, payload = self.writer_q.get(timeout=0.1)
             except queue.Empty:
                 # periodic flush
-                if batch_rows and (time.perf_counter() - last_flush) > FLUSH_PERIOD:
+                if (batch_rows or pose_rows) and (time.perf_counter() - last_flush) > FLUSH_PERIOD:
                     self._flush_csv(batch_rows)
+                    self._flush_pose(pose_rows)
                     batch_rows.clear()
+                    pose_rows.clear()
                     last_flush = time.perf_counter()
                 continue
 
@@ -184,23 +376,55 @@ class Engine:
                     batch_rows.clear()
                     last_flush = time.perf_counter()
 
+            elif kind == "pose":
+                pose_rows.append(payload)
+                if len(pose_rows) >= S.CSV_FLUSH_EVERY_N:
+                    self._flush_pose(pose_rows)
+                    pose_rows.clear()
+
+            elif kind == "flush":
+                self._flush_csv(batch_rows)
+                self._flush_pose(pose_rows)
+                batch_rows.clear()
+                pose_rows.clear()
+                last_flush = time.perf_counter()
+                payload.set()
+
             elif kind == "frame":
                 tstamp, frame = payload
                 # write JPEG
                 if S.current_session_path:
+                    import cv2  # deferred: only needed once frames are persisted
                     path = os.path.join(S.current_session_path, "frames", f"frame_{int(tstamp*1000)}.jpg")
                     try: cv2.imwrite(path, frame)
-                    except Exception as e: print(f"[WRITER] frame save error: {e}")
+                    except Exception as e: self.logger.error("[WRITER] frame save error: %s", e)
 
         # final flush
         if batch_rows:
             self._flush_csv(batch_rows)
+        if pose_rows:
+            self._flush_pose(pose_rows)
+        self.stats.thread_cpu["WriterThread"] = time.thread_time()
 
     def _flush_csv(self, rows):
+        S = self.state
+        if self.row_sink is not None:
+            if rows: self.row_sink(list(rows))
+            return
         if not S.csv_writer or not rows: return
         try:
-            # rows: list of (tstamp, [v1..v16])
+            # rows: list of (tstamp, [v1..vN])
             S.csv_writer.writerows([[rt, *vals] for (rt, vals) in rows])
             S.csv_file.flush()
         except Exception as e:
-            print(f"[WRITER] csv flush error: {e}")
+            self.logger.error("[WRITER] csv flush error: %s", e)
+
+    def _flush_pose(self, rows):
+        S = self.state
+        if not S.pose_csv_writer or not rows: return
+        try:
+            # rows: list of (tstamp, x1, y1, likelihood1, ...)
+            S.pose_csv_writer.writerows(rows)
+            S.pose_csv_file.flush()
+        except Exception as e:
+            self.logger.error("[WRITER] pose flush error: %s", e)
@@ -1,18 +1,20 @@
 import dearpygui.dearpygui as dpg
 from engine import Engine
 import threading
+import time
 
 from shared_states import (
     label_table, buttons_lickports1, buttons_lickports2, buttons_trials,
-    ser1, ser2, trial_labels
+    trial_labels
 )
 
 import shared_states
 
 from utils import (
     toggle_lickport_button, shift_data_window, get_screen_dimensions,
-    setup_fonts, setup_button_theme, toggle_trial_button, set_led, send_serial_command
+    setup_fonts, setup_button_theme, toggle_trial_button
 )
+from hardware import set_led, send_serial_command
 
 from mouse_folder_creator import (
     mouse_file_selected, save_mouse_file_dialog_callback, create_mouse_file,
@@ -24,44 +26,94 @@ from protocol_designer import (
     protocol_selected, cancel_protocol_overwrite
 )
 
-from plot_window import start_plot_window
+from protocol_compiler import OUTPUT_EVENTS
+from output_scheduler import get_output_scheduler
+from profiler import get_profiler
+from session_files import open_sensor_csv, close_sensor_csv, open_pose_csv, close_pose_csv
+from position_tracker import PositionTracker
+from pose_inference import PoseProvider
+
+_arm_lock = threading.Lock()
+
+def arm_recording():
+    """
+    Armed state: starts the Engine and the plot window as soon as a mouse file
+    and a protocol are selected. Acquisition then runs into memory only, so
+    starting the recording just switches persistence on (with the configured
+    pre-roll, see recording_policy.py).
+    """
+    with _arm_lock:
+        # boards are opened in the background at startup; give a late handshake a moment
+        if not shared_states.devices.handshake_done.wait(timeout=5.0):
+            print("[WARNING] Device handshake still running, starting anyway.")
+        if shared_states.engine_instance is None:
+            shared_states.engine_instance = Engine(target_hz=30, tracker=PositionTracker(),
+                                                   pose=PoseProvider.from_config(shared_states.arena_config))
+            shared_states.engine_instance.start()
+            print("[GUI] Engine started (armed)")
+
+        # Start plot thread if not running
+        if shared_states.plot_thread is None or not shared_states.plot_thread.is_alive():
+            # Ensure any previous stop event is cleared
+            try:
+                if getattr(shared_states, "plot_stop_event", None):
+                    shared_states.plot_stop_event.clear()
+            except Exception:
+                pass
+
+            # deferred: pulls in cv2, pyqtgraph and Qt
+            from plot_window import start_plot_window
+            shared_states.plot_thread = threading.Thread(target=lambda: start_plot_window(update_hz=30), daemon=False)
+            shared_states.plot_thread.start()
+            print("[GUI] Plot thread started")
+
+def arm_recording_async():
+    """arm_recording() off the GUI thread (it may wait for the device handshake)."""
+    if not shared_states.is_recording:
+        threading.Thread(target=arm_recording, name="ArmRecording", daemon=True).start()
 
 def start_recording_callback():
-    if shared_states.engine_instance is None:
-        shared_states.engine_instance = Engine(target_hz=30)
-        shared_states.engine_instance.start()
-        print("[GUI] Engine started")
-
-    # Start plot thread if not running
-    if shared_states.plot_thread is None or not shared_states.plot_thread.is_alive():
-        # Ensure any previous stop event is cleared
-        try:
-            if getattr(shared_states, "plot_stop_event", None):
-                shared_states.plot_stop_event.clear()
-        except Exception:
-            pass
-
-        shared_states.plot_thread = threading.Thread(target=lambda: start_plot_window(update_hz=30), daemon=False)
-        shared_states.plot_thread.start()
-        print("[GUI] Plot thread started")
+    t0 = time.perf_counter()
+    arm_recording()     # no-op once armed
+    t_armed = time.perf_counter()
+    if shared_states.current_session_path:
+        open_sensor_csv(shared_states.current_session_path)
+        pose = shared_states.engine_instance.pose
+        open_pose_csv(shared_states.current_session_path, n_keypoints=pose.n_keypoints if pose else 1)
+    shared_states.is_recording = True
+    t_started = time.perf_counter()
+    print(f"[RECORDING STARTED] -> {shared_states.current_session_path} "
+          f"({1000 * (t_started - t_armed):.2f} ms, {1000 * (t_armed - t0):.0f} ms arming)")
     try:
         if getattr(shared_states, "trial_controller", None):
             shared_states.trial_controller.start_session()
     except Exception as e:
         print(f"[TRIAL] Could not start TrialController: {e}")
-    shared_states.is_recording = True
-    print(f"[RECORDING STARTED] -> {shared_states.current_session_path}")
 
 def stop_recording_callback():
+    """Ends the recording; the Engine and plot keep running (armed for the next one)."""
     shared_states.is_recording = False
 
     if getattr(shared_states, "trial_controller", None):
         shared_states.trial_controller.stop_session()
 
-    if shared_states.engine_instance:
-        shared_states.engine_instance.stop()
-        shared_states.engine_instance = None
-        print("[GUI] Engine stopped")
+    engine = shared_states.engine_instance
+    if engine is not None and not engine.flush_writer():
+        print("[WARNING] Writer did not flush within 2 s; the last rows may be missing.")
+    close_sensor_csv()
+    close_pose_csv()
+    print("[GUI] Recording stopped (still armed)")
+
+def disarm_recording():
+    """Stops the Engine and the plot window (on exit)."""
+    shared_states.is_recording = False
+    with _arm_lock:
+        if shared_states.engine_instance:
+            shared_states.engine_instance.stop()
+            shared_states.engine_instance = None
+            print("[GUI] Engine stopped")
+    close_sensor_csv()
+    close_pose_csv()
 
     # Request plot window to close safely via its own thread
     if hasattr(shared_states, "plot_stop_event"):
@@ -76,15 +128,12 @@ def stop_recording_callback():
         else:
             print("[GUI] Plot thread exited cleanly.")
         shared_states.plot_thread = None
-    
-    
-
 
 
 def create_reward_table(prefix, button_dict):
     screen_width, screen_height = get_screen_dimensions()
     with dpg.table(width=screen_width // 2, header_row=False):
-        for _ in range(8):
+        for _ in range(max((len(row) for row in label_table), default=1)):
             dpg.add_table_column()
         for row in label_table:
             with dpg.table_row():
@@ -137,7 +186,8 @@ def create_hardware_test_panel(parent, width=250, height=500):
     dpg.add_separator()
 
     dpg.add_text("LED Control")
-    dpg.add_input_int(label="LED Number (1-16)", tag="test_led_number", min_value=1, max_value=16)
+    n_ports = shared_states.topology.n_ports
+    dpg.add_input_int(label=f"LED Number (1-{n_ports})", tag="test_led_number", min_value=1, max_value=n_ports)
     dpg.add_button(label="LED ON", callback=lambda: set_led(None, dpg.get_value("test_led_number"), True))
     dpg.add_button(label="LED OFF", callback=lambda: set_led(None, dpg.get_value("test_led_number"), False))
 
@@ -146,7 +196,7 @@ def create_hardware_test_panel(parent, width=250, height=500):
     dpg.add_combo(label="Reward", items=["1", "2"], default_value="1", tag="test_reward_channel")
     dpg.add_input_int(label="PWM Value (0-255)", default_value=255, tag="test_pwm_value", min_value=0, max_value=255)
     dpg.add_button(label="Send PWM", callback=lambda: send_serial_command(
-        ser1 if dpg.get_value("test_reward_channel") == "1" else ser2,
+        shared_states.ser1 if dpg.get_value("test_reward_channel") == "1" else shared_states.ser2,
         f"P{dpg.get_value('test_reward_channel')}{chr(dpg.get_value('test_pwm_value'))}"
     ))
 
@@ -158,12 +208,32 @@ def create_hardware_test_panel(parent, width=250, height=500):
 
     dpg.add_separator()
     dpg.add_text("Digital/Analog Output Test")
-    dpg.add_combo(label="Output Type", items=["session_start", "intertrial_phase", "light_sphere_dwell", "reward_phase", "reward_port_licks"], tag="test_output_type")
+    dpg.add_combo(label="Output Type", items=list(OUTPUT_EVENTS), default_value=OUTPUT_EVENTS[0], tag="test_output_type")
     dpg.add_input_int(label="Frequency", tag="test_output_freq", default_value=0)
-    dpg.add_button(label="Send Output Command", callback=lambda: print("Output command sent (implement serial cmd)"))
+    dpg.add_button(label="Send Output Command", callback=send_test_output)
+
+    dpg.add_separator()
+    dpg.add_text("Profiling")
+    dpg.add_input_float(label="Duration (s)", tag="profile_duration", default_value=10.0, min_value=1.0)
+    dpg.add_button(label="Start/Stop Profiling", callback=toggle_profiling)
     dpg.pop_container_stack()
 
 
+def send_test_output():
+    event = dpg.get_value("test_output_type") or OUTPUT_EVENTS[0]
+    frequency = max(0, dpg.get_value("test_output_freq"))
+    pulses = get_output_scheduler().test_output(event, frequency)
+    print(f"[OUTPUT] Test: {pulses} pulse(s) for '{event}' at {frequency} Hz.")
+
+
+def toggle_profiling():
+    # runs in the background: acquisition and the GUI keep going while all threads are sampled
+    if get_profiler().toggle(max(1.0, dpg.get_value("profile_duration"))):
+        print("[PROFILE] Capture started.")
+    else:
+        print("[PROFILE] Capture stopped, writing the profile to the session folder.")
+
+
 def update_protocol_summary(container_tag=None):
     protocol = getattr(shared_states, "current_protocol", None)
 
@@ -233,6 +303,16 @@ def update_protocol_summary(container_tag=None):
         return summary
 
 
+def update_live_stats():
+    """Refreshes the live statistics panel from the trial controller's analytics snapshot."""
+    controller = getattr(shared_states, "trial_controller", None)
+    if controller is None or not dpg.does_item_exist("live_stats_text"):
+        return
+    if controller.analytics.t_start is None:
+        return
+    dpg.set_value("live_stats_text", "\n".join(controller.analytics.format_lines()))
+
+
 def build_gui():
     screen_width, screen_height = get_screen_dimensions()
     dpg.create_context()
@@ -344,7 +424,7 @@ def build_gui():
                         width=trial_button_width,
                         height=60,
                         callback=lambda s=tag: toggle_trial_button(
-                            s, buttons_trials, shared_states.active_theme, ser1, ser2
+                            s, buttons_trials, shared_states.active_theme
                         )
                     )
                     buttons_trials[tag] = {"checked": False}
@@ -397,3 +477,7 @@ def build_gui():
                     create_hardware_test_panel(dpg.last_container())
                 with dpg.child_window(width=child_width, height=700, tag="protocol_summary_child_window"):
                     update_protocol_summary("protocol_summary_child_window")
+                with dpg.child_window(width=child_width, height=700):
+                    dpg.add_text("Live session statistics")
+                    dpg.add_separator()
+                    dpg.add_text("No session running.", tag="live_stats_text")
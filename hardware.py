@@ -0,0 +1,214 @@
+# hardware.py
+# Serial and camera I/O shared by the GUI, the Engine and headless runs.
+# Must not import any GUI toolkit.
+import numpy as np
+
+import shared_states
+from logging_setup import get_logger
+
+log = get_logger("hardware")
+
+# The routing functions below take an optional `state`: any object with the
+# shared_states attributes they use (devices, topology), e.g. an
+# arena.ArenaState. Default is the global shared_states module.
+
+def _log(state):
+    """hardware logger tagged with the state's session (see logging_setup.get_logger)."""
+    return get_logger("hardware", state or shared_states)
+
+
+### Serial connection functions
+
+def initialize_serial_connections(block=True, timeout=5.0, state=None):
+    """
+    Opens all configured boards and waits for their READY handshake, in
+    parallel. With block=False the handshake runs in the background and
+    shared_states.devices.handshake_done is set once it finished.
+    """
+    registry = (state or shared_states).devices
+    if not block:
+        return registry.handshake_all_async(timeout)
+    ready = registry.handshake_all(timeout)
+    _log(state).info("[INFO] Serial connections initialized: %s", ready)
+    return ready
+
+def clean_serial_line(line):
+    try:
+        return line.strip()
+    except Exception:
+        return ""  # Or str(line).strip()
+    
+def parse_sensor_line(line):
+    """
+    Parses: 'ts:12345 cs:400,1200,...'
+    Returns (timestamp, [sensor_values])
+    """
+    if not line:
+        return None, []
+    try:
+        head, sep, values = line.strip().partition(" cs:")
+        if not sep or not head.startswith("ts:"):
+            raise ValueError("not a sensor line")
+        return int(head[3:]), [int(v) for v in values.split(",")]
+    except Exception as e:
+        log.warning("[Parse error]: %s | Line: %s", e, line)
+        return None, []
+
+def read_sensor_lines(state=None):
+    """
+    Requests one sensor sample from every board and returns
+    [(ts, [values])] in topology board order.
+    All requests go out before the first reply is read, so the boards
+    sample in parallel and a tick costs the slowest board, not the sum.
+    """
+    state = state or shared_states
+    registry = state.devices
+    boards = state.topology.boards
+    devs = [registry.get(b) for b in boards]
+    for board, dev in zip(boards, devs):
+        if dev is not None:
+            registry.discard_sensor_lines(board)
+            registry.submit(board, b's')
+    # acks and other replies are sorted out by each board's reader thread
+    return [parse_sensor_line(registry.read_sensor_line(board) if dev is not None else "")
+            for board, dev in zip(boards, devs)]
+
+def send_serial_command(serial_obj, command, state=None):
+    if serial_obj is None:
+        _log(state).warning("[WARNING] Tried to send '%s' but serial connection is not available.", command)
+        return
+    board = (state or shared_states).devices.name_of(serial_obj)
+    if board is None:
+        _log(state).warning("[WARNING] '%s' is not a registered device, command '%s' not sent.", serial_obj.port, command)
+        return
+    write_board(board, command.encode('latin-1'), state)
+
+def write_board(board, data: bytes, state=None, on_ack=None):
+    """
+    Queues raw command bytes for a board by name (written by the board's writer
+    thread). on_ack(t) is called once the board acknowledged the command.
+    """
+    if not (state or shared_states).devices.submit(board, data, on_ack):
+        _log(state).warning("[WARNING] Tried to send %r to '%s' but serial connection is not available.", data, board)
+
+def broadcast_command(command, state=None):
+    """Sends the same command to every board."""
+    state = state or shared_states
+    data = command.encode('utf-8')
+    for board in state.topology.boards:
+        write_board(board, data, state)
+
+def set_led(serial_obj, led_number, on=True, state=None):
+    """
+    Controls an LED via appropriate Arduino.
+    LED numbers: any port in shared_states.topology (serial_obj is unused, the
+    topology decides the board). To switch several LEDs use set_outputs().
+    """
+    state = state or shared_states
+    table = state.topology.led_on_cmd if on else state.topology.led_off_cmd
+    route = table.get(led_number)
+    if route is None:
+        _log(state).error("[ERROR] Invalid LED number: %s", led_number)
+        return
+    _track_single_output(state, led_number, 0, on)
+    write_board(*route, state)
+
+def push_relay_mappings(mapping: dict, state=None):
+    """
+    Send reward group assignment to each Arduino
+    mapping: {relay_num: reward_group}, both 1-based
+    """
+    state = state or shared_states
+    topology = state.topology
+    for relay_num_str, reward_group in mapping.items():
+        relay_num = int(relay_num_str)
+        reward_group = int(reward_group)
+
+        if not topology.has_port(relay_num) or reward_group not in [1, 2]:
+            _log(state).warning("[WARNING] Invalid mapping: Relay %s -> Reward %s", relay_num, reward_group)
+            continue
+        write_board(*topology.map_command(relay_num, reward_group), state)
+
+def select_relay(relay_number, state=None):
+    """Selects a relay for the reward phase on the board that owns it."""
+    state = state or shared_states
+    route = state.topology.select_cmd.get(relay_number)
+    if route is None:
+        _log(state).error("[ERROR] Invalid relay number: %s", relay_number)
+        return
+    _track_single_output(state, relay_number, 1, True)
+    write_board(*route, state)
+
+def send_trial_phase_commands(phase_label, remembered_relays, state=None):
+    """
+    Sends the phase command to all boards. Entering the reward phase also
+    re-selects the remembered relays (tags like 'button1_3').
+    """
+    if phase_label == 'Reward-Phase':
+        broadcast_command('r', state)
+        relays = [int(tag.split("_")[1]) for tag in remembered_relays.values() if tag]
+        set_outputs(relays=relays, state=state)
+    elif phase_label == 'Intertrial-Phase':
+        # 'i' deselects all relays and switches all LEDs off on every board
+        state = state or shared_states
+        registry = state.devices
+        for board in state.topology.boards:
+            registry.output_masks[board] = (0, 0)
+            registry.acked_masks.pop(board, None)
+            write_board(board, b'i', state, on_ack=_masks_acked(registry, board, (0, 0)))
+
+### Bulk output state ('B' command)
+# One 'B' + <led mask byte> + <relay mask byte> per board sets all of its LEDs
+# and selected reward relays at once (the firmware applies it atomically and
+# acknowledges it like every command). Bit 0 is the board's LED/relay 1.
+
+def set_outputs(leds=None, relays=None, state=None):
+    """
+    Sets which LEDs are on and which relays are selected, over all boards.
+    leds / relays: iterables of ports; None keeps that part as it is.
+    Boards whose masks equal the last acknowledged ones are not written.
+    Returns the number of boards written to.
+    """
+    state = state or shared_states
+    topology, registry = state.topology, state.devices
+    led_masks = topology.port_masks(leds) if leds is not None else None
+    relay_masks = topology.port_masks(relays) if relays is not None else None
+    writes = 0
+    for board in topology.boards:
+        led, relay = registry.output_masks.get(board, (0, 0))
+        masks = (led if led_masks is None else led_masks[board],
+                 relay if relay_masks is None else relay_masks[board])
+        registry.output_masks[board] = masks
+        if registry.acked_masks.get(board) == masks:
+            continue
+        write_board(board, b'B' + bytes(masks), state, on_ack=_masks_acked(registry, board, masks))
+        writes += 1
+    return writes
+
+def _masks_acked(registry, board, masks):
+    """
+    Ack handler recording that a board applied `masks`. Ignored if the host
+    asked for something else in the meantime (that command is still on its way).
+    """
+    def on_ack(t):
+        if registry.output_masks.get(board) == masks:
+            registry.acked_masks[board] = masks
+    return on_ack
+
+def _track_single_output(state, port, which, on):
+    """Keeps the bulk masks in sync with a single-port L/l/<digit> command."""
+    topology, registry = state.topology, state.devices
+    board = topology.port_board.get(port)
+    if board is None:
+        return
+    masks = list(registry.output_masks.get(board, (0, 0)))
+    bit = 1 << (topology.port_local[port] - 1)
+    masks[which] = masks[which] | bit if on else masks[which] & ~bit
+    registry.output_masks[board] = tuple(masks)
+    registry.acked_masks.pop(board, None)
+
+### Camera functions 
+
+def get_camera_frame():
+    # Return a dummy black frame if real camera is not available
+    return np.zeros((200, 200, 3), dtype=np.uint8)
@@ -0,0 +1,146 @@
+# headless_session.py
+"""
+Runs a full session without the GUI.
+
+Loads a mouse file and a protocol JSON, creates the session folder, then runs
+Engine and TrialController until the protocol's end condition (or Ctrl+C)
+while printing a one-line live status. dearpygui, Qt and the GUI modules are
+never imported.
+
+Usage:
+    python headless_session.py <mouse.json> <protocol.json> [--session N]
+                               [--reward1-relay R] [--reward2-relay R] [--hz 30] [--seed S]
+                               [--dashboard [PORT]] [--profile SECONDS]
+
+SIGUSR1 (python profiler.py <pid>) starts or stops a profiling capture.
+"""
+import time
+_T_START = time.perf_counter()
+
+import argparse
+import json
+import sys
+
+import shared_states as S
+from engine import Engine
+from hardware import initialize_serial_connections
+from position_tracker import PositionTracker
+from protocol_compiler import validate_protocol
+from pose_inference import PoseProvider
+from profiler import get_profiler, install_signal_handler
+from serial_dispatcher import format_dispatch_stats
+from session_files import prepare_session, open_sensor_csv, close_sensor_csv, open_pose_csv, close_pose_csv
+from trial_functionality import TrialController
+from web_dashboard import DEFAULT_PORT, WebDashboard
+
+
+def _status_line(controller, engine, t0, last):
+    """last: (time, processed, rate) of the previous rate measurement."""
+    stats = engine.stats
+    now = time.perf_counter()
+    rate = last[2]
+    if now - last[0] >= 0.2:  # too short a window gives meaningless rates
+        rate = (stats.processed - last[1]) / (now - last[0])
+        last = (now, stats.processed, rate)
+    target = controller.trial_count_target or "-"
+    phase = controller.current_phase or "-"
+    line = (f"[RUN] {now - t0:7.1f}s | trial {controller.current_trial_index}/{target} | "
+            f"{phase:<16} | {rate:6.1f} Hz | drops {stats.acq_drops}/{stats.writer_drops}")
+    return line, last
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a Multiport session without the GUI.")
+    parser.add_argument("mouse_file", help="Mouse JSON file (<MouseID>.json)")
+    parser.add_argument("protocol_file", help="Protocol JSON file")
+    parser.add_argument("--session", type=int, help="Session number (default: next free)")
+    parser.add_argument("--overwrite", action="store_true", help="Reuse an existing session number")
+    parser.add_argument("--reward1-relay", type=int, help="Relay (lickport number) for reward 1")
+    parser.add_argument("--reward2-relay", type=int, help="Relay (lickport number) for reward 2")
+    parser.add_argument("--hz", type=float, default=30.0, help="Acquisition rate")
+    parser.add_argument("--status-hz", type=float, default=2.0, help="Status line refresh rate")
+    parser.add_argument("--pose-model", help="Pose model 'module:Class' (overrides the arena config)")
+    parser.add_argument("--pose-workers", type=int, default=2, help="Pose worker processes (with --pose-model)")
+    parser.add_argument("--no-track", action="store_true", help="Disable camera position tracking")
+    parser.add_argument("--skip-handshake", action="store_true", help="Don't wait for READY from the boards")
+    parser.add_argument("--seed", type=int, help="Trial schedule seed (default: the protocol's, else a new one)")
+    parser.add_argument("--dashboard", type=int, nargs="?", const=DEFAULT_PORT, metavar="PORT",
+                        help=f"Serve the live web dashboard on 127.0.0.1 (default port {DEFAULT_PORT})")
+    parser.add_argument("--profile", type=float, metavar="SECONDS",
+                        help="Profile all threads for the first SECONDS of the session (see profiler.py)")
+    args = parser.parse_args(argv)
+
+    # reject a bad protocol before a session folder is created
+    try:
+        with open(args.protocol_file, "r") as f:
+            validate_protocol(json.load(f))
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"[HEADLESS] {e}")
+
+    try:
+        session_path, protocol = prepare_session(
+            args.mouse_file, args.protocol_file, session=args.session, overwrite=args.overwrite,
+            reward1_relay=args.reward1_relay, reward2_relay=args.reward2_relay)
+    except FileExistsError as e:
+        raise SystemExit(f"[HEADLESS] {e} (use --overwrite).")
+    print(f"[HEADLESS] Startup {1000 * (time.perf_counter() - _T_START):.0f} ms -> {session_path}")
+
+    if not args.skip_handshake:
+        initialize_serial_connections()
+
+    controller = TrialController(headless=True)
+    controller.load_protocol(protocol, seed=args.seed)
+    S.trial_controller = controller
+    if args.dashboard is not None:
+        S.dashboard = WebDashboard(port=args.dashboard).start()
+    else:
+        S.dashboard = WebDashboard.from_config(S.arena_config)
+        if S.dashboard is not None:
+            S.dashboard.start()
+
+    if args.pose_model:
+        pose = PoseProvider(model=args.pose_model, workers=args.pose_workers)
+    else:
+        pose = PoseProvider.from_config(S.arena_config)
+    engine = Engine(target_hz=args.hz, tracker=None if args.no_track else PositionTracker(), pose=pose)
+    S.engine_instance = engine
+    open_sensor_csv(session_path)
+    open_pose_csv(session_path, n_keypoints=pose.n_keypoints if pose else 1)
+    S.is_recording = True
+    engine.start()
+    controller.start_session()
+    install_signal_handler()
+    if args.profile:
+        get_profiler().start(args.profile)
+
+    t0 = time.perf_counter()
+    last = (t0, engine.stats.processed, 0.0)
+    period = 1.0 / max(0.1, args.status_hz)
+    try:
+        while controller.thread is not None and controller.thread.is_alive():
+            line, last = _status_line(controller, engine, t0, last)
+            sys.stdout.write("\r" + line)
+            sys.stdout.flush()
+            time.sleep(period)
+    except KeyboardInterrupt:
+        print("\n[HEADLESS] Interrupted, stopping session.")
+        controller.stop_session()
+    finally:
+        if S.profiler is not None:
+            S.profiler.stop(wait=True)
+        S.is_recording = False
+        engine.stop()
+        S.engine_instance = None
+        close_sensor_csv()
+        close_pose_csv()
+        for line in format_dispatch_stats(S.devices.dispatch_stats()):
+            print(line)
+        S.devices.close_all()
+        if S.dashboard is not None:
+            S.dashboard.stop()
+    print(f"\n[HEADLESS] Session finished: {controller.current_trial_index} trials, "
+          f"{engine.stats.processed} samples in {time.perf_counter() - t0:.1f}s -> {session_path}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
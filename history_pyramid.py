@@ -0,0 +1,221 @@
+# history_pyramid.py
+"""
+Whole-session sensor history at several resolutions, for zoomable plots.
+
+Level 0 holds the last `capacity` raw samples. Every level above holds
+buckets of `factor` entries of the level below (first time, min, max, sum,
+count) and is filled incrementally while samples arrive, so nothing is ever
+recomputed. Levels 0..n-2 are rings of `capacity` entries; the top level is
+unbounded but grows only by one bucket per factor**(levels-1) samples (about
+two per minute at 1 kHz with the defaults), so memory stays bounded for
+multi-hour sessions (about 2 MB per sensor with the defaults; at 1 kHz the
+levels reach back 8 s, 1 min, 9 min, 70 min, 9 h and the whole session).
+
+query(t0, t1, max_points) picks the finest level that still holds t0 and
+has at most max_points entries in the range, so any time span of the session
+is answered with a bounded number of points in O(points).
+
+The Engine fills one pyramid per sensor (state.sensor_history): samples are
+appended to pending_t / pending_v on the processing thread and moved into
+the levels by flush() once per GUI bucket.
+"""
+import threading
+
+import numpy as np
+
+DEFAULT_FACTOR = 8
+DEFAULT_LEVELS = 6
+DEFAULT_CAPACITY = 8192
+
+
+class _Level:
+    """Time-ordered entries (t, min, max, sum, count); a ring of `capacity` or unbounded (capacity=None)."""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        size = capacity or 1024
+        self.t = np.zeros(size, dtype=np.float64)
+        self.vmin = np.zeros(size, dtype=np.float64)
+        self.vmax = np.zeros(size, dtype=np.float64)
+        self.vsum = np.zeros(size, dtype=np.float64)
+        self.count = np.zeros(size, dtype=np.int64)
+        self.n = 0          # entries held
+        self.head = 0       # next write index (rings)
+
+    def append(self, t, vmin, vmax, vsum, count):
+        k = len(t)
+        if not k:
+            return
+        arrays = (self.t, self.vmin, self.vmax, self.vsum, self.count)
+        values = (t, vmin, vmax, vsum, count)
+        if self.capacity is None:
+            if self.n + k > len(self.t):
+                size = max(2 * len(self.t), self.n + k)
+                for name in ("t", "vmin", "vmax", "vsum", "count"):
+                    old = getattr(self, name)
+                    new = np.zeros(size, dtype=old.dtype)
+                    new[:self.n] = old[:self.n]
+                    setattr(self, name, new)
+                arrays = (self.t, self.vmin, self.vmax, self.vsum, self.count)
+            for a, v in zip(arrays, values):
+                a[self.n:self.n + k] = v
+            self.n += k
+            return
+        cap = self.capacity
+        if k > cap:
+            values = tuple(v[-cap:] for v in values)
+            k = cap
+        first = min(k, cap - self.head)
+        for a, v in zip(arrays, values):
+            a[self.head:self.head + first] = v[:first]
+            a[:k - first] = v[first:]
+        self.head = (self.head + k) % cap
+        self.n = min(cap, self.n + k)
+
+    def segments(self):
+        """The entries as one or two time-ordered index ranges of the arrays."""
+        if self.capacity is None or self.n < self.capacity:
+            return [(0, self.n)]
+        return [(self.head, self.capacity), (0, self.head)]
+
+    def first_time(self):
+        if not self.n:
+            return None
+        start = self.segments()[0][0]
+        return float(self.t[start])
+
+    def select(self, t0, t1):
+        """(start, stop) index ranges of the entries with t0 <= t < t1."""
+        ranges = []
+        for a, b in self.segments():
+            lo = a + int(np.searchsorted(self.t[a:b], t0, side="left"))
+            hi = a + int(np.searchsorted(self.t[a:b], t1, side="left"))
+            if hi > lo:
+                ranges.append((lo, hi))
+        return ranges
+
+    def take(self, ranges):
+        if len(ranges) == 1:
+            lo, hi = ranges[0]
+            return (self.t[lo:hi], self.vmin[lo:hi], self.vmax[lo:hi], self.vsum[lo:hi], self.count[lo:hi])
+        idx = np.concatenate([np.arange(lo, hi) for lo, hi in ranges]) if ranges else np.zeros(0, dtype=np.int64)
+        return (self.t[idx], self.vmin[idx], self.vmax[idx], self.vsum[idx], self.count[idx])
+
+
+class HistoryPyramid:
+    def __init__(self, factor=DEFAULT_FACTOR, levels=DEFAULT_LEVELS, capacity=DEFAULT_CAPACITY):
+        if factor < 2 or levels < 1:
+            raise ValueError("HistoryPyramid needs factor >= 2 and levels >= 1")
+        self.factor = int(factor)
+        self.levels = [_Level(int(capacity)) for _ in range(levels - 1)] + [_Level(None)]
+        # entries of level k-1 not yet grouped into a level-k bucket (index k-1)
+        self._carry = [tuple(np.zeros(0) for _ in range(5)) for _ in range(levels - 1)]
+        self.pending_t = []
+        self.pending_v = []
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    # ---------- Filling (processing thread) ----------
+    def extend(self, t, v):
+        """Appends samples (time-ordered, after the ones already held)."""
+        t = np.asarray(t, dtype=np.float64)
+        v = np.asarray(v, dtype=np.float64)
+        if not len(t):
+            return
+        ones = np.ones(len(t), dtype=np.int64)
+        entries = (t, v, v, v, ones)
+        with self._lock:
+            self.samples += len(t)
+            for k, level in enumerate(self.levels):
+                level.append(*entries)
+                if k == len(self.levels) - 1:
+                    break
+                entries = self._roll_up(k, entries)
+                if not len(entries[0]):
+                    break
+
+    def flush(self):
+        """Moves pending_t / pending_v into the pyramid."""
+        if self.pending_t:
+            # cleared in place: the Engine holds their append methods
+            self.extend(self.pending_t, self.pending_v)
+            self.pending_t.clear()
+            self.pending_v.clear()
+
+    def _roll_up(self, k, entries):
+        """Complete buckets of `factor` entries of level k (with the carry from before)."""
+        carry = self._carry[k]
+        if len(carry[0]):
+            entries = tuple(np.concatenate((c, e)) for c, e in zip(carry, entries))
+        f = self.factor
+        n = (len(entries[0]) // f) * f
+        self._carry[k] = tuple(e[n:].copy() for e in entries)
+        if not n:
+            return tuple(np.zeros(0) for _ in range(5))
+        t, vmin, vmax, vsum, count = (e[:n].reshape(-1, f) for e in entries)
+        return (t[:, 0], vmin.min(axis=1), vmax.max(axis=1), vsum.sum(axis=1), count.sum(axis=1))
+
+    def _tail(self, k):
+        """The not yet complete bucket after the last entry of level k (from the carries below it)."""
+        parts = [c for c in self._carry[:k] if len(c[0])]
+        if not parts:
+            return None
+        t = min(float(c[0][0]) for c in parts)
+        return (np.array([t]),
+                np.array([min(float(c[1].min()) for c in parts)]),
+                np.array([max(float(c[2].max()) for c in parts)]),
+                np.array([sum(float(c[3].sum()) for c in parts)]),
+                np.array([sum(int(c[4].sum()) for c in parts)]))
+
+    # ---------- Queries (any thread) ----------
+    def time_range(self):
+        """(first, last) sample time held, or None."""
+        with self._lock:
+            first = next((lv.first_time() for lv in reversed(self.levels) if lv.n), None)
+            level0 = self.levels[0]
+            if first is None:
+                return None
+            last_index = (level0.head - 1) % level0.capacity if level0.capacity else level0.n - 1
+            return first, float(level0.t[last_index])
+
+    def buckets(self, t0=None, t1=None, max_points=2000):
+        """
+        (t, min, max, mean, level) of the range t0 <= t <= t1 (default: the
+        whole history) at the finest level with at most max_points entries.
+        """
+        with self._lock:
+            firsts = [lv.first_time() for lv in self.levels if lv.n]
+            # a range starting before the history starts at its first sample
+            t0 = max(t0, min(firsts)) if t0 is not None and firsts else (min(firsts) if firsts else -np.inf)
+            t1 = np.inf if t1 is None else t1
+            chosen = len(self.levels) - 1
+            for k, level in enumerate(self.levels[:-1]):
+                first = level.first_time()
+                if first is None or first > t0:
+                    continue        # this level no longer holds the start of the range
+                n = sum(hi - lo for lo, hi in level.select(t0, np.nextafter(t1, np.inf)))
+                if n + 1 <= max_points:
+                    chosen = k
+                    break
+            level = self.levels[chosen]
+            t, vmin, vmax, vsum, count = level.take(level.select(t0, np.nextafter(t1, np.inf)))
+            tail = self._tail(chosen)
+            if tail is not None and t0 <= tail[0][0] <= t1:
+                t, vmin, vmax, vsum, count = (np.concatenate((a, b)) for a, b in
+                                              zip((t, vmin, vmax, vsum, count), tail))
+            else:
+                t, vmin, vmax, vsum, count = (a.copy() for a in (t, vmin, vmax, vsum, count))
+        mean = vsum / np.maximum(count, 1)
+        return t, vmin, vmax, mean, chosen
+
+    def query(self, t0=None, t1=None, max_points=2000):
+        """
+        (t, v) to plot t0..t1 with at most about max_points points: raw
+        samples, or the min and max of every bucket (so peaks always show).
+        """
+        t, vmin, vmax, _, level = self.buckets(t0, t1, max_points if max_points < 4 else max_points // 2)
+        if level == 0:
+            return t, vmin
+        return np.repeat(t, 2), np.column_stack((vmin, vmax)).ravel()
+
+    def nbytes(self):
+        return sum(a.nbytes for lv in self.levels for a in (lv.t, lv.vmin, lv.vmax, lv.vsum, lv.count))
@@ -0,0 +1,239 @@
+# live_analytics.py
+"""
+Online per-trial and session statistics.
+
+TrialController reports trial, phase, lick, reward and zone events to a
+SessionAnalytics as they happen. Every event updates running counters and
+Welford mean/variance accumulators in O(1), so the current snapshot (for
+the GUI) and the end-of-session summary (session_summary.json) never need a
+second pass over the CSVs.
+
+All times are time.perf_counter() seconds (the Engine clock).
+"""
+import json
+import math
+import threading
+import time
+
+
+class RunningStat:
+    """Count, mean, std, min and max of a stream of values (Welford)."""
+    __slots__ = ("n", "mean", "_m2", "min", "max")
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def std(self):
+        return math.sqrt(self._m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+    def as_dict(self):
+        if not self.n:
+            return {"n": 0}
+        return {"n": self.n, "mean": self.mean, "std": self.std, "min": self.min, "max": self.max}
+
+
+class TrialStats:
+    """Counters of one trial."""
+    def __init__(self, index, t_start):
+        self.index = index
+        self.t_start = t_start
+        self.t_end = None
+        self.reward_onset = None
+        self.reward_end = None
+        self.intertrial_onset = None
+        self.licks = {}                 # port label -> count
+        self.first_lick_latency = None  # reward-phase onset -> first lick (s)
+        self.dispensed = 0
+        self.withheld = 0
+        self.time_to_dwell = None       # intertrial onset -> dwell threshold reached (s)
+
+    def as_dict(self):
+        reward_time = None
+        if self.reward_onset is not None and self.reward_end is not None:
+            reward_time = self.reward_end - self.reward_onset
+        return {
+            "trial": self.index,
+            "duration_s": None if self.t_end is None else self.t_end - self.t_start,
+            "reward_phase_s": reward_time,
+            "licks": dict(sorted(self.licks.items())),
+            "first_lick_latency_s": self.first_lick_latency,
+            "rewards_dispensed": self.dispensed,
+            "rewards_withheld": self.withheld,
+            "time_to_dwell_s": self.time_to_dwell,
+        }
+
+
+class SessionAnalytics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, t=None):
+        with self._lock:
+            self.t_start = t
+            self.t_end = None
+            self.trial = None                  # TrialStats of the running trial
+            self.trials = []                   # finished trials, as dicts
+            self.licks = {}                    # port label -> session lick count
+            self.reward_phase_time = 0.0       # summed reward-phase duration (for lick rates)
+            self.dispensed = 0
+            self.withheld = 0
+            self.first_lick_latency = RunningStat()
+            self.time_to_dwell = RunningStat()
+            self.trial_duration = RunningStat()
+            self.zone_visits = {}              # zone -> number of entries
+            self.zone_time = {}                # zone -> summed visit time (closed visits)
+
+    # ---------- Events ----------
+    def on_session_start(self, t):
+        self.reset(t)
+
+    def on_session_end(self, t):
+        with self._lock:
+            self._close_trial(t)
+            self.t_end = t
+
+    def on_trial_start(self, t, index):
+        with self._lock:
+            self._close_trial(t)
+            self.trial = TrialStats(index, t)
+
+    def on_reward_phase(self, t):
+        with self._lock:
+            if self.trial is not None:
+                self.trial.reward_onset = t
+
+    def on_reward_phase_end(self, t):
+        with self._lock:
+            tr = self.trial
+            if tr is not None and tr.reward_onset is not None:
+                tr.reward_end = t
+                self.reward_phase_time += t - tr.reward_onset
+
+    def on_intertrial_phase(self, t):
+        with self._lock:
+            if self.trial is not None:
+                self.trial.intertrial_onset = t
+
+    def on_lick(self, t, port):
+        """port: lickport label, e.g. 'port3' (same names as the zones)."""
+        port = str(port)
+        with self._lock:
+            self.licks[port] = self.licks.get(port, 0) + 1
+            tr = self.trial
+            if tr is None:
+                return
+            tr.licks[port] = tr.licks.get(port, 0) + 1
+            if tr.first_lick_latency is None and tr.reward_onset is not None and tr.reward_end is None:
+                tr.first_lick_latency = t - tr.reward_onset
+                self.first_lick_latency.add(tr.first_lick_latency)
+
+    def on_reward(self, t, dispensed):
+        with self._lock:
+            if dispensed:
+                self.dispensed += 1
+            else:
+                self.withheld += 1
+            if self.trial is not None:
+                if dispensed:
+                    self.trial.dispensed += 1
+                else:
+                    self.trial.withheld += 1
+
+    def on_dwell(self, t):
+        with self._lock:
+            tr = self.trial
+            if tr is not None and tr.intertrial_onset is not None and tr.time_to_dwell is None:
+                tr.time_to_dwell = t - tr.intertrial_onset
+                self.time_to_dwell.add(tr.time_to_dwell)
+
+    def on_zone(self, t, kind, zone, duration=None):
+        with self._lock:
+            if kind == "enter":
+                self.zone_visits[zone] = self.zone_visits.get(zone, 0) + 1
+            elif kind == "exit" and duration is not None:
+                self.zone_time[zone] = self.zone_time.get(zone, 0.0) + duration
+
+    def _close_trial(self, t):
+        tr = self.trial
+        if tr is None:
+            return
+        if tr.reward_onset is not None and tr.reward_end is None:
+            tr.reward_end = t
+            self.reward_phase_time += t - tr.reward_onset
+        tr.t_end = t
+        self.trial_duration.add(t - tr.t_start)
+        self.trials.append(tr.as_dict())
+        self.trial = None
+
+    # ---------- Output ----------
+    def snapshot(self, t=None):
+        """Current statistics as a JSON-serializable dict (cheap; safe to call from the GUI)."""
+        with self._lock:
+            if t is None:
+                t = self.t_end if self.t_end is not None else time.perf_counter()
+            elapsed = t - self.t_start if self.t_start is not None else 0.0
+            reward_time = self.reward_phase_time
+            tr = self.trial
+            if tr is not None and tr.reward_onset is not None and tr.reward_end is None:
+                reward_time += t - tr.reward_onset
+            n_rewards = self.dispensed + self.withheld
+            return {
+                "elapsed_s": elapsed,
+                "trials_completed": len(self.trials),
+                "current_trial": tr.as_dict() if tr is not None else None,
+                "licks": dict(sorted(self.licks.items())),
+                "lick_rate_hz": {p: n / elapsed for p, n in sorted(self.licks.items())} if elapsed > 0 else {},
+                "reward_phase_lick_rate_hz": ({p: n / reward_time for p, n in sorted(self.licks.items())}
+                                              if reward_time > 0 else {}),
+                "rewards_dispensed": self.dispensed,
+                "rewards_withheld": self.withheld,
+                "reward_collected_ratio": self.dispensed / n_rewards if n_rewards else None,
+                "first_lick_latency_s": self.first_lick_latency.as_dict(),
+                "time_to_dwell_s": self.time_to_dwell.as_dict(),
+                "trial_duration_s": self.trial_duration.as_dict(),
+                "zone_visits": dict(self.zone_visits),
+                "zone_time_s": dict(self.zone_time),
+            }
+
+    def summary(self):
+        """Snapshot plus the per-trial table."""
+        snap = self.snapshot()
+        with self._lock:
+            snap["trials"] = list(self.trials)
+        return snap
+
+    def write_summary(self, path, summary=None):
+        """Writes summary (default: the current one) as JSON."""
+        with open(path, "w") as f:
+            json.dump(self.summary() if summary is None else summary, f, indent=4)
+        return path
+
+    def format_lines(self):
+        """Short human-readable version of the snapshot (GUI panel)."""
+        s = self.snapshot()
+        lines = [f"Elapsed: {s['elapsed_s']:.0f} s, trials completed: {s['trials_completed']}"]
+        if s["licks"]:
+            lines.append("Licks: " + ", ".join(f"{p}: {n} ({s['lick_rate_hz'].get(p, 0.0) * 60:.1f}/min)"
+                                               for p, n in s["licks"].items()))
+        ratio = s["reward_collected_ratio"]
+        lines.append(f"Rewards: {s['rewards_dispensed']} dispensed, {s['rewards_withheld']} withheld"
+                     + (f" ({ratio:.0%} collected)" if ratio is not None else ""))
+        for key, label in (("first_lick_latency_s", "First-lick latency"), ("time_to_dwell_s", "Time to dwell")):
+            st = s[key]
+            if st["n"]:
+                lines.append(f"{label}: {st['mean']:.2f} +/- {st['std']:.2f} s (n={st['n']})")
+        return lines
@@ -0,0 +1,300 @@
+# logging_setup.py
+"""
+Non-blocking logging for the acquisition, processing, trial and serial threads.
+
+Modules log through get_logger("trial") etc. A record only goes into a queue
+(logging.handlers.QueueHandler) on the calling thread; the LogWriter thread
+writes it to the console and to the open session logs (session.log in the
+session folder). No console or file I/O happens on the thread that logs;
+other file writes can be handed to the LogWriter as well (run_on_writer).
+
+A record goes to the session log of its session only: get_logger("trial",
+state) tags every record with state.current_session_path, so arenas running
+side by side (arena.py) keep separate logs. Untagged records (module-level
+loggers) are written to the session log only while exactly one is open.
+
+Repeated messages are rate limited per key (logger name + unformatted
+message, so use %-style arguments, or extra={"key": ...}): at most
+RATE_LIMIT records per key get through per RATE_WINDOW_S, the rest are
+counted and reported once the window is over ("N similar messages
+suppressed").
+
+CSV logs (open_csv_log) are written on the LogWriter thread as well:
+
+    events = open_csv_log(path, ["pc_timestamp", "event_type"])
+    events.write([time.time(), "trial_start"])   # only queues the row
+    events.close()                               # after the queued rows
+"""
+import atexit
+import csv
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+ROOT = "multiport"
+RATE_LIMIT = 5                  # records per key and window
+RATE_WINDOW_S = 2.0
+SESSION_LOG_NAME = "session.log"
+CONSOLE_FORMAT = "%(message)s"
+FILE_FORMAT = "%(asctime)s.%(msecs)03d %(threadName)s %(levelname)s %(message)s"
+
+_lock = threading.Lock()
+_writer = None
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # the rate limit key needs the message before it is formatted
+        record.key = getattr(record, "key", None) or (record.name, str(record.msg), getattr(record, "session", None))
+        return super().prepare(record)
+
+    def emit(self, record):
+        writer = _writer
+        if writer is not None and writer.on_thread():
+            # logged by a call running on the LogWriter (run_on_writer): written in order, right away
+            writer.handle(self.prepare(record))
+        else:
+            super().emit(record)
+
+
+class SessionLogger(logging.LoggerAdapter):
+    """Logger whose records carry the session folder of a state (see get_logger)."""
+    def process(self, msg, kwargs):
+        extra = dict(kwargs.get("extra") or {})
+        extra.setdefault("session", _session_key(getattr(self.extra["state"], "current_session_path", None)))
+        kwargs["extra"] = extra
+        return msg, kwargs
+
+
+class RateLimiter:
+    """Lets `limit` records per key through per `window` seconds and counts the rest."""
+    def __init__(self, limit=RATE_LIMIT, window=RATE_WINDOW_S):
+        self.limit = int(limit)
+        self.window = float(window)
+        self._keys = {}             # key -> [window start, passed, suppressed, last suppressed record]
+        self.total_suppressed = 0
+
+    def check(self, record):
+        """Records to write for `record`: none if it is suppressed, else the summary of its last window (if any) and itself."""
+        entry = self._keys.get(record.key)
+        if entry is not None and record.created - entry[0] < self.window:
+            if entry[1] < self.limit:
+                entry[1] += 1
+                return [record]
+            entry[2] += 1
+            entry[3] = record
+            self.total_suppressed += 1
+            return []
+        self._keys[record.key] = [record.created, 1, 0, None]
+        return [_summary(entry), record] if entry is not None and entry[2] else [record]
+
+    def expired(self, now=None, all_keys=False):
+        """Forgets the windows that are over (all with all_keys=True) and returns their summaries."""
+        now = time.time() if now is None else now
+        summaries = []
+        for key, entry in list(self._keys.items()):
+            if all_keys or now - entry[0] >= self.window:
+                del self._keys[key]
+                if entry[2]:
+                    summaries.append(_summary(entry))
+        return summaries
+
+def _summary(entry):
+    _, _, suppressed, last = entry
+    summary = logging.makeLogRecord(last.__dict__)
+    summary.msg = f"{last.getMessage()}  ({suppressed} similar messages suppressed)"
+    summary.args = None
+    return summary
+
+
+class CsvLog:
+    """CSV file whose rows are written on the LogWriter thread (see open_csv_log)."""
+    def __init__(self, writer, path, header):
+        self.path = path
+        self._writer = writer
+        self._file = open(path, "w", newline="")
+        self._csv = csv.writer(self._file)
+        self._csv.writerow(header)
+        self.closed = False
+
+    def write(self, row):
+        if not self.closed:
+            self._writer.queue.put((self._write, row))
+
+    def close(self, on_closed=None):
+        """Closes the file once the rows queued before are written; on_closed(path) runs on the LogWriter thread."""
+        if not self.closed:
+            self.closed = True
+            self._writer.queue.put((self._close, on_closed))
+
+    def _write(self, row):
+        self._csv.writerow(row)
+        self._file.flush()
+
+    def _close(self, on_closed):
+        self._file.close()
+        if on_closed is not None:
+            on_closed(self.path)
+
+
+class LogWriter:
+    """Thread draining the log queue into the console, the session logs and the CSV logs."""
+    def __init__(self, stream=None, limit=RATE_LIMIT, window=RATE_WINDOW_S):
+        self.queue = queue.SimpleQueue()
+        self.console = logging.StreamHandler(stream or sys.stdout)
+        self.console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        self.session_logs = {}              # session folder -> FileHandler of its session.log
+        self.limiter = RateLimiter(limit, window)
+        self.errors = 0
+        self._thread = None
+
+    def on_thread(self):
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="LogWriter", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=2.0):
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def flush(self, timeout=2.0):
+        """Waits until everything queued so far is written."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self.queue.put((lambda _: done.set(), None))
+        return done.wait(timeout)
+
+    def _run(self):
+        next_sweep = time.monotonic() + self.limiter.window
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0.0, next_sweep - time.monotonic()))
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if isinstance(item, logging.LogRecord):
+                self.handle(item)
+            elif item:
+                call, arg = item
+                try:
+                    call(arg)
+                except Exception as e:
+                    self.errors += 1
+                    self._emit(logging.makeLogRecord({"name": ROOT, "levelno": logging.ERROR, "levelname": "ERROR",
+                                                      "msg": f"[ERROR] Log writer: {e}"}))
+            if time.monotonic() >= next_sweep:
+                self._emit_all(self.limiter.expired())
+                next_sweep = time.monotonic() + self.limiter.window
+        self._emit_all(self.limiter.expired(all_keys=True))
+        for handler in self.session_logs.values():
+            handler.close()
+        self.session_logs.clear()
+
+    def handle(self, record):
+        self._emit_all(self.limiter.check(record))
+
+    def _emit_all(self, records):
+        for record in records:
+            self._emit(record)
+
+    def _emit(self, record):
+        if record.levelno >= self.console.level:
+            self.console.handle(record)
+        session = getattr(record, "session", None)
+        if session is not None:
+            handler = self.session_logs.get(session)
+        elif len(self.session_logs) == 1:
+            handler = next(iter(self.session_logs.values()))
+        else:
+            handler = None      # several sessions open: not attributable, console only
+        if handler is not None:
+            handler.handle(record)
+
+    # ---------- Session logs (run on the LogWriter thread) ----------
+    def _open_session_log(self, session):
+        if session not in self.session_logs:
+            handler = logging.FileHandler(os.path.join(session, SESSION_LOG_NAME), encoding="utf-8")
+            handler.setFormatter(logging.Formatter(FILE_FORMAT, "%Y-%m-%d %H:%M:%S"))
+            self.session_logs[session] = handler
+
+    def _close_session_log(self, session):
+        handler = self.session_logs.pop(session, None)
+        if handler is not None:
+            handler.close()
+
+
+def setup_logging(level=logging.INFO, stream=None):
+    """Installs the queue handler and starts the LogWriter (once; later calls only set the level)."""
+    global _writer
+    with _lock:
+        root = logging.getLogger(ROOT)
+        root.setLevel(level)
+        if _writer is None:
+            _writer = LogWriter(stream)
+            root.addHandler(_QueueHandler(_writer.queue))
+            root.propagate = False
+            _writer.start()
+            atexit.register(shutdown_logging)
+        return _writer
+
+def get_logger(name, state=None):
+    """
+    Logger 'multiport.<name>' (starts the LogWriter on first use). With a
+    state (shared_states or an ArenaState) its records go to that state's
+    session log only.
+    """
+    _running_writer()
+    logger = logging.getLogger(f"{ROOT}.{name}")
+    return logger if state is None else SessionLogger(logger, {"state": state})
+
+def _running_writer():
+    return _writer or setup_logging()
+
+def shutdown_logging():
+    """Writes what is queued, closes the logs and stops the LogWriter."""
+    global _writer
+    with _lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
+        root = logging.getLogger(ROOT)
+        for handler in list(root.handlers):
+            if isinstance(handler, _QueueHandler):
+                root.removeHandler(handler)
+
+def flush_logs(timeout=2.0):
+    return _writer.flush(timeout) if _writer is not None else True
+
+def run_on_writer(call, *args):
+    """Runs call(*args) on the LogWriter thread after everything queued so far (for file writes)."""
+    _running_writer().queue.put((lambda a: call(*a), args))
+
+
+# ---------- Session and CSV logs ----------
+def _session_key(session_path):
+    return os.path.normpath(session_path) if session_path else None
+
+def open_session_log(session_path):
+    """Also writes the session's log records (see get_logger) to <session_path>/session.log until close_session_log()."""
+    writer = _running_writer()
+    writer.queue.put((writer._open_session_log, _session_key(session_path)))
+    return os.path.join(session_path, SESSION_LOG_NAME)
+
+def close_session_log(session_path):
+    if _writer is not None:
+        _writer.queue.put((_writer._close_session_log, _session_key(session_path)))
+
+def open_csv_log(path, header):
+    """Opens a CsvLog (the file is created here, rows are written on the LogWriter thread)."""
+    return CsvLog(_running_writer(), path, header)
@@ -1,14 +1,21 @@
-import dearpygui.dearpygui as dpg
 import time
+_T_START = time.perf_counter()
+
+import dearpygui.dearpygui as dpg
 import shared_states
-from gui_functions import build_gui
-from utils import initialize_serial_connections
+from gui_functions import build_gui, update_live_stats, disarm_recording
+from hardware import initialize_serial_connections
 import trial_functionality
+from profiler import install_signal_handler
+from web_dashboard import WebDashboard
 
 TARGET_FPS = shared_states.TARGET_FPS
 FRAME_PERIOD = 1.0 / TARGET_FPS
+LIVE_STATS_INTERVAL = 0.5  # seconds between refreshes of the live statistics panel
+_last_stats_update = 0.0
 
 def main_loop():
+    global _last_stats_update
     # Process queued GUI actions if any
     while shared_states.gui_actions:
         try:
@@ -17,24 +24,55 @@ def main_loop():
         except Exception as e:
             print(f"[GUI ACTION ERROR]: {e}")
 
+    now = time.perf_counter()
+    if now - _last_stats_update >= LIVE_STATS_INTERVAL:
+        _last_stats_update = now
+        update_live_stats()
+
     # Render a single DearPyGUI frame
     dpg.render_dearpygui_frame()
 
     # Sleep to maintain target FPS
     time.sleep(FRAME_PERIOD)
 
+_T_IMPORTED = time.perf_counter()
+
+def report_startup(t_devices, t_built, t_interactive):
+    timings = shared_states.startup_timings
+    timings["imports_ms"] = 1000 * (_T_IMPORTED - _T_START)
+    timings["devices_ms"] = 1000 * (t_devices - _T_IMPORTED)
+    timings["gui_build_ms"] = 1000 * (t_built - t_devices)
+    timings["first_frame_ms"] = 1000 * (t_interactive - t_built)
+    timings["time_to_interactive_ms"] = 1000 * (t_interactive - _T_START)
+    print(f"[STARTUP] Time to interactive: {timings['time_to_interactive_ms']:.0f} ms "
+          f"(imports {timings['imports_ms']:.0f}, devices {timings['devices_ms']:.0f}, "
+          f"GUI build {timings['gui_build_ms']:.0f}, first frame {timings['first_frame_ms']:.0f})")
+
 def main():
-    initialize_serial_connections()
+    # READY handshakes run in parallel in the background while the GUI builds
+    initialize_serial_connections(block=False)
+    t_devices = time.perf_counter()
+    install_signal_handler()
     shared_states.trial_controller = trial_functionality.TrialController()
+    shared_states.dashboard = WebDashboard.from_config(shared_states.arena_config)
+    if shared_states.dashboard is not None:
+        shared_states.dashboard.start()
     build_gui()
     dpg.show_viewport()
+    t_built = time.perf_counter()
     print(f"Starting GUI loop at target {TARGET_FPS} FPS...")
 
+    main_loop()
+    report_startup(t_devices, t_built, time.perf_counter())
     while dpg.is_dearpygui_running():
         main_loop()
 
     print("GUI closed. Destroying context.")
     dpg.destroy_context()
+    disarm_recording()
+    if shared_states.dashboard is not None:
+        shared_states.dashboard.stop()
+    shared_states.devices.close_all()
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,5 @@
 import os
 import shared_states
-import csv
 import dearpygui.dearpygui as dpg
 import json
 
@@ -11,35 +10,11 @@ from shared_states import (
 from utils import (
     check_ready_state
 )
+from session_files import (
+    create_mouse_folder_structure, setup_session_folder, last_session_relays
+)
 
 
-def create_mouse_folder_structure(mouse_id: str, base_dir: str, notes: str = ""):
-    mouse_folder = os.path.join(base_dir, mouse_id)
-    os.makedirs(mouse_folder, exist_ok=True)
-    session_name = "session1"
-    session_folder = os.path.join(mouse_folder, session_name)
-    os.makedirs(session_folder, exist_ok=True)
-    shared_states.current_session_path = session_folder
-    os.makedirs(os.path.join(session_folder, "frames"), exist_ok=True)
-
-    sensor_csv = os.path.join(session_folder, "sensor_data.csv")
-    pose_csv = os.path.join(session_folder, "pose_estimation.csv")
-
-    with open(sensor_csv, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["timestamp", "sensor1", "sensor2", "..."])
-
-    with open(pose_csv, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["timestamp", "x1", "y1", "likelihood1", "..."])
-
-    return {
-        "mouse_folder": mouse_folder,
-        "session_name": session_name,
-        "session_folder": session_folder,
-        "json_path": os.path.join(mouse_folder, f"{mouse_id}.json")
-    }
-
 def create_mouse_file():
     mouse_id = dpg.get_value("mouse_id_input")
 
@@ -122,26 +97,6 @@ def cancel_mouse_overwrite():
         del shared_states.pending_mouse_save
     dpg.configure_item("mouse_overwrite_popup", show=False)
 
-def setup_session_folder(mouse_folder_path, session_name):
-    session_folder = os.path.join(mouse_folder_path, session_name)
-    shared_states.current_session_path = session_folder
-    os.makedirs(session_folder, exist_ok=True)
-    os.makedirs(os.path.join(session_folder, "frames"), exist_ok=True)
-
-    sensor_csv = os.path.join(session_folder, "sensor_data.csv")
-    pose_csv = os.path.join(session_folder, "pose_estimation.csv")
-
-    with open(sensor_csv, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["timestamp", "sensor1", "sensor2", "..."])
-
-    with open(pose_csv, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["timestamp", "x1", "y1", "likelihood1", "..."])
-
-    print(f"[SESSION FOLDER CREATED]: {session_folder}")
-    return session_folder
-
 def mouse_file_selected(sender, app_data):
     mouse_file = app_data['file_path_name']
     shared_states.current_mouse_file = mouse_file
@@ -154,12 +109,9 @@ def mouse_file_selected(sender, app_data):
             shared_states.current_mouse_data = json.load(f)
         current_mouse_data = shared_states.current_mouse_data
         dpg.configure_item("session_prompt_popup", show=True)
-        relay_sessions = current_mouse_data.get("relay_sessions", {})
-        if relay_sessions:
-            last_session = sorted(relay_sessions.keys(), key=lambda x: int(x.replace("session", "")))[-1]
-            last_relays = relay_sessions[last_session]
-            remembered_relays["1"] = last_relays[-1][0]
-            remembered_relays["2"] = last_relays[-1][1]
+        last_relays = last_session_relays(current_mouse_data)
+        if last_relays:
+            remembered_relays["1"], remembered_relays["2"] = last_relays
         else:
             print("No relay session history found.")
 
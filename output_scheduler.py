@@ -0,0 +1,217 @@
+# output_scheduler.py
+"""
+TTL pulse trains for the protocol's digital_analog_outputs.
+
+trigger() turns an OutputSpec (see protocol_compiler.py) into rising and
+falling edges with absolute perf_counter() deadlines and returns at once;
+the OutputTimer thread sleeps until shortly before each deadline, spins the
+rest and then queues 'T' <channel> <level> on the output board, ahead of
+every other command (class 'ttl' in serial_dispatcher.py).
+
+A new train on a channel replaces the rest of the previous one on that
+channel (a high output is pulled low first).
+
+Every edge is logged with its scheduled time, the time it was issued and
+the time the board acknowledged it, so jitter against external rigs (ephys,
+photometry) can be quantified; write_log() saves output_timing.csv and
+summary() gives the error percentiles.
+
+With a clock other than perf_counter() (session replay: the ReplayClock,
+see session_replay.py) there is no OutputTimer thread: trains start at the
+clock's time and run_due() issues the edges as that clock advances, so the
+edge count matches the recording even when the replay runs faster.
+
+Arena config (optional): "outputs": {"board": "ser1"} (default: first board).
+"""
+import csv
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+import shared_states
+from logging_setup import get_logger
+from protocol_compiler import OutputSpec, output_spec
+
+SPIN_S = 0.0005                 # last part of a wait is spun instead of slept
+LOG_LENGTH = 200000             # edges kept for output_timing.csv
+TIMING_NAME = "output_timing.csv"
+
+
+class OutputScheduler:
+    def __init__(self, state=None, board=None, spin_s=SPIN_S, clock=None):
+        self.state = state or shared_states
+        self.clock = clock or time.perf_counter
+        self.stepped = clock is not None        # edges issued by run_due(), not the OutputTimer thread
+        self.logger = get_logger("outputs", self.state)
+        cfg = (getattr(self.state, "arena_config", None) or {}).get("outputs", {})
+        boards = self.state.topology.boards
+        self.board = board or cfg.get("board") or (boards[0] if boards else None)
+        self.spin_s = float(spin_s)
+        self.log = deque(maxlen=LOG_LENGTH)     # [event, channel, level, scheduled, issued, acked]
+        self._heap = []                         # (deadline, order, channel, level, train, event)
+        self._order = itertools.count()
+        self._train = {}                        # channel -> id of the train that owns it
+        self._level = {}                        # channel -> last issued level
+        self._trains = itertools.count(1)
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    # ---------- Lifecycle ----------
+    def start(self):
+        if self._thread is not None or self.stepped:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="OutputTimer", daemon=True)
+        self._thread.start()
+
+    def release(self, event="release"):
+        """Drops pending edges and pulls every high output low (end of session)."""
+        with self._cond:
+            self._heap.clear()
+            now = self.clock()
+            for channel, level in self._level.items():
+                if level:
+                    heapq.heappush(self._heap, (now, next(self._order), channel, 0, self._train[channel], event))
+            self._cond.notify()
+        if self.stepped:
+            self.run_due(now)
+
+    def stop(self, timeout=1.0):
+        """release(), then ends the thread."""
+        self.release("stop")
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ---------- Scheduling (never blocks) ----------
+    def trigger(self, event, spec: OutputSpec, t0=None):
+        """Schedules the pulse train of `spec` starting at t0 (default: now). Returns the number of pulses."""
+        t0 = self.clock() if t0 is None else t0
+        with self._cond:
+            train = next(self._trains)
+            self._train[spec.channel] = train
+            if self._level.get(spec.channel):
+                # the previous train is cut off: low first, then the new train
+                heapq.heappush(self._heap, (t0, next(self._order), spec.channel, 0, train, event))
+            for t, level in spec.edges(t0):
+                heapq.heappush(self._heap, (t, next(self._order), spec.channel, level, train, event))
+            self._cond.notify()
+        return spec.pulses
+
+    def test_output(self, event, frequency):
+        """One second of pulses at `frequency` on the event's default channel (hardware test panel)."""
+        spec = output_spec({"enabled": True, "frequency": frequency}, event)
+        return self.trigger(event, spec) if spec is not None else 0
+
+    # ---------- Timer thread ----------
+    def _run(self):
+        _raise_priority()
+        while True:
+            with self._cond:
+                while True:
+                    if self._heap:
+                        remaining = self._heap[0][0] - time.perf_counter()
+                        if remaining <= self.spin_s:
+                            break
+                        self._cond.wait(remaining - self.spin_s)
+                    elif not self._running:
+                        return
+                    else:
+                        self._cond.wait()
+                deadline, _, channel, level, train, event = heapq.heappop(self._heap)
+                if train != self._train.get(channel):
+                    continue                     # replaced by a newer train
+                self._level[channel] = level
+            while time.perf_counter() < deadline:
+                pass
+            self._issue(event, channel, level, deadline)
+
+    def run_due(self, now):
+        """Issues every edge due at `now` (stepped clock; called whenever it advances)."""
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, _, channel, level, train, event = heapq.heappop(self._heap)
+                if train == self._train.get(channel):
+                    self._level[channel] = level
+                    due.append((event, channel, level, deadline))
+        for edge in due:
+            self._issue(*edge, issued=now)
+
+    def _issue(self, event, channel, level, deadline, issued=None):
+        row = [event, channel, level, deadline, time.perf_counter() if issued is None else issued, None]
+        self.log.append(row)
+        data = b'T' + bytes((ord('0') + channel, ord('0') + level))
+        if not self.state.devices.submit(self.board, data, on_ack=lambda t: row.__setitem__(5, t)):
+            self.logger.warning("[WARNING] Output board '%s' not available, edge on channel %d dropped.", self.board, channel)
+
+    # ---------- Timing log ----------
+    def reset_log(self):
+        self.log.clear()
+
+    def summary(self):
+        """Issue and ack error (ms, relative to the scheduled edge) percentiles."""
+        rows = list(self.log)
+        issued = sorted(1000.0 * (r[4] - r[3]) for r in rows)
+        acked = sorted(1000.0 * (r[5] - r[3]) for r in rows if r[5] is not None)
+
+        def pct(values):
+            if not values:
+                return {"n": 0}
+            n = len(values)
+            return {"n": n, "p50_ms": values[n // 2], "p99_ms": values[min(n - 1, n * 99 // 100)],
+                    "max_ms": values[-1]}
+        return {"edges": len(rows), "issue_error": pct(issued), "ack_delay": pct(acked),
+                "unacknowledged": len(rows) - len(acked)}
+
+    def format_summary(self):
+        s = self.summary()
+        if not s["edges"]:
+            return "[OUTPUT] No output edges."
+        line = (f"[OUTPUT] {s['edges']} edges, issue error p50 {s['issue_error']['p50_ms']:.3f} / "
+                f"p99 {s['issue_error']['p99_ms']:.3f} ms")
+        if s["ack_delay"]["n"]:
+            line += f", acked after p50 {s['ack_delay']['p50_ms']:.2f} / p99 {s['ack_delay']['p99_ms']:.2f} ms"
+        if s["unacknowledged"]:
+            line += f", {s['unacknowledged']} unacknowledged"
+        return line
+
+    def write_log(self, session_path, rows=None):
+        """Writes output_timing.csv of rows (default: the current log; times in seconds of the scheduler's clock, the Engine clock)."""
+        path = os.path.join(session_path, TIMING_NAME)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["event", "channel", "level", "scheduled_s", "issued_s", "acked_s",
+                             "issue_error_ms", "ack_delay_ms"])
+            for event, channel, level, scheduled, issued, acked in (list(self.log) if rows is None else rows):
+                writer.writerow([event, channel, level, f"{scheduled:.6f}", f"{issued:.6f}",
+                                 "" if acked is None else f"{acked:.6f}",
+                                 f"{1000.0 * (issued - scheduled):.3f}",
+                                 "" if acked is None else f"{1000.0 * (acked - scheduled):.3f}"])
+        return path
+
+
+def _raise_priority():
+    """Best effort: raises the calling thread's scheduling priority (Linux, needs privileges)."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), -10)
+    except (AttributeError, OSError):
+        pass
+
+
+def get_output_scheduler(state=None):
+    """The state's running OutputScheduler (created on first use)."""
+    state = state or shared_states
+    scheduler = getattr(state, "output_scheduler", None)
+    if scheduler is None:
+        scheduler = OutputScheduler(state)
+        scheduler.start()
+        state.output_scheduler = scheduler
+    return scheduler
@@ -6,6 +6,8 @@ import pyqtgraph as pg
 from pyqtgraph.Qt import QtWidgets, QtCore
 import shared_states as S
 
+HISTORY_POINTS = 2000  # points per curve in the whole-session view
+
 class PlotWindow(QtWidgets.QMainWindow):
     def __init__(self, update_hz=30):
         super().__init__()
@@ -29,23 +31,32 @@ class PlotWindow(QtWidgets.QMainWindow):
         self.camera_view = pg.ImageView(view=pg.PlotItem())
         layout.addWidget(self.camera_view, stretch=2)
 
+        # Whole-session view: plots query the history pyramids for the visible range
+        self.history_box = QtWidgets.QCheckBox("Whole session (zoomable)")
+        self.history_box.toggled.connect(self._on_history_toggled)
+        layout.addWidget(self.history_box)
+
         # Sensor plots grid (GraphicsLayoutWidget)
         self.plots_layout = pg.GraphicsLayoutWidget()
         layout.addWidget(self.plots_layout, stretch=3)
 
-        self.sensor_curves = []
-        # Build a 4x4 grid of plots
-        for row in range(4):
-            for col in range(4):
-                idx = row * 4 + col
-                p = self.plots_layout.addPlot(row=row, col=col, title=f"Sensor {idx+1}")
-                p.showGrid(x=True, y=True)
-                p.setLabel('left', "Value")
-                p.setLabel('bottom', "Time (s)")
-                # assign a visible colored pen
-                color = (idx * 15 % 255, 100, 255)
-                curve = p.plot([], [], pen=pg.mkPen(color=color, width=1))
-                self.sensor_curves.append(curve)
+        self.sensor_curves = []  # (buffer index, curve, plot)
+        # One plot per configured sensor port, laid out in a near-square grid
+        rows, cols = S.topology.plot_grid()
+        for n, port in enumerate(S.topology.sensor_ports):
+            row, col = divmod(n, cols)
+            idx = port - 1
+            p = self.plots_layout.addPlot(row=row, col=col, title=f"Sensor {port}")
+            p.showGrid(x=True, y=True)
+            p.setLabel('left', "Value")
+            p.setLabel('bottom', "Time (s)")
+            # the buffers hold min/max pairs; 'peak' keeps them when zoomed out further
+            p.setDownsampling(auto=True, mode='peak')
+            p.setClipToView(True)
+            # assign a visible colored pen
+            color = (idx * 15 % 255, 100, 255)
+            curve = p.plot([], [], pen=pg.mkPen(color=color, width=1))
+            self.sensor_curves.append((idx, curve, p))
 
         # Timer for updates
         self.timer = QtCore.QTimer()
@@ -74,20 +85,43 @@ class PlotWindow(QtWidgets.QMainWindow):
                 print(f"[PlotWindow] camera update error: {e}")
 
         # Update sensor curves
-        for sid in range(16):
+        history_mode = self.history_box.isChecked()
+        for sid, curve, plot in self.sensor_curves:
+            if history_mode:
+                self._show_history(sid, curve, plot)
+                continue
             try:
-                times = list(S.gui_time_buffers[sid])
-                vals = list(S.gui_plot_buffers[sid])
+                times = np.array(S.gui_time_buffers[sid], dtype=np.float64)
+                vals = np.array(S.gui_plot_buffers[sid], dtype=np.float64)
             except IndexError:
-                times = []
-                vals = []
+                times = vals = np.zeros(0)
 
-            if times and vals and len(times) == len(vals):
-                t0 = times[0]
-                rel_times = [t - t0 for t in times]
-                self.sensor_curves[sid].setData(rel_times, vals)
+            if len(times) and len(times) == len(vals):
+                curve.setData(times - times[0], vals)
             else:
-                self.sensor_curves[sid].setData([], [])
+                curve.setData([], [])
+
+    def _on_history_toggled(self, checked):
+        for _, curve, plot in self.sensor_curves:
+            curve.setData([], [])
+            plot.setLabel('bottom', "Session time (s)" if checked else "Time (s)")
+            plot.enableAutoRange(x=True, y=True)
+
+    def _show_history(self, sid, curve, plot):
+        pyramid = getattr(S, "sensor_history", {}).get(sid)
+        span = pyramid.time_range() if pyramid is not None else None
+        if span is None:
+            curve.setData([], [])
+            return
+        origin = span[0]
+        view = plot.getViewBox()
+        if view.autoRangeEnabled()[0]:
+            t0 = t1 = None
+        else:
+            x0, x1 = view.viewRange()[0]
+            t0, t1 = origin + x0, origin + x1
+        t, v = pyramid.query(t0, t1, max_points=HISTORY_POINTS)
+        curve.setData(t - origin, v)
 
     def closeEvent(self, event):
         try:
@@ -0,0 +1,294 @@
+# pose_inference.py
+"""
+Pose inference on a pool of CPU worker processes.
+
+The Engine hands every camera frame to PoseProvider.submit(). Frames are
+copied into a ring of shared-memory slots (no pickling of pixel data) and
+the newest pending frames are dispatched, as one small batch, whenever a
+worker is idle. If the workers fall behind, the oldest pending frames are
+dropped ("latest frame wins"), so latency stays bounded by about one batch.
+Results come back with the original frame timestamp.
+
+Models plug in as "module:Class" (see PoseModel). They are imported in the
+workers, so heavy frameworks are loaded there and not in the acquisition
+process. Keypoints are normalized to the frame ([0..1], like the tracker).
+
+Config/arena.json (optional):
+    "pose": {"model": "pose_inference:CentroidModel", "workers": 2, "max_batch": 4,
+             "model_kwargs": {}}
+"""
+import importlib
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from logging_setup import get_logger
+
+log = get_logger("pose")
+
+
+# ---------- Model interface ----------
+class PoseModel:
+    """
+    Base class for pose models.
+
+    bodyparts: keypoint names, in output order (class attribute, read by the
+               host process without loading the model).
+    load():    called once inside the worker before the first batch.
+    predict(): frames uint8 [B, H, W, 3] (BGR) -> float [B, K, 3] with
+               (x_px, y_px, likelihood) per keypoint.
+    """
+    bodyparts = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def load(self):
+        pass
+
+    def predict(self, frames):
+        raise NotImplementedError
+
+
+class CentroidModel(PoseModel):
+    """Stand-in model: one keypoint at the centroid of the darkest pixels."""
+    bodyparts = ["body"]
+
+    def __init__(self, step=4, k=2.0, delay=0.0):
+        super().__init__(step=step, k=k, delay=delay)
+        self.step = int(step)
+        self.k = float(k)
+        self.delay = float(delay)  # extra seconds per batch, to emulate a slow model
+
+    def predict(self, frames):
+        s = self.step
+        gray = frames[:, ::s, ::s, :].mean(axis=3)
+        out = np.zeros((len(frames), 1, 3), dtype=np.float32)
+        ys = np.arange(gray.shape[1], dtype=np.float32) * s + s / 2
+        xs = np.arange(gray.shape[2], dtype=np.float32) * s + s / 2
+        for i, g in enumerate(gray):
+            mask = g < g.mean() - self.k * g.std()
+            n = np.count_nonzero(mask)
+            if n:
+                out[i, 0] = (np.count_nonzero(mask, axis=0) @ xs / n,
+                             np.count_nonzero(mask, axis=1) @ ys / n,
+                             1.0)
+        if self.delay:
+            time.sleep(self.delay)
+        return out
+
+
+def load_model_class(spec):
+    """'module:Class' (or a class) -> class."""
+    if not isinstance(spec, str):
+        return spec
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+# ---------- Worker process ----------
+def _worker_main(model_spec, model_kwargs, shm_name, n_slots, frame_shape, task_q, result_q):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = None
+    try:
+        slots = np.ndarray((n_slots, *frame_shape), dtype=np.uint8, buffer=shm.buf)
+        model = load_model_class(model_spec)(**(model_kwargs or {}))
+        model.load()
+        while True:
+            task = task_q.get()
+            if task is None:
+                break
+            slot_ids, stamps = task
+            t0 = time.perf_counter()
+            error = None
+            try:
+                keypoints = np.asarray(model.predict(slots[slot_ids]), dtype=np.float32)
+            except Exception as e:
+                # reported by the host's result thread (this process has no LogWriter)
+                keypoints, error = None, str(e)
+            result_q.put((slot_ids, stamps, keypoints, time.perf_counter() - t0, error))
+    finally:
+        del slots
+        shm.close()
+
+
+# ---------- Host side ----------
+class PoseStats:
+    def __init__(self, maxlen=10000):
+        self.submitted = 0
+        self.skipped = 0          # frames dropped because newer ones arrived
+        self.batches = 0
+        self.processed = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=maxlen)   # frame tstamp -> result available (s)
+        self.batch_sizes = deque(maxlen=maxlen)
+        self.infer_times = deque(maxlen=maxlen)
+
+
+class PoseProvider:
+    def __init__(self, model="pose_inference:CentroidModel", model_kwargs=None,
+                 workers=2, max_batch=4, on_result=None):
+        """
+        model:     'module:Class' of a PoseModel
+        workers:   number of worker processes
+        max_batch: frames per batch, also the number of frames kept pending
+        on_result: callable(t, keypoints[K, 3]) called from the result thread,
+                   keypoints normalized to the frame
+        """
+        self.model_spec = model
+        self.model_kwargs = dict(model_kwargs or {})
+        self.bodyparts = list(load_model_class(model).bodyparts)
+        self.n_workers = max(1, int(workers))
+        self.max_batch = max(1, int(max_batch))
+        self.on_result = on_result
+        self.stats = PoseStats()
+        self.latest = None                 # (t, keypoints)
+
+        self.n_slots = self.n_workers * self.max_batch + self.max_batch
+        self.frame_shape = None
+        self._shm = None
+        self._slots = None
+        self._free = []
+        self._pending = deque()            # (slot, t), oldest first
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._procs = []
+        self._ctx = multiprocessing.get_context("spawn")
+        self._task_q = None
+        self._result_q = None
+        self._result_thread = None
+        self._running = threading.Event()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """PoseProvider from the arena config's "pose" section, or None if no model is set."""
+        cfg = dict(config.get("pose") or {})
+        if not cfg.get("model"):
+            return None
+        return cls(model=cfg["model"], model_kwargs=cfg.get("model_kwargs"),
+                   workers=cfg.get("workers", 2), max_batch=cfg.get("max_batch", 4), **kwargs)
+
+    @property
+    def n_keypoints(self):
+        return len(self.bodyparts)
+
+    # ---------- Lifecycle ----------
+    def start(self, frame_shape):
+        """Allocates the shared frame slots and starts the workers (called on the first frame)."""
+        if self._running.is_set():
+            return
+        self.frame_shape = tuple(frame_shape)
+        nbytes = int(np.prod(self.frame_shape)) * self.n_slots
+        self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._slots = np.ndarray((self.n_slots, *self.frame_shape), dtype=np.uint8, buffer=self._shm.buf)
+        self._free = list(range(self.n_slots))
+        self._pending.clear()
+        self._in_flight = 0
+        self._task_q = self._ctx.Queue()
+        self._result_q = self._ctx.Queue()
+        for i in range(self.n_workers):
+            p = self._ctx.Process(target=_worker_main, name=f"PoseWorker-{i}", daemon=True,
+                                  args=(self.model_spec, self.model_kwargs, self._shm.name,
+                                        self.n_slots, self.frame_shape, self._task_q, self._result_q))
+            p.start()
+            self._procs.append(p)
+        self._running.set()
+        self._result_thread = threading.Thread(target=self._result_loop, name="PoseResults", daemon=True)
+        self._result_thread.start()
+        log.info("[POSE] %d worker(s) started for %s (%s).", self.n_workers, self.model_spec, ", ".join(self.bodyparts))
+
+    def stop(self):
+        if not self._running.is_set():
+            return
+        self._running.clear()
+        for _ in self._procs:
+            self._task_q.put(None)
+        # drain outstanding batches before joining, so no worker blocks on a full pipe
+        if self._result_thread is not None:
+            self._result_thread.join(timeout=5.0)
+            self._result_thread = None
+        for p in self._procs:
+            p.join(timeout=5.0)
+            if p.is_alive():
+                p.terminate()
+        self._procs.clear()
+        self._slots = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    # ---------- Submission ----------
+    def submit(self, t, frame):
+        """Queues a frame for inference; returns False if it was skipped."""
+        if frame is None:
+            return False
+        if not self._running.is_set():
+            self.start(frame.shape)
+        if frame.shape != self.frame_shape:
+            self.stats.skipped += 1
+            return False
+        with self._lock:
+            self.stats.submitted += 1
+            if self._free:
+                slot = self._free.pop()
+            elif self._pending:
+                # latest frame wins: reuse the slot of the oldest pending frame
+                slot, _ = self._pending.popleft()
+                self.stats.skipped += 1
+            else:
+                self.stats.skipped += 1
+                return False
+            self._slots[slot] = frame
+            self._pending.append((slot, t))
+            while len(self._pending) > self.max_batch:
+                old_slot, _ = self._pending.popleft()
+                self._free.append(old_slot)
+                self.stats.skipped += 1
+            self._dispatch_locked()
+        return True
+
+    def _dispatch_locked(self):
+        while self._pending and self._in_flight < self.n_workers:
+            batch = list(self._pending)
+            self._pending.clear()
+            self._in_flight += 1
+            self.stats.batches += 1
+            self.stats.batch_sizes.append(len(batch))
+            self._task_q.put(([s for s, _ in batch], [t for _, t in batch]))
+
+    # ---------- Results ----------
+    def _result_loop(self):
+        w, h = self.frame_shape[1], self.frame_shape[0]
+        scale = np.array([1.0 / w, 1.0 / h, 1.0], dtype=np.float32)
+        while self._running.is_set() or self._in_flight:
+            try:
+                slot_ids, stamps, keypoints, infer_time, error = self._result_q.get(timeout=0.1)
+            except queue.Empty:
+                if not any(p.is_alive() for p in self._procs):
+                    break
+                continue
+            with self._lock:
+                self._free.extend(slot_ids)
+                self._in_flight -= 1
+                if self._running.is_set():
+                    self._dispatch_locked()
+            self.stats.infer_times.append(infer_time)
+            if keypoints is None:
+                self.stats.errors += 1
+                log.error("[POSE] Model error: %s", error)
+                continue
+            now = time.perf_counter()
+            for t, kp in zip(stamps, keypoints * scale):
+                self.stats.processed += 1
+                self.stats.latencies.append(now - t)
+                self.latest = (t, kp)
+                if self.on_result is not None:
+                    try:
+                        self.on_result(t, kp)
+                    except Exception as e:
+                        log.error("[POSE] Result callback error: %s", e)
@@ -0,0 +1,179 @@
+# position_tracker.py
+"""
+CPU-only animal position tracking from the arena camera.
+
+PositionTracker finds the animal as the largest deviation from a running
+background model on a downscaled (and optionally cropped) grayscale frame and
+takes the centroid from the image moments of that foreground mask. All steps
+are vectorized numpy operations on a few thousand pixels, so one core keeps up
+with the camera frame rate.
+
+Positions are normalized to the full frame ([0..1], x to the right, y down),
+which is the coordinate system TrialController uses for the light sphere.
+"""
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class PositionStream:
+    """
+    Latest tracked positions, written by the Engine and read by the trial
+    controller. Samples are (t, x, y, confidence) with t on the Engine clock.
+    """
+    def __init__(self, maxlen=600):
+        self._lock = threading.Lock()
+        self._latest = None
+        self.history = deque(maxlen=maxlen)
+
+    def push(self, t, x, y, confidence):
+        sample = (t, x, y, confidence)
+        with self._lock:
+            self._latest = sample
+            self.history.append(sample)
+
+    def latest(self):
+        with self._lock:
+            return self._latest
+
+    def since(self, t):
+        """Samples newer than t, oldest first (t=None: the whole history)."""
+        with self._lock:
+            if t is None:
+                return list(self.history)
+            out = []
+            for sample in reversed(self.history):
+                if sample[0] <= t:
+                    break
+                out.append(sample)
+        out.reverse()
+        return out
+
+    def clear(self):
+        with self._lock:
+            self._latest = None
+            self.history.clear()
+
+
+class PositionTracker:
+    def __init__(self, scale=0.25, roi=None, threshold=25, bg_alpha=0.02,
+                 min_area=0.0005, max_area=0.25, warmup_frames=30, warmup_stride=5,
+                 polarity="dark"):
+        """
+        scale:     downscale factor applied by pixel striding (0.25 -> every 4th pixel)
+        roi:       (x0, y0, x1, y1) in normalized frame coordinates, default full frame
+        threshold: gray level difference to the background counted as foreground
+        bg_alpha:  background learning rate for pixels outside the animal (pixels
+                   under it learn 10x slower, so a resting animal is not absorbed at once)
+        min_area:  foreground fraction of the ROI below which nothing is reported
+        max_area:  foreground fraction above which the frame is treated as a global
+                   change (light switched, camera bumped) and the background re-learned
+        warmup_frames, warmup_stride: the initial background is the median of
+                   warmup_frames frames taken every warmup_stride frames, so an
+                   animal already moving in the arena is not baked into it
+        polarity:  'dark' (animal darker than the floor), 'light' or 'any'. With a
+                   known polarity the "ghost" left where the animal sat during
+                   warm-up is not foreground and heals at the normal rate.
+        """
+        self.step = max(1, int(round(1.0 / scale)))
+        self.roi = roi
+        self.threshold = float(threshold)
+        self.bg_alpha = float(bg_alpha)
+        self.min_area = float(min_area)
+        self.max_area = float(max_area)
+        self.warmup_frames = max(1, int(warmup_frames))
+        self.warmup_stride = max(1, int(warmup_stride))
+        if polarity not in ("dark", "light", "any"):
+            raise ValueError(f"Unknown polarity: {polarity}")
+        self.polarity = polarity
+        self._n_seen = 0
+        self.background = None
+        self._warmup = []
+        self._shape = None
+        self._grid = None
+
+    def reset(self):
+        self.background = None
+        self._warmup = []
+        self._n_seen = 0
+
+    def set_background(self, frame):
+        """Uses a frame of the empty arena as background (skips the warm-up)."""
+        self.background = self._prepare(frame)
+        self._warmup = []
+
+    def _prepare(self, frame):
+        """Crops to the ROI, downsamples and converts to float32 gray."""
+        h, w = frame.shape[:2]
+        if self._shape != (h, w):
+            x0, y0, x1, y1 = self.roi or (0.0, 0.0, 1.0, 1.0)
+            self._slices = (slice(int(y0 * h), int(y1 * h), self.step),
+                            slice(int(x0 * w), int(x1 * w), self.step))
+            # pixel centres of the sampled grid (full-frame pixel units)
+            self._grid = (np.arange(w)[self._slices[1]].astype(np.float32) + 0.5,
+                          np.arange(h)[self._slices[0]].astype(np.float32) + 0.5)
+            self._shape = (h, w)
+            self.background = None
+            self._warmup = []
+        small = frame[self._slices]
+        if small.ndim == 3:
+            # BGR -> gray (ITU-R 601 weights), on the small image only
+            small = small.astype(np.float32)
+            return small[..., 0] * 0.114 + small[..., 1] * 0.587 + small[..., 2] * 0.299
+        return small.astype(np.float32)
+
+    def update(self, frame):
+        """
+        Processes one frame. Returns (x, y, confidence) or None if no animal
+        was found (warm-up, empty arena or global change).
+        """
+        if frame is None:
+            return None
+        if self.background is None:
+            self._n_seen += 1
+            if (self._n_seen - 1) % self.warmup_stride:
+                return None
+            self._warmup.append(self._prepare(frame))
+            if len(self._warmup) >= self.warmup_frames:
+                self.background = np.median(np.stack(self._warmup), axis=0).astype(np.float32)
+                self._warmup = []
+            return None
+
+        gray = self._prepare(frame)
+        diff = gray - self.background
+        if self.polarity == "dark":
+            mask = diff < -self.threshold
+        elif self.polarity == "light":
+            mask = diff > self.threshold
+        else:
+            mask = np.abs(diff) > self.threshold
+        n_fg = int(np.count_nonzero(mask))
+        area = n_fg / mask.size
+
+        if area > self.max_area:
+            self.background = gray
+            return None
+
+        # learn the background everywhere except under the animal
+        alpha = np.where(mask, self.bg_alpha * 0.1, self.bg_alpha).astype(np.float32)
+        self.background += alpha * diff
+
+        if area < self.min_area:
+            return None
+
+        # first and second moments from the row/column projections
+        xs, ys = self._grid
+        col_mass = np.count_nonzero(mask, axis=0).astype(np.float32)
+        row_mass = np.count_nonzero(mask, axis=1).astype(np.float32)
+        cx = float(col_mass @ xs) / n_fg
+        cy = float(row_mass @ ys) / n_fg
+
+        # compact blobs score high, scattered noise low: compare the mask's
+        # spread with that of a filled disc of the same area (r^2 / 2)
+        var = float(col_mass @ (xs - cx) ** 2 + row_mass @ (ys - cy) ** 2) / n_fg
+        disc_var = n_fg * self.step * self.step / (2.0 * np.pi)
+        confidence = min(1.0, disc_var / var) if var > 0 else 1.0
+
+        h, w = self._shape
+        return cx / w, cy / h, confidence
@@ -0,0 +1,179 @@
+# profiler.py
+"""
+On-demand sampling profiler for a running session.
+
+A capture samples the stacks of every Python thread (AcqThread, ProcThread,
+WriterThread, TrialThread, the GUI loop in MainThread, ...) every
+interval_s from its own "Profiler" thread via sys._current_frames(), for
+duration_s or until it is stopped. Nothing is paused or instrumented, so
+acquisition keeps running; with a dozen threads the default 5 ms interval
+costs the Profiler thread about 4% of one core (its own row in the CSV).
+
+Written into the session folder (or the working directory without one):
+    profile_<time>.collapsed     one line per stack, "thread;file:func;... count"
+                                 (input for flamegraph.pl, speedscope, inferno)
+    profile_<time>_threads.csv   per thread: samples, CPU time and CPU share of the capture
+
+Start/stop it from the hardware test panel, with SIGUSR1 (headless sessions,
+see install_signal_handler) or from another shell:
+    python profiler.py <pid>
+"""
+import csv
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+import shared_states
+from logging_setup import get_logger
+
+log = get_logger("profiler")
+
+DEFAULT_INTERVAL_S = 0.005
+DEFAULT_DURATION_S = 10.0
+MAX_DEPTH = 64
+
+
+class SamplingProfiler:
+    def __init__(self, state=None, interval_s=DEFAULT_INTERVAL_S, duration_s=DEFAULT_DURATION_S):
+        self.state = state or shared_states
+        self.interval_s = float(interval_s)
+        self.duration_s = float(duration_s)
+        self.stacks = Counter()             # collapsed stack -> samples
+        self.samples = Counter()            # thread name -> samples
+        self.ticks = 0
+        self.last_paths = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # ---------- Control ----------
+    def start(self, duration_s=None):
+        """Starts a capture (False if one is running already)."""
+        with self._lock:
+            if self.running:
+                return False
+            self._stop.clear()
+            duration = self.duration_s if duration_s is None else float(duration_s)
+            self._thread = threading.Thread(target=self._run, args=(duration,), name="Profiler", daemon=True)
+            self._thread.start()
+        log.info("[PROFILE] Capturing all threads for %.0f s (every %.1f ms).", duration, 1000 * self.interval_s)
+        return True
+
+    def stop(self, wait=False):
+        """Ends the running capture early (its files are still written)."""
+        self._stop.set()
+        thread = self._thread
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def toggle(self, duration_s=None):
+        if self.running:
+            self.stop()
+            return False
+        return self.start(duration_s)
+
+    # ---------- Sampling thread ----------
+    def _run(self, duration):
+        own = threading.get_ident()
+        self.stacks.clear()
+        self.samples.clear()
+        self.ticks = 0
+        cpu_start = _thread_cpu_times()
+        t_start = time.perf_counter()
+        t_end = t_start + duration
+        next_tick = t_start
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            if now >= t_end:
+                break
+            if now < next_tick:
+                self._stop.wait(next_tick - now)
+                continue
+            next_tick = max(next_tick + self.interval_s, now)
+            self._sample(own)
+        elapsed = time.perf_counter() - t_start
+        cpu_end = _thread_cpu_times()
+        try:
+            self.last_paths = self._write(elapsed, cpu_start, cpu_end)
+        except OSError as e:
+            log.error("[ERROR] Could not write the profile: %s", e)
+            return
+        log.info("[PROFILE] %d samples in %.1f s -> %s", self.ticks, elapsed, self.last_paths[0])
+
+    def _sample(self, own):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        self.ticks += 1
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            calls = []
+            while frame is not None and len(calls) < MAX_DEPTH:
+                code = frame.f_code
+                calls.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            name = names.get(ident, f"thread-{ident}")
+            calls.append(name)
+            self.stacks[";".join(reversed(calls))] += 1
+            self.samples[name] += 1
+
+    def _write(self, elapsed, cpu_start, cpu_end):
+        folder = getattr(self.state, "current_session_path", None) or os.getcwd()
+        base = os.path.join(folder, time.strftime("profile_%Y%m%d_%H%M%S"))
+        collapsed = base + ".collapsed"
+        with open(collapsed, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        threads = base + "_threads.csv"
+        with open(threads, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["thread", "samples", "cpu_s", "cpu_percent"])
+            for name in sorted(set(self.samples) | set(cpu_end)):
+                cpu = cpu_end.get(name, 0.0) - cpu_start.get(name, 0.0) if name in cpu_end else None
+                writer.writerow([name, self.samples.get(name, 0),
+                                 "" if cpu is None else f"{cpu:.4f}",
+                                 "" if cpu is None else f"{100.0 * cpu / elapsed:.1f}"])
+        return collapsed, threads
+
+
+def _thread_cpu_times():
+    """CPU seconds used so far per thread name (Linux/macOS; empty where per-thread clocks are missing)."""
+    times = {}
+    if not hasattr(time, "pthread_getcpuclockid"):
+        return times
+    for t in threading.enumerate():
+        try:
+            cpu = time.clock_gettime(time.pthread_getcpuclockid(t.ident))
+        except (OSError, TypeError, OverflowError):
+            continue                # thread ended meanwhile
+        times[t.name] = times.get(t.name, 0.0) + cpu
+    return times
+
+
+def get_profiler(state=None):
+    """The state's SamplingProfiler (created on first use)."""
+    state = state or shared_states
+    profiler = getattr(state, "profiler", None)
+    if profiler is None:
+        profiler = SamplingProfiler(state)
+        state.profiler = profiler
+    return profiler
+
+def install_signal_handler(state=None, signum=getattr(signal, "SIGUSR1", None)):
+    """SIGUSR1 starts or stops a capture (call from the main thread; no-op on Windows)."""
+    if signum is None:
+        return False
+    signal.signal(signum, lambda *_: get_profiler(state).toggle())
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or not hasattr(signal, "SIGUSR1"):
+        raise SystemExit("Usage: python profiler.py <pid of a running session>  (starts/stops a capture)")
+    os.kill(int(sys.argv[1]), signal.SIGUSR1)
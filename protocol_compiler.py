@@ -0,0 +1,372 @@
+# protocol_compiler.py
+"""
+Protocols validated and compiled once into an immutable CompiledProtocol.
+
+compile_protocol() checks the protocol dict (as written by the protocol
+designer), normalizes it into plain attributes and pregenerates the whole
+trial schedule from a seed: light sphere position, Y-maze cue swap and the
+reward-gate seed of every trial, from which the outcome of each lick is
+derived (gate_draw). The trial loop only reads these entries, so a session
+is reproducible from its protocol and seed. A session that outlasts the
+pregenerated schedule (fixed_time trials shorter than assumed) continues
+the same streams with extend_schedule().
+
+The seed is taken from the protocol ("seed") or drawn fresh and recorded.
+Every random stream (sphere, Y-maze, gates) is seeded separately, so e.g.
+changing a reward probability does not move the light spheres. The compiled
+protocol is saved as compiled_protocol.json in the session folder and can be
+loaded back with load_compiled().
+
+Outputs: every enabled "digital_analog_outputs" event becomes an OutputSpec
+(TTL channel, pulse train) for output_scheduler.py. Besides "enabled" and
+"frequency" an event may set "channel" (default: its position in
+OUTPUT_EVENTS), "pulses" or "duration_s" (default 1 s of pulses; one pulse
+at frequency 0) and "pulse_width_ms" (default 10, at most half a period).
+
+Reward gating: reward i dispenses with probability reward<i>_probability
+(top level, as written by the designer). The older
+"reward_probability": {"enabled": ..., "per_reward": {"1": p}} section still
+overrides these when enabled.
+"""
+import functools
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+from types import MappingProxyType
+from typing import NamedTuple, Optional, Tuple
+
+from zones import sphere_radius
+
+SCHEMA_VERSION = 2
+COMPILED_NAME = "compiled_protocol.json"
+MIN_TRIAL_S = 1.0               # shortest trial assumed when sizing fixed_time schedules in position mode
+MAX_SCHEDULE_TRIALS = 100000
+OPEN_ENDED_TRIALS = 10000       # schedule length of sessions without trial count or duration
+
+EXPERIMENT_TYPES = ("Open-Field Experiment", "Y-Maze")
+LED_MODES = {"single": "single", "neighbour": "neighbour", "neighbor": "neighbour", "all": "all"}
+SPHERE_AREA = (0.2, 0.8)        # random light sphere centres, normalized arena units
+OUTPUT_EVENTS = ("session_start", "intertrial_phase", "light_sphere_dwell", "reward_phase", "reward_port_licks")
+MAX_TTL_CHANNELS = 9            # firmware addresses TTL outputs with the digits '1'..'9'
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class TrialPlan(NamedTuple):
+    index: int                  # 1-based trial number
+    sphere_x: float
+    sphere_y: float
+    ymaze_swap: bool
+    gate_seed: int              # seeds the reward gate draws of this trial (see gate_draw)
+    gate_p: Tuple[float, ...]   # dispense probability per reward (reward 1 first; 1.0 without gating)
+
+    def dispense(self, reward_id, lick_number):
+        """Gate outcome of the lick_number-th (0-based) lick on reward reward_id in this trial."""
+        if not 1 <= reward_id <= len(self.gate_p):
+            return True
+        p = self.gate_p[reward_id - 1]
+        return p >= 1.0 or gate_draw(self.gate_seed, reward_id, lick_number) < p
+
+
+def gate_draw(gate_seed, reward_id, lick_number):
+    """Uniform [0, 1) value of one lick, fixed by (trial gate seed, reward, lick number); any number of licks."""
+    digest = hashlib.blake2b(f"{gate_seed}/{reward_id}/{lick_number}".encode("ascii"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2.0 ** 64
+
+
+class OutputSpec(NamedTuple):
+    channel: int                # 1-based TTL output of the output board
+    frequency: float            # Hz (0: single pulse)
+    pulses: int
+    width: float                # pulse width (s)
+
+    def edges(self, t0):
+        """[(t, level)] of the pulse train starting at t0."""
+        period = 1.0 / self.frequency if self.frequency > 0 else 0.0
+        out = []
+        for k in range(self.pulses):
+            t = t0 + k * period
+            out.append((t, 1))
+            out.append((t + self.width, 0))
+        return out
+
+
+def output_spec(settings, event, errors=None):
+    """OutputSpec of one digital_analog_outputs entry (None if disabled)."""
+    errors = [] if errors is None else errors
+    label = f"digital_analog_outputs.{event}"
+    if not isinstance(settings, dict) or not settings.get("enabled"):
+        return None
+    default_channel = OUTPUT_EVENTS.index(event) + 1 if event in OUTPUT_EVENTS else 1
+    channel = _number(errors, settings.get("channel", default_channel), f"{label}.channel",
+                      1, MAX_TTL_CHANNELS, integer=True)
+    frequency = _number(errors, settings.get("frequency") or 0, f"{label}.frequency", 0, 1000)
+    if channel is None or frequency is None:
+        return None
+    if "pulses" in settings:
+        pulses = _number(errors, settings["pulses"], f"{label}.pulses", 1, 100000, integer=True)
+    else:
+        duration = _number(errors, settings.get("duration_s", 1.0), f"{label}.duration_s", 0)
+        pulses = max(1, int(round(frequency * duration))) if duration is not None else None
+    width = _number(errors, settings.get("pulse_width_ms", 10.0), f"{label}.pulse_width_ms", 0.1) 
+    if pulses is None or width is None:
+        return None
+    width /= 1000.0
+    if frequency > 0:
+        width = min(width, 0.5 / frequency)
+    return OutputSpec(channel, frequency, pulses if frequency > 0 else 1, width)
+
+
+class CompiledProtocol:
+    """Read-only result of compile_protocol(); attributes are set once in __init__."""
+    _FIELDS = ("name", "experiment_type", "seed", "digest", "trial_mode", "trial_count", "session_duration",
+               "phase_length_mode", "trial_phase_length", "intertrial_phase_length", "num_rewards",
+               "reward_probabilities", "gating_enabled", "pwm", "led_mode", "sphere_location_mode",
+               "sphere_size", "sphere_radius", "dwell_threshold", "ymaze_enabled", "cue_switch_probability",
+               "outputs", "schedule")
+    __slots__ = _FIELDS
+
+    def __init__(self, **fields):
+        for name in self._FIELDS:
+            value = fields[name]
+            object.__setattr__(self, name, MappingProxyType(dict(value)) if name == "outputs" else value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledProtocol is immutable")
+
+    def trial(self, index) -> Optional[TrialPlan]:
+        """Plan of the 1-based trial `index`; None once the schedule is exhausted."""
+        return self.schedule[index - 1] if 0 < index <= len(self.schedule) else None
+
+    def __len__(self):
+        return len(self.schedule)
+
+    def __repr__(self):
+        return f"CompiledProtocol({self.name!r}, seed={self.seed}, {len(self.schedule)} trials)"
+
+    # ---------- Persistence ----------
+    def to_dict(self):
+        d = {name: getattr(self, name) for name in self._FIELDS if name != "schedule"}
+        d["reward_probabilities"] = list(self.reward_probabilities)
+        d["pwm"] = list(self.pwm)
+        d["outputs"] = {event: list(spec) for event, spec in self.outputs.items()}
+        d["schema_version"] = SCHEMA_VERSION
+        d["schedule"] = [[p.index, p.sphere_x, p.sphere_y, p.ymaze_swap, p.gate_seed, list(p.gate_p)]
+                         for p in self.schedule]
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        if d.get("schema_version") != SCHEMA_VERSION:
+            raise ProtocolError(f"Unsupported compiled protocol version {d.get('schema_version')}")
+        fields = {name: d[name] for name in cls._FIELDS if name not in ("schedule", "outputs")}
+        fields["outputs"] = {event: OutputSpec(int(c), float(f), int(n), float(w))
+                             for event, (c, f, n, w) in (d.get("outputs") or {}).items()}
+        fields["reward_probabilities"] = tuple(d["reward_probabilities"])
+        fields["pwm"] = tuple(d["pwm"])
+        fields["schedule"] = tuple(TrialPlan(int(i), float(x), float(y), bool(swap), int(gate_seed),
+                                             tuple(float(p) for p in gate_p))
+                                   for i, x, y, swap, gate_seed, gate_p in d["schedule"])
+        return cls(**fields)
+
+    def save(self, session_path):
+        path = os.path.join(session_path, COMPILED_NAME)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+        return path
+
+
+def load_compiled(path):
+    """CompiledProtocol from a compiled_protocol.json (or the session folder containing it)."""
+    return CompiledProtocol.from_dict(_read_compiled(path))
+
+def compiled_seed(path):
+    """Schedule seed of a compiled_protocol.json of any schema version (sessions recorded before a change)."""
+    return _read_compiled(path)["seed"]
+
+def _read_compiled(path):
+    if os.path.isdir(path):
+        path = os.path.join(path, COMPILED_NAME)
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+# ---------- Validation ----------
+def _number(errors, value, label, lo=None, hi=None, integer=False, allow_none=False):
+    if value is None and allow_none:
+        return None
+    try:
+        if isinstance(value, bool):
+            raise TypeError
+        v = int(value) if integer else float(value)
+        if integer and v != float(value):
+            raise ValueError
+    except (TypeError, ValueError):
+        errors.append(f"{label} must be {'an integer' if integer else 'a number'} (got {value!r})")
+        return None
+    if not math.isfinite(v) or (lo is not None and v < lo) or (hi is not None and v > hi):
+        errors.append(f"{label} must be in [{lo}, {hi}] (got {value!r})")
+        return None
+    return v
+
+def _choice(errors, value, label, choices):
+    if value not in choices:
+        errors.append(f"{label} must be one of {list(choices)} (got {value!r})")
+        return None
+    return value
+
+def _section(errors, protocol, key):
+    section = protocol.get(key) or {}
+    if not isinstance(section, dict):
+        errors.append(f"{key} must be an object")
+        return {}
+    return section
+
+def validate_protocol(protocol):
+    """Normalized protocol fields (without the schedule); raises ProtocolError listing every problem."""
+    if not isinstance(protocol, dict):
+        raise ProtocolError("Protocol must be a JSON object")
+    errors = []
+    f = {"name": str(protocol.get("protocol_name") or "Unnamed")}
+    f["experiment_type"] = _choice(errors, protocol.get("experiment_type", "Open-Field Experiment"),
+                                   "experiment_type", EXPERIMENT_TYPES)
+
+    trial = _section(errors, protocol, "trial_settings")
+    # anything but fixed_trials runs for session_duration seconds (no duration: until stopped)
+    f["trial_mode"] = "fixed_trials" if trial.get("mode") == "fixed_trials" else "fixed_time"
+    f["trial_count"] = f["session_duration"] = None
+    if f["trial_mode"] == "fixed_trials":
+        f["trial_count"] = _number(errors, trial.get("trial_count"), "trial_settings.trial_count",
+                                   1, MAX_SCHEDULE_TRIALS, integer=True)
+    else:
+        f["session_duration"] = _number(errors, trial.get("session_duration"), "trial_settings.session_duration",
+                                        0, allow_none=True)
+
+    phase = _section(errors, protocol, "phase_length_settings")
+    mode = phase.get("phase_length_mode", "time")
+    f["phase_length_mode"] = "time" if mode == "time" else _choice(
+        errors, mode, "phase_length_settings.phase_length_mode", ("time", "mouse_position", "position"))
+    f["trial_phase_length"] = _number(errors, phase.get("trial_phase_length", 10.0),
+                                      "phase_length_settings.trial_phase_length", 0)
+    f["intertrial_phase_length"] = _number(errors, phase.get("intertrial_phase_length", 5.0),
+                                           "phase_length_settings.intertrial_phase_length", 0)
+
+    f["num_rewards"] = _number(errors, protocol.get("num_rewards", 0), "num_rewards", 0, 2, integer=True)
+    probs = [_number(errors, protocol.get(f"reward{i}_probability", 1.0), f"reward{i}_probability", 0, 1)
+             for i in (1, 2)]
+    rp = _section(errors, protocol, "reward_probability")
+    if rp.get("enabled"):
+        for key, value in (rp.get("per_reward") or {}).items():
+            i = _number(errors, key, "reward_probability.per_reward key", 1, 2, integer=True)
+            p = _number(errors, value, f"reward_probability.per_reward.{key}", 0, 1)
+            if i is not None and p is not None:
+                probs[i - 1] = p
+    f["reward_probabilities"] = tuple(1.0 if p is None else p for p in probs)
+    f["gating_enabled"] = any(p < 1.0 for p in f["reward_probabilities"][:f["num_rewards"] or 0])
+    f["pwm"] = tuple(_number(errors, protocol.get(f"pwm_reward{i}"), f"pwm_reward{i}", 0, 255,
+                             integer=True, allow_none=True) for i in (1, 2))
+
+    led = _section(errors, protocol, "led_configuration")
+    mode = _choice(errors, led.get("mode") or "single", "led_configuration.mode", LED_MODES)
+    f["led_mode"] = LED_MODES.get(mode)
+
+    sphere = _section(errors, protocol, "light_sphere")
+    f["sphere_location_mode"] = _choice(errors, sphere.get("location_mode", "random"), "light_sphere.location_mode",
+                                        ("random", "fixed"))
+    f["sphere_size"] = _number(errors, sphere.get("size", 40.0), "light_sphere.size", 0)
+    f["sphere_radius"] = sphere_radius(f["sphere_size"]) if f["sphere_size"] is not None else None
+    f["dwell_threshold"] = _number(errors, sphere.get("dwell_time_threshold", 1.0),
+                                   "light_sphere.dwell_time_threshold", 0)
+
+    ymaze = _section(errors, protocol, "ymaze_settings")
+    f["ymaze_enabled"] = f["experiment_type"] == "Y-Maze"
+    f["cue_switch_probability"] = _number(errors, ymaze.get("cue_switch_probability", 0.5),
+                                          "ymaze_settings.cue_switch_probability", 0, 1)
+
+    outputs = _section(errors, protocol, "digital_analog_outputs")
+    f["outputs"] = {}
+    for event, settings in outputs.items():
+        spec = output_spec(settings, event, errors)
+        if spec is not None:
+            f["outputs"][event] = spec
+    if errors:
+        raise ProtocolError("Invalid protocol: " + "; ".join(errors))
+    return f
+
+
+# ---------- Schedule ----------
+def schedule_length(fields):
+    if fields["trial_mode"] == "fixed_trials":
+        return fields["trial_count"]
+    if fields["session_duration"] is None:
+        return OPEN_ENDED_TRIALS
+    if fields["phase_length_mode"] == "time":
+        shortest = max(MIN_TRIAL_S, fields["trial_phase_length"] + fields["intertrial_phase_length"])
+    else:
+        shortest = MIN_TRIAL_S
+    return min(MAX_SCHEDULE_TRIALS, int(math.ceil(fields["session_duration"] / shortest)) + 1)
+
+def build_schedule(fields, seed):
+    return tuple(itertools.islice(_plan_stream(fields, seed), schedule_length(fields)))
+
+def extend_schedule(compiled, count):
+    """The `count` TrialPlans following compiled.schedule, from the same seeded streams."""
+    fields = {name: getattr(compiled, name) for name in
+              ("sphere_location_mode", "cue_switch_probability", "gating_enabled", "reward_probabilities")}
+    start = len(compiled.schedule)
+    return tuple(itertools.islice(_plan_stream(fields, compiled.seed), start, start + count))
+
+def _plan_stream(fields, seed):
+    """Endless TrialPlans from trial 1 (a schedule is a prefix of it)."""
+    sphere_rng = random.Random(f"{seed}/sphere")
+    ymaze_rng = random.Random(f"{seed}/ymaze")
+    gate_rng = random.Random(f"{seed}/gate")
+    lo, hi = SPHERE_AREA
+    for index in itertools.count(1):
+        if fields["sphere_location_mode"] == "fixed":
+            x, y = 0.5, 0.5
+        else:
+            x, y = sphere_rng.uniform(lo, hi), sphere_rng.uniform(lo, hi)
+        swap = ymaze_rng.random() < fields["cue_switch_probability"]
+        # the draws do not depend on the probabilities: raising one only turns withheld licks into dispensed ones
+        gate_p = tuple(float(p) if fields["gating_enabled"] else 1.0 for p in fields["reward_probabilities"])
+        yield TrialPlan(index, x, y, swap, gate_rng.getrandbits(64), gate_p)
+
+
+# ---------- Compilation ----------
+def protocol_digest(protocol):
+    return hashlib.sha1(_canonical(protocol).encode("utf-8")).hexdigest()
+
+def _canonical(protocol):
+    return json.dumps(protocol, sort_keys=True, separators=(",", ":"), default=str)
+
+@functools.lru_cache(maxsize=16)
+def _compile_cached(canonical, seed):
+    protocol = json.loads(canonical)
+    fields = validate_protocol(protocol)
+    fields["seed"] = seed
+    fields["digest"] = protocol_digest(protocol)
+    fields["schedule"] = build_schedule(fields, seed)
+    return CompiledProtocol(**fields)
+
+def new_seed():
+    return random.SystemRandom().randrange(2 ** 32)
+
+def compile_protocol(protocol, seed=None):
+    """
+    Validates and compiles a protocol dict. seed defaults to the protocol's
+    "seed" entry, else a fresh one. Results are cached per (protocol, seed).
+    """
+    if seed is None:
+        seed = (protocol or {}).get("seed") if isinstance(protocol, dict) else None
+    if seed is None:
+        seed = new_seed()
+    seed = _number([], seed, "seed", 0, integer=True)
+    if seed is None:
+        raise ProtocolError("Invalid protocol: seed must be a non-negative integer")
+    return _compile_cached(_canonical(protocol or {}), seed)
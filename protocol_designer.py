@@ -2,6 +2,8 @@ import dearpygui.dearpygui as dpg
 import json
 import os
 import shared_states
+from session_files import save_protocol_copy
+from protocol_compiler import validate_protocol, ProtocolError
 
 # ===========================
 # Internal helpers
@@ -56,6 +58,11 @@ def on_num_rewards_changed(sender, app_data):
 
 def finalize_protocol_file(protocol_data, overwrite=False):
     from utils import check_ready_state
+    try:
+        validate_protocol(protocol_data)
+    except ProtocolError as e:
+        print(f"[ERROR] Protocol not saved. {e}")
+        return False
     protocol_name = protocol_data["protocol_name"]
     filename = f"Protocols/{protocol_name}.json"
     if not overwrite and os.path.exists(filename):
@@ -66,8 +73,7 @@ def finalize_protocol_file(protocol_data, overwrite=False):
         json.dump(protocol_data, f, indent=4)
     if shared_states.current_mouse_file:
         mouse_folder_path = os.path.dirname(os.path.abspath(shared_states.current_mouse_file))
-        with open(f"{mouse_folder_path}\\{shared_states.current_session_name}\\Protocol_{protocol_name}.json", "w") as f:
-            json.dump(protocol_data, f, indent = 4)
+        save_protocol_copy(os.path.join(mouse_folder_path, shared_states.current_session_name), protocol_data)
     dpg.set_value("protocol_file_path", filename)
     shared_states.current_protocol = protocol_data
     shared_states.protocol_file_path = filename
@@ -159,8 +165,7 @@ def protocol_selected(sender, app_data):
         shared_states.current_protocol = protocol
         if shared_states.current_mouse_file:
             mouse_folder_path = os.path.dirname(os.path.abspath(shared_states.current_mouse_file))
-            with open(f"{mouse_folder_path}\\{shared_states.current_session_name}\\Protocol_{protocol["protocol_name"]}.json", "w") as f:
-                json.dump(protocol, f, indent = 4)
+            save_protocol_copy(os.path.join(mouse_folder_path, shared_states.current_session_name), protocol)
         dpg.set_value("protocol_file_path", file_path)
         print(f"[LOADED] Protocol from {file_path}")
         shared_states.protocol_loaded = True
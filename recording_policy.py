@@ -0,0 +1,142 @@
+# recording_policy.py
+"""
+Which camera frames of a recording are written to disk.
+
+"continuous" (default) keeps every frame. With "events" the Engine only
+hands frames to the FrameRecorder, which keeps the last pre_s seconds in a
+memory ring; when a configured trial event fires (trigger(), called by the
+TrialController), the frames from pre_s before to post_s after the event
+are persisted. Windows that overlap are merged, so no frame is written
+twice.
+
+trigger() only records the window; the buffered frames are handed back to
+the Engine's processing thread by the next add(), so the trial thread never
+touches frames or the disk.
+
+Before a recording starts (armed, see gui_functions.arm_recording) frames go
+to hold(); begin() then returns the last pre_roll_s seconds of them, so the
+recording starts with a back-filled pre-roll.
+
+Arena config (optional):
+    "recording": {"mode": "events", "pre_s": 2.0, "post_s": 3.0,
+                  "events": ["reward_phase", "reward_port_licks", "light_sphere_dwell"],
+                  "pre_roll_s": 1.0}
+"""
+import threading
+import time
+from collections import deque
+
+MODES = ("continuous", "events")
+DEFAULT_EVENTS = ("reward_phase", "reward_port_licks", "light_sphere_dwell", "reward_dispensed")
+DEFAULT_PRE_S = 2.0
+DEFAULT_POST_S = 3.0
+DEFAULT_PRE_ROLL_S = 0.0
+
+
+class FrameRecorder:
+    def __init__(self, mode="continuous", pre_s=DEFAULT_PRE_S, post_s=DEFAULT_POST_S, events=DEFAULT_EVENTS,
+                 pre_roll_s=DEFAULT_PRE_ROLL_S):
+        if mode not in MODES:
+            raise ValueError(f"Unknown recording mode '{mode}' (expected one of {', '.join(MODES)})")
+        self.mode = mode
+        self.continuous = mode == "continuous"
+        self.pre_s = max(0.0, float(pre_s))
+        self.post_s = max(0.0, float(post_s))
+        self.events = frozenset(events)
+        self.pre_roll_s = max(0.0, float(pre_roll_s))
+        self.ring = deque()             # (t, frame) of the last pre_s seconds, not yet written
+        self.windows = deque()          # [start, end] still to come, merged and in order
+        self.segments = []              # every merged [start, end] of the recording
+        self._lock = threading.Lock()
+        self.frames_seen = 0
+        self.frames_written = 0
+        self.triggers = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """FrameRecorder from the arena config's "recording" section (continuous if there is none)."""
+        cfg = dict((config or {}).get("recording") or {})
+        return cls(mode=cfg.get("mode", "continuous"), pre_s=cfg.get("pre_s", DEFAULT_PRE_S),
+                   post_s=cfg.get("post_s", DEFAULT_POST_S), events=cfg.get("events", DEFAULT_EVENTS),
+                   pre_roll_s=cfg.get("pre_roll_s", DEFAULT_PRE_ROLL_S))
+
+    # ---------- Engine side (processing thread) ----------
+    def add(self, t, frame):
+        """Offers the frame taken at t; returns the (t, frame) pairs to write now."""
+        self.frames_seen += 1
+        if self.continuous:
+            self.frames_written += 1
+            return [(t, frame)]
+        with self._lock:
+            windows = self.windows
+            while windows and windows[0][1] < t:
+                windows.popleft()
+            ring = self.ring
+            if windows and windows[0][0] <= t:
+                start = windows[0][0]
+                out = [item for item in ring if item[0] >= start]
+                out.append((t, frame))
+                ring.clear()
+                self.frames_written += len(out)
+                return out
+            ring.append((t, frame))
+            while ring[0][0] < t - self.pre_s:
+                ring.popleft()
+            return []
+
+    def hold(self, t, frame):
+        """Keeps the frame taken at t while armed (not recording), for the pre-roll and the first event window."""
+        keep = self.pre_roll_s if self.continuous else max(self.pre_roll_s, self.pre_s)
+        if keep <= 0.0:
+            return
+        with self._lock:
+            ring = self.ring
+            ring.append((t, frame))
+            while ring[0][0] < t - keep:
+                ring.popleft()
+
+    def begin(self, t):
+        """Recording starts at t: returns the held frames of the pre-roll to write."""
+        with self._lock:
+            start = t - self.pre_roll_s
+            out = [item for item in self.ring if item[0] >= start]
+            if self.continuous:
+                self.ring.clear()
+            else:
+                # older frames stay in the ring for a window opened right after the start
+                self.ring = deque(item for item in self.ring if item[0] < start)
+            self.frames_seen += len(out)
+            self.frames_written += len(out)
+            return out
+
+    def clear(self):
+        """Drops buffered frames and open windows (end of a recording)."""
+        with self._lock:
+            self.ring.clear()
+            self.windows.clear()
+
+    # ---------- Trial side ----------
+    def trigger(self, event, t=None):
+        """Marks pre_s..post_s around t (default: now) for writing if `event` is configured."""
+        if self.continuous or event not in self.events:
+            return False
+        t = time.perf_counter() if t is None else t
+        start, end = t - self.pre_s, t + self.post_s
+        with self._lock:
+            self.triggers += 1
+            if self.windows and start <= self.windows[-1][1]:
+                self.windows[-1][1] = max(self.windows[-1][1], end)
+            else:
+                self.windows.append([start, end])
+            if self.segments and start <= self.segments[-1][1]:
+                self.segments[-1][1] = max(self.segments[-1][1], end)
+            else:
+                self.segments.append([start, end])
+        return True
+
+    def format_summary(self):
+        if self.continuous:
+            return f"[RECORD] {self.frames_written} frames written (continuous)."
+        share = 100.0 * self.frames_written / self.frames_seen if self.frames_seen else 0.0
+        return (f"[RECORD] {self.frames_written}/{self.frames_seen} frames written ({share:.1f}%), "
+                f"{self.triggers} triggers in {len(self.segments)} windows.")
@@ -0,0 +1,476 @@
+# serial_dispatcher.py
+"""
+One writer and one reader thread per serial port.
+
+Every write to a board (GUI, trial thread, AcqThread) goes through the
+board's BoardDispatcher instead of calling Serial.write() directly, so
+multi-byte commands like M<relay><group> or P<ch><val> can never interleave.
+Commands are queued by class:
+
+    ttl     'T' output edges (output_scheduler.py)                        (first)
+    reward  relay selection, relay mapping, PWM, bulk masks with relays
+    phase   'r' / 'i'
+    sensor  's' poll
+    led     'L' / 'l', bulk masks without relays                          (last)
+
+and within a class in submission order. A command never overtakes an older
+queued one that writes the same board state (command_groups: a bulk mask
+or an LED behind an 'i'); the older one moves up to its priority instead.
+A command that supersedes a still queued one (same LED, same PWM channel,
+a newer bulk mask, a second poll) replaces it. Queueing delay is measured
+per class.
+
+Acknowledgements: every command except the 's' poll (whose sensor line is
+its answer) goes out as '#' <0x80 | seq> <command>, and the firmware answers
+'ack:<seq>' once the command is applied. The sequence byte is never a
+command character, so an old firmware ignores the prefix. The BoardReader
+sorts incoming lines into acks (matched to the outstanding command, giving
+the round-trip time) and sensor lines (queued for read_sensor_lines). A
+command without ack after ack_timeout is sent again, followed by every later
+command of the same kind (outputs, phase, ...) so a late retry never undoes
+a newer one; after ack_retries retries it counts as failed.
+"""
+import bisect
+import heapq
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+
+from logging_setup import get_logger
+
+log = get_logger("serial")
+
+PRIORITIES = {"ttl": 0, "reward": 1, "phase": 1, "sensor": 2, "led": 3}
+
+SEQ_PREFIX = b'#'
+SEQ_FLAG = 0x80                 # sequence byte = SEQ_FLAG | seq
+SEQ_COUNT = 128
+ACK_TIMEOUT = 0.25              # s
+ACK_RETRIES = 2
+HISTORY_LENGTH = 64             # written commands kept for replays after a retry
+
+
+def classify_command(data):
+    """(class, coalesce key or None) of a raw command."""
+    c = data[:1]
+    if c == b's':
+        return "sensor", ("s",)
+    if c == b'T':
+        return "ttl", None               # every edge counts
+    if c in (b'r', b'i'):
+        return "phase", None             # never dropped: 'i' resets relays and LEDs
+    if c in (b'L', b'l'):
+        return "led", ("L", data[1:2])
+    if c == b'B':
+        return ("reward" if data[2:3] != b'\x00' else "led"), ("B",)
+    if c == b'P':
+        return "reward", ("P", data[1:2])
+    if c == b'M':
+        return "reward", ("M", data[1:2])
+    if b'1' <= c <= b'8':
+        return "reward", ("select", c)
+    return "reward", None
+
+def command_groups(data):
+    """Board state a command writes (commands of a common group must stay in order)."""
+    c = data[:1]
+    if c == b'r':
+        return {"phase"}
+    if c == b'i':
+        return {"phase", "outputs"}
+    if c in (b'L', b'l', b'B') or b'1' <= c <= b'8':
+        return {"outputs"}
+    if c == b'P':
+        return {"pwm"}
+    if c == b'M':
+        return {"mapping"}
+    if c == b'T':
+        return {f"ttl{data[1:2].decode('latin-1')}"}
+    return {"other"}
+
+
+class LatencyHistogram:
+    """Log2-binned latencies from 0.125 ms to 1 s (plus overflow)."""
+    EDGES_MS = tuple(0.125 * 2 ** k for k in range(14))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.EDGES_MS) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = 1000.0 * seconds
+        self.counts[bisect.bisect_left(self.EDGES_MS, ms)] += 1
+        self.n += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q):
+        """Upper edge of the bin holding the q-quantile (ms; capped at the maximum)."""
+        if not self.n:
+            return None
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * self.n:
+                return min(self.EDGES_MS[i], self.max) if i < len(self.EDGES_MS) else self.max
+        return self.max
+
+    def as_dict(self):
+        if not self.n:
+            return {"n": 0}
+        return {"n": self.n, "mean_ms": self.total / self.n, "p50_ms": self.percentile(0.5),
+                "p99_ms": self.percentile(0.99), "max_ms": self.max,
+                "edges_ms": list(self.EDGES_MS), "counts": list(self.counts)}
+
+
+class CommandStats:
+    """Queueing delay (submit -> written) and round trip (written -> ack) per command class."""
+    def __init__(self, maxlen=2000):
+        self.written = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.acked = 0
+        self.retries = 0
+        self.failed = 0
+        self.max_delay = 0.0
+        self.delays = deque(maxlen=maxlen)
+        self.rtt = LatencyHistogram()
+
+    def add(self, delay):
+        self.written += 1
+        self.max_delay = max(self.max_delay, delay)
+        self.delays.append(delay)
+
+    def as_dict(self):
+        d = {"written": self.written, "coalesced": self.coalesced, "errors": self.errors,
+             "acked": self.acked, "retries": self.retries, "failed": self.failed}
+        if self.delays:
+            ordered = sorted(self.delays)
+            n = len(ordered)
+            d.update(delay_p50_ms=1000.0 * ordered[n // 2], delay_p99_ms=1000.0 * ordered[min(n - 1, n * 99 // 100)],
+                     delay_max_ms=1000.0 * self.max_delay)
+        d["rtt"] = self.rtt.as_dict()
+        return d
+
+
+class BoardDispatcher:
+    def __init__(self, name, device, ack_timeout=ACK_TIMEOUT, ack_retries=ACK_RETRIES):
+        self.name = name
+        self.device = device
+        self.ack_timeout = float(ack_timeout)
+        self.ack_retries = int(ack_retries)
+        self.stats = {cls: CommandStats() for cls in PRIORITIES}
+        self.unmatched_acks = 0
+        self._heap = []                     # [priority, seq, entry]
+        self._pending = {}                  # coalesce key -> queued entry
+        self._outstanding = {}              # sequence number -> written entry awaiting its ack
+        self._inflight = {}                 # coalesce key -> written entry awaiting its ack
+        self._history = deque(maxlen=HISTORY_LENGTH)
+        self._next_seq = 0
+        self._poll_t = None                 # write time of the unanswered 's'
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._busy = False
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"SerialTx-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, data, cls=None, key=None, on_ack=None):
+        """
+        Queues raw bytes. cls/key default to classify_command(data).
+        on_ack(t) is called from the reader thread when the board confirms the command.
+        """
+        if cls is None:
+            cls, key = classify_command(data)
+        priority = PRIORITIES[cls]
+        entry = {"data": data, "cls": cls, "key": key, "t": time.perf_counter(), "dropped": False,
+                 "on_ack": on_ack, "seq": None, "attempts": 0, "deadline": None, "priority": priority}
+        with self._cond:
+            if key is not None:
+                old = self._pending.pop(key, None)
+                if old is not None:
+                    # superseded: the newer command takes its place at the back of the queue
+                    old["dropped"] = True
+                    self.stats[old["cls"]].coalesced += 1
+                self._pending[key] = entry
+                self._cancel_inflight(key)
+            self._promote_older(data, priority)
+            heapq.heappush(self._heap, (priority, next(self._order), entry))
+            self._cond.notify()
+
+    def _promote_older(self, data, priority):
+        """Moves queued commands of a common group up to priority (they must go out first)."""
+        groups = command_groups(data) - {"other"}
+        if not groups:
+            return
+        for _, order, other in list(self._heap):
+            if (other["priority"] > priority and not other["dropped"]
+                    and groups & command_groups(other["data"])):
+                other["priority"] = priority        # its old heap item is skipped when popped
+                heapq.heappush(self._heap, (priority, order, other))
+
+    # ---------- Writer thread ----------
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.perf_counter()
+                    batch = self._due_retry(now) or self._next_queued()
+                    if batch or not self._running:
+                        break
+                    self._busy = False
+                    self._cond.notify_all()
+                    self._cond.wait(self._retry_wait(now))
+                if not batch:
+                    self._busy = False
+                    self._cond.notify_all()
+                    return
+                self._busy = True
+            for entry in batch:
+                self._write(entry)
+
+    def _next_queued(self):
+        while self._heap:
+            priority, _, entry = heapq.heappop(self._heap)
+            if entry["dropped"] or priority != entry["priority"]:
+                continue
+            if entry["key"] is not None and self._pending.get(entry["key"]) is entry:
+                del self._pending[entry["key"]]
+            if entry["data"][:1] != b's':
+                self._track(entry)
+            return [entry]
+        return None
+
+    def _track(self, entry):
+        """Gives a command a sequence number and registers it as awaiting its ack."""
+        for _ in range(SEQ_COUNT):
+            seq = self._next_seq
+            self._next_seq = (seq + 1) % SEQ_COUNT
+            if seq not in self._outstanding:
+                break
+        else:
+            self._give_up(self._outstanding[seq])      # 128 commands in flight: the oldest is lost
+        entry["seq"] = seq
+        entry["deadline"] = float("inf")
+        self._outstanding[seq] = entry
+        if entry["key"] is not None:
+            self._inflight[entry["key"]] = entry
+
+    def _cancel_inflight(self, key):
+        """A newer command with the same key was submitted: the older one is not retried anymore."""
+        old = self._inflight.pop(key, None)
+        if old is not None and self._outstanding.get(old["seq"]) is old:
+            del self._outstanding[old["seq"]]
+            old["dropped"] = True
+
+    def _give_up(self, entry):
+        self._outstanding.pop(entry["seq"], None)
+        if entry["key"] is not None and self._inflight.get(entry["key"]) is entry:
+            del self._inflight[entry["key"]]
+        entry["dropped"] = True
+        self.stats[entry["cls"]].failed += 1
+        log.error("[ERROR] '%s' did not acknowledge %r after %d attempts.", self.name, entry["data"], entry["attempts"])
+
+    def _due_retry(self, now):
+        """The oldest timed-out command plus the later written commands it could undo."""
+        for entry in sorted(self._outstanding.values(), key=lambda e: e["deadline"]):
+            if entry["deadline"] > now:
+                return None
+            if entry["attempts"] > self.ack_retries:
+                self._give_up(entry)
+                continue
+            entry["deadline"] = float("inf")
+            batch = [entry]
+            groups = command_groups(entry["data"])
+            later = False
+            for other in list(self._history):
+                if other is entry:
+                    later = True
+                elif later and not other["dropped"] and groups & command_groups(other["data"]):
+                    if self._outstanding.get(other["seq"]) is not other:
+                        # already acknowledged: replayed under a new sequence number
+                        other = dict(other, on_ack=None, attempts=1)
+                        self._track(other)
+                    other["deadline"] = float("inf")
+                    batch.append(other)
+            return batch
+        return None
+
+    def _retry_wait(self, now):
+        deadlines = [e["deadline"] for e in self._outstanding.values()]
+        earliest = min(deadlines, default=float("inf"))
+        return None if earliest == float("inf") else max(0.0, earliest - now)
+
+    def _write(self, entry):
+        stats = self.stats[entry["cls"]]
+        data = entry["data"]
+        if entry["seq"] is not None:
+            data = SEQ_PREFIX + bytes((SEQ_FLAG | entry["seq"],)) + data
+        t = time.perf_counter()
+        entry["t_sent"] = t
+        try:
+            self.device.write(data)
+        except Exception as e:
+            stats.errors += 1
+            log.error("[ERROR] Failed to send %r to '%s': %s", entry["data"], self.name, e)
+        with self._cond:
+            entry["attempts"] += 1
+            if entry["attempts"] == 1:
+                stats.add(t - entry["t"])
+                self._history.append(entry)
+            else:
+                stats.retries += 1
+            if entry["seq"] is None:
+                self._poll_t = t
+            elif self._outstanding.get(entry["seq"]) is entry:
+                entry["deadline"] = t + self.ack_timeout
+
+    # ---------- Replies (called by the BoardReader) ----------
+    def on_ack(self, seq, t):
+        with self._cond:
+            entry = self._outstanding.pop(seq, None)
+            if entry is None:
+                self.unmatched_acks += 1       # late ack of a retried or superseded command
+                return
+            if entry["key"] is not None and self._inflight.get(entry["key"]) is entry:
+                del self._inflight[entry["key"]]
+            stats = self.stats[entry["cls"]]
+            stats.acked += 1
+            self._cond.notify_all()
+            if entry["attempts"] == 1:
+                # after a retry the ack cannot be matched to one send, so it gives no round trip
+                stats.rtt.add(t - entry["t_sent"])
+        if entry["on_ack"] is not None:
+            try:
+                entry["on_ack"](t)
+            except Exception as e:
+                log.error("[ERROR] Ack handler for %r on '%s' failed: %s", entry["data"], self.name, e)
+
+    def on_poll_reply(self, t):
+        with self._cond:
+            t_sent, self._poll_t = self._poll_t, None
+            if t_sent is not None:
+                self.stats["sensor"].rtt.add(t - t_sent)
+
+    # ---------- Control ----------
+    def flush(self, timeout=1.0):
+        """Waits until everything queued so far has been written."""
+        deadline = time.perf_counter() + timeout
+        with self._cond:
+            while self._heap or self._busy:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def wait_acked(self, timeout=1.0):
+        """Waits until every written command was acknowledged (or given up)."""
+        deadline = time.perf_counter() + timeout
+        with self._cond:
+            while self._heap or self._busy or self._outstanding:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout=1.0):
+        """Writes what is queued, then ends the thread (unacknowledged commands are not retried)."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def stats_dict(self):
+        d = {cls: st.as_dict() for cls, st in self.stats.items()}
+        d["unmatched_acks"] = self.unmatched_acks
+        return d
+
+
+class BoardReader:
+    """
+    Reads every line a board sends: acks go to the dispatcher, READY sets
+    .ready, everything else is treated as a sensor reply (malformed lines
+    included, so a corrupted reply still fails its own read).
+    """
+    def __init__(self, name, device, dispatcher):
+        self.name = name
+        self.device = device
+        self.dispatcher = dispatcher
+        self.ready = threading.Event()
+        self.bad_acks = 0
+        self._lines = queue.Queue()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"SerialRx-{name}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            try:
+                raw = self.device.readline()
+            except Exception as e:
+                if self._running:
+                    log.error("[ERROR] Reading from '%s' failed: %s", self.name, e)
+                return
+            if not raw:
+                continue
+            t = time.perf_counter()
+            line = raw.decode("utf-8", errors="replace")
+            i = line.find("ack:")
+            if i >= 0:
+                try:
+                    self.dispatcher.on_ack(int(line[i + 4:].strip()), t)
+                except ValueError:
+                    self.bad_acks += 1
+                    log.warning("[Parse error]: bad acknowledgement from '%s' | Line: %s", self.name, line)
+            elif line.strip() == "READY":
+                self.ready.set()
+            else:
+                self.dispatcher.on_poll_reply(t)
+                self._lines.put(line)
+
+    def read_line(self, timeout):
+        """Next sensor line, or '' after timeout seconds."""
+        try:
+            return self._lines.get(timeout=timeout)
+        except queue.Empty:
+            return ""
+
+    def discard_lines(self):
+        """Drops replies left over from earlier polls."""
+        while True:
+            try:
+                self._lines.get_nowait()
+            except queue.Empty:
+                return
+
+    def stop(self):
+        """Ends the thread; the device must be closed afterwards to unblock readline()."""
+        self._running = False
+
+    def join(self, timeout=1.0):
+        self._thread.join(timeout)
+
+
+def format_dispatch_stats(stats):
+    """One line per board from DeviceRegistry.dispatch_stats()."""
+    lines = []
+    for board, classes in stats.items():
+        parts = []
+        for cls, st in classes.items():
+            if not isinstance(st, dict) or not st["written"]:
+                continue
+            part = f"{cls} {st['written']} (queue p99 {st['delay_p99_ms']:.2f} ms"
+            if st["rtt"]["n"]:
+                part += f", rtt p50 {st['rtt']['p50_ms']:.2f} / p99 {st['rtt']['p99_ms']:.2f} ms"
+            for key in ("coalesced", "retries", "failed"):
+                if st[key]:
+                    part += f", {st[key]} {key}"
+            parts.append(part + ")")
+        lines.append(f"[SERIAL] {board}: " + (", ".join(parts) or "no writes"))
+    return lines
@@ -0,0 +1,334 @@
+# session_catalog.py
+"""
+SQLite catalog of mice, sessions, protocol parameters and relay assignments.
+
+TrialController adds a session when it starts and completes the entry (end
+time, duration, summary statistics from session_summary.json) when it ends.
+The catalog is only an index: everything in it can be rebuilt from the mouse
+and session folders on disk.
+
+Location: "catalog" in the arena config, else MULTIPORT_CATALOG, else
+Config/catalog.sqlite.
+
+    python session_catalog.py rebuild <data_root>
+    python session_catalog.py query [--mouse M] [--protocol P] [--reward1-relay R]
+                                    [--reward2-relay R] [--param light_sphere.size=40]
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_CATALOG_PATH = os.path.join("Config", "catalog.sqlite")
+SESSION_DIR_RE = re.compile(r"^session(\d+)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mice (
+    mouse_id    TEXT PRIMARY KEY,
+    folder      TEXT,
+    mouse_file  TEXT,
+    notes       TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id                  INTEGER PRIMARY KEY,
+    path                TEXT UNIQUE NOT NULL,
+    mouse_id            TEXT,
+    session_name        TEXT,
+    session_number      INTEGER,
+    protocol_name       TEXT,
+    experiment_type     TEXT,
+    reward1_relay       INTEGER,
+    reward2_relay       INTEGER,
+    started_at          TEXT,
+    ended_at            TEXT,
+    duration_s          REAL,
+    trials_completed    INTEGER,
+    rewards_dispensed   INTEGER,
+    rewards_withheld    INTEGER,
+    licks_total         INTEGER,
+    first_lick_latency_s REAL,
+    time_to_dwell_s     REAL
+);
+CREATE TABLE IF NOT EXISTS protocol_params (
+    session_id  INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    key         TEXT NOT NULL,
+    value       TEXT,
+    num         REAL,
+    PRIMARY KEY (session_id, key)
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_mouse ON sessions(mouse_id, session_number);
+CREATE INDEX IF NOT EXISTS idx_sessions_protocol ON sessions(protocol_name);
+CREATE INDEX IF NOT EXISTS idx_sessions_relays ON sessions(reward1_relay, reward2_relay);
+CREATE INDEX IF NOT EXISTS idx_params_key_value ON protocol_params(key, value);
+CREATE INDEX IF NOT EXISTS idx_params_key_num ON protocol_params(key, num);
+"""
+
+
+def relay_number(tag):
+    """'button2_5' -> 5 (None for missing tags)."""
+    try:
+        return int(tag.split("_")[1]) if tag else None
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+def flatten_protocol(protocol, prefix=""):
+    """{'light_sphere': {'size': 40}} -> {'light_sphere.size': 40}"""
+    flat = {}
+    for key, value in (protocol or {}).items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_protocol(value, f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+def _param_row(value):
+    """(text, numeric) columns of one protocol value."""
+    if isinstance(value, bool):
+        return str(value).lower(), float(value)
+    if isinstance(value, (int, float)):
+        return repr(value), float(value)
+    if isinstance(value, str):
+        return value, None
+    return json.dumps(value), None
+
+
+class Catalog:
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("MULTIPORT_CATALOG", DEFAULT_CATALOG_PATH)
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        # one connection shared by the trial threads of this process; WAL lets
+        # arena processes and readers use the file at the same time
+        self.conn = sqlite3.connect(self.path, timeout=10.0, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    # ---------- Writing ----------
+    def _upsert_mouse(self, mouse_id, folder=None, mouse_file=None, notes=None):
+        self.conn.execute(
+            "INSERT INTO mice (mouse_id, folder, mouse_file, notes) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(mouse_id) DO UPDATE SET folder=coalesce(excluded.folder, folder), "
+            "mouse_file=coalesce(excluded.mouse_file, mouse_file), notes=coalesce(excluded.notes, notes)",
+            (mouse_id, folder, mouse_file, notes))
+
+    def _upsert_session(self, path, fields):
+        fields = dict(fields, path=os.path.abspath(path))
+        cols = ", ".join(fields)
+        marks = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{c}=excluded.{c}" for c in fields if c != "path")
+        self.conn.execute(f"INSERT INTO sessions ({cols}) VALUES ({marks}) "
+                          f"ON CONFLICT(path) DO UPDATE SET {updates}", tuple(fields.values()))
+        return self.conn.execute("SELECT id FROM sessions WHERE path = ?", (fields["path"],)).fetchone()[0]
+
+    def _set_protocol(self, session_id, protocol):
+        self.conn.execute("DELETE FROM protocol_params WHERE session_id = ?", (session_id,))
+        rows = [(session_id, key, *_param_row(value)) for key, value in flatten_protocol(protocol).items()]
+        self.conn.executemany("INSERT INTO protocol_params (session_id, key, value, num) VALUES (?, ?, ?, ?)", rows)
+
+    @staticmethod
+    def _summary_fields(summary):
+        licks = summary.get("licks") or {}
+        return {
+            "duration_s": summary.get("elapsed_s"),
+            "trials_completed": summary.get("trials_completed"),
+            "rewards_dispensed": summary.get("rewards_dispensed"),
+            "rewards_withheld": summary.get("rewards_withheld"),
+            "licks_total": sum(licks.values()),
+            "first_lick_latency_s": (summary.get("first_lick_latency_s") or {}).get("mean"),
+            "time_to_dwell_s": (summary.get("time_to_dwell_s") or {}).get("mean"),
+        }
+
+    def record_session_start(self, session_path, mouse_file=None, mouse_data=None, protocol=None,
+                             relays=None, started_at=None):
+        """Adds (or resets) a session when it starts. relays: {'1': tag, '2': tag}."""
+        session_path = os.path.abspath(session_path)
+        mouse_data = mouse_data or {}
+        mouse_folder = os.path.dirname(session_path)
+        mouse_id = mouse_data.get("MouseID") or os.path.basename(mouse_folder)
+        session_name = os.path.basename(session_path)
+        m = SESSION_DIR_RE.match(session_name)
+        relays = relays or {}
+        protocol = protocol or {}
+        with self._lock, self.conn:
+            self._upsert_mouse(mouse_id, mouse_folder, mouse_file, mouse_data.get("Notes"))
+            session_id = self._upsert_session(session_path, {
+                "mouse_id": mouse_id,
+                "session_name": session_name,
+                "session_number": int(m.group(1)) if m else None,
+                "protocol_name": protocol.get("protocol_name"),
+                "experiment_type": protocol.get("experiment_type"),
+                "reward1_relay": relay_number(relays.get("1")),
+                "reward2_relay": relay_number(relays.get("2")),
+                "started_at": started_at or time.strftime("%Y-%m-%d %H:%M:%S"),
+                "ended_at": None,
+            })
+            self._set_protocol(session_id, protocol)
+        return session_id
+
+    def record_session_end(self, session_path, summary=None, ended_at=None):
+        """Completes a session entry with its end time and summary statistics."""
+        fields = {"ended_at": ended_at or time.strftime("%Y-%m-%d %H:%M:%S")}
+        fields.update(self._summary_fields(summary or {}))
+        sets = ", ".join(f"{c} = ?" for c in fields)
+        with self._lock, self.conn:
+            self.conn.execute(f"UPDATE sessions SET {sets} WHERE path = ?",
+                              (*fields.values(), os.path.abspath(session_path)))
+
+    # ---------- Rebuild from disk ----------
+    def index_session_folder(self, session_path, mouse_file=None, mouse_data=None):
+        from session_files import find_session_protocol
+        session_path = os.path.abspath(session_path)
+        mouse_data = mouse_data or {}
+        entries = (mouse_data.get("relay_sessions") or {}).get(os.path.basename(session_path)) or []
+        relays = {"1": entries[-1][0], "2": entries[-1][1]} if entries else {}
+
+        started_at = None
+        events = os.path.join(session_path, "trial_events.csv")
+        if os.path.isfile(events):
+            with open(events, "r") as f:
+                f.readline()
+                first = f.readline().split(",")
+            started_at = first[0].strip() or None
+        self.record_session_start(session_path, mouse_file, mouse_data, find_session_protocol(session_path),
+                                  relays, started_at=started_at)
+
+        summary_path = os.path.join(session_path, "session_summary.json")
+        if os.path.isfile(summary_path):
+            with open(summary_path, "r") as f:
+                summary = json.load(f)
+            ended = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(summary_path)))
+            self.record_session_end(session_path, summary, ended_at=ended)
+
+    def rebuild(self, root):
+        """Re-indexes every mouse folder below root (<MouseID>/<MouseID>.json + session<N>/). Returns #sessions."""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM protocol_params")
+            self.conn.execute("DELETE FROM sessions")
+            self.conn.execute("DELETE FROM mice")
+        n = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if d != "frames" and not d.startswith("."))
+            mouse_file = os.path.join(dirpath, f"{os.path.basename(dirpath)}.json")
+            if not os.path.isfile(mouse_file):
+                continue
+            try:
+                with open(mouse_file, "r") as f:
+                    mouse_data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[CATALOG] Skipping {mouse_file}: {e}")
+                continue
+            sessions = [d for d in dirnames if SESSION_DIR_RE.match(d)]
+            for name in sessions:
+                self.index_session_folder(os.path.join(dirpath, name), mouse_file, mouse_data)
+                n += 1
+            if not sessions:
+                with self._lock, self.conn:
+                    self._upsert_mouse(mouse_data.get("MouseID") or os.path.basename(dirpath),
+                                       dirpath, mouse_file, mouse_data.get("Notes"))
+        return n
+
+    # ---------- Queries ----------
+    def find_sessions(self, mouse=None, protocol=None, reward1_relay=None, reward2_relay=None,
+                      experiment_type=None, params=None):
+        """
+        Sessions matching all given filters, ordered by mouse and session number.
+        params: {'light_sphere.size': 40, ...} compared numerically for numbers.
+        """
+        where, args = [], []
+        for col, value in (("mouse_id", mouse), ("protocol_name", protocol), ("reward1_relay", reward1_relay),
+                           ("reward2_relay", reward2_relay), ("experiment_type", experiment_type)):
+            if value is not None:
+                where.append(f"s.{col} = ?")
+                args.append(value)
+        for key, value in (params or {}).items():
+            text, num = _param_row(value)
+            if num is not None:
+                where.append("EXISTS (SELECT 1 FROM protocol_params p WHERE p.session_id = s.id "
+                             "AND p.key = ? AND p.num = ?)")
+                args += [key, num]
+            else:
+                where.append("EXISTS (SELECT 1 FROM protocol_params p WHERE p.session_id = s.id "
+                             "AND p.key = ? AND p.value = ?)")
+                args += [key, text]
+        sql = "SELECT s.* FROM sessions s"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY s.mouse_id, s.session_number"
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(sql, args)]
+
+    def protocol_params(self, session_path):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT p.key, p.value FROM protocol_params p JOIN sessions s ON s.id = p.session_id "
+                "WHERE s.path = ? ORDER BY p.key", (os.path.abspath(session_path),)).fetchall()
+        return {r["key"]: r["value"] for r in rows}
+
+
+# ---------- Process-wide catalog ----------
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(arena_config=None):
+    """The catalog for an arena config (one connection per file and process)."""
+    path = (arena_config or {}).get("catalog") or os.environ.get("MULTIPORT_CATALOG", DEFAULT_CATALOG_PATH)
+    with _catalogs_lock:
+        if path not in _catalogs:
+            _catalogs[path] = Catalog(path)
+        return _catalogs[path]
+
+
+def _parse_param(text):
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the session catalog.")
+    parser.add_argument("--catalog", help="Catalog file (default: MULTIPORT_CATALOG or Config/catalog.sqlite)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_rebuild = sub.add_parser("rebuild", help="Re-index all mouse folders below a data folder")
+    p_rebuild.add_argument("root")
+    p_query = sub.add_parser("query", help="List sessions matching filters")
+    p_query.add_argument("--mouse")
+    p_query.add_argument("--protocol")
+    p_query.add_argument("--experiment-type")
+    p_query.add_argument("--reward1-relay", type=int)
+    p_query.add_argument("--reward2-relay", type=int)
+    p_query.add_argument("--param", action="append", default=[], help="key=value, e.g. light_sphere.size=40")
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(args.catalog)
+    if args.command == "rebuild":
+        t0 = time.perf_counter()
+        n = catalog.rebuild(args.root)
+        print(f"[CATALOG] Indexed {n} sessions in {time.perf_counter() - t0:.2f} s -> {catalog.path}")
+        return 0
+
+    t0 = time.perf_counter()
+    rows = catalog.find_sessions(mouse=args.mouse, protocol=args.protocol, experiment_type=args.experiment_type,
+                                 reward1_relay=args.reward1_relay, reward2_relay=args.reward2_relay,
+                                 params=dict(_parse_param(p) for p in args.param))
+    elapsed = 1000 * (time.perf_counter() - t0)
+    for r in rows:
+        print(f"{r['mouse_id']}/{r['session_name']}: {r['protocol_name']} relays {r['reward1_relay']}/"
+              f"{r['reward2_relay']}, {r['trials_completed']} trials, {r['path']}")
+    print(f"[CATALOG] {len(rows)} sessions ({elapsed:.1f} ms)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
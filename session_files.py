@@ -0,0 +1,183 @@
+# session_files.py
+# Mouse/session folder layout and session file handling.
+# Used by the GUI (mouse_folder_creator) and by headless runs, so no GUI imports here.
+import csv
+import glob
+import json
+import os
+
+import shared_states
+
+def pose_csv_header(n_keypoints=1):
+    """timestamp, x1, y1, likelihood1, x2, ... (normalized coordinates)."""
+    header = ["timestamp"]
+    for i in range(1, n_keypoints + 1):
+        header += [f"x{i}", f"y{i}", f"likelihood{i}"]
+    return header
+
+POSE_CSV_HEADER = pose_csv_header(1)
+
+
+def create_mouse_folder_structure(mouse_id: str, base_dir: str, notes: str = ""):
+    mouse_folder = os.path.join(base_dir, mouse_id)
+    os.makedirs(mouse_folder, exist_ok=True)
+    session_name = "session1"
+    session_folder = setup_session_folder(mouse_folder, session_name)
+
+    return {
+        "mouse_folder": mouse_folder,
+        "session_name": session_name,
+        "session_folder": session_folder,
+        "json_path": os.path.join(mouse_folder, f"{mouse_id}.json")
+    }
+
+def setup_session_folder(mouse_folder_path, session_name, state=None):
+    state = state or shared_states
+    session_folder = os.path.join(mouse_folder_path, session_name)
+    state.current_session_path = session_folder
+    os.makedirs(session_folder, exist_ok=True)
+    os.makedirs(os.path.join(session_folder, "frames"), exist_ok=True)
+
+    sensor_csv = os.path.join(session_folder, "sensor_data.csv")
+    pose_csv = os.path.join(session_folder, "pose_estimation.csv")
+
+    with open(sensor_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(state.topology.csv_header())
+
+    with open(pose_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(POSE_CSV_HEADER)
+
+    print(f"[SESSION FOLDER CREATED]: {session_folder}")
+    return session_folder
+
+def session_number(session_name):
+    return int(session_name.replace("session", ""))
+
+def last_session_relays(mouse_data):
+    """Returns the last remembered (relay1_tag, relay2_tag) pair from relay_sessions, or None."""
+    relay_sessions = mouse_data.get("relay_sessions", {})
+    for session_name in sorted(relay_sessions.keys(), key=session_number, reverse=True):
+        entries = relay_sessions[session_name]
+        if entries:
+            return entries[-1][0], entries[-1][1]
+    return None
+
+def next_session_name(mouse_data):
+    relay_sessions = mouse_data.get("relay_sessions", {})
+    if not relay_sessions:
+        return "session1"
+    return f"session{max(session_number(k) for k in relay_sessions) + 1}"
+
+def load_mouse_file(mouse_file):
+    with open(mouse_file, "r") as f:
+        return json.load(f)
+
+def save_mouse_file(mouse_file, mouse_data):
+    with open(mouse_file, "w") as f:
+        json.dump(mouse_data, f, indent=4)
+
+def save_protocol_copy(session_path, protocol):
+    """Stores the protocol used for a session as Protocol_<name>.json in the session folder."""
+    path = os.path.join(session_path, f"Protocol_{protocol.get('protocol_name', 'Unnamed')}.json")
+    with open(path, "w") as f:
+        json.dump(protocol, f, indent=4)
+    return path
+
+def find_session_protocol(session_path):
+    matches = sorted(glob.glob(os.path.join(session_path, "Protocol_*.json")))
+    if not matches:
+        return None
+    with open(matches[0], "r") as f:
+        return json.load(f)
+
+def prepare_session(mouse_file, protocol_file, session=None, overwrite=False,
+                    reward1_relay=None, reward2_relay=None, state=None):
+    """
+    Creates the next (or given) session folder for a mouse, records the reward
+    relays in the mouse file and stores a copy of the protocol.
+    Relays default to the mouse's last session. Returns (session_path, protocol).
+    """
+    state = state or shared_states
+    mouse_data = load_mouse_file(mouse_file)
+    mouse_folder = os.path.dirname(os.path.abspath(mouse_file))
+    session_name = f"session{session}" if session else next_session_name(mouse_data)
+    relay_sessions = mouse_data.setdefault("relay_sessions", {})
+    if session_name in relay_sessions and relay_sessions[session_name] and not overwrite:
+        raise FileExistsError(f"{session_name} already exists for this mouse")
+
+    session_path = setup_session_folder(mouse_folder, session_name, state)
+
+    relays = last_session_relays(mouse_data) or (None, None)
+    r1 = f"button1_{reward1_relay}" if reward1_relay else relays[0]
+    r2 = f"button2_{reward2_relay}" if reward2_relay else relays[1]
+    state.remembered_relays["1"] = r1
+    state.remembered_relays["2"] = r2
+    relay_sessions[session_name] = [[r1, r2]]
+    save_mouse_file(mouse_file, mouse_data)
+
+    with open(protocol_file, "r") as f:
+        protocol = json.load(f)
+    save_protocol_copy(session_path, protocol)
+
+    state.current_mouse_file = mouse_file
+    state.current_mouse_data = mouse_data
+    state.current_session_name = session_name
+    state.current_protocol = protocol
+    state.protocol_file_path = protocol_file
+    return session_path, protocol
+
+# ---- Sensor CSV used by Engine._flush_csv ----
+def open_sensor_csv(session_path, state=None):
+    """Opens sensor_data.csv for appending and installs it as state.csv_writer (default: shared_states)."""
+    state = state or shared_states
+    close_sensor_csv(state)
+    path = os.path.join(session_path, "sensor_data.csv")
+    write_header = not os.path.isfile(path) or os.path.getsize(path) == 0
+    state.csv_file = open(path, "a", newline="")
+    state.csv_writer = csv.writer(state.csv_file)
+    if write_header:
+        state.csv_writer.writerow(state.topology.csv_header())
+    return path
+
+def close_sensor_csv(state=None):
+    state = state or shared_states
+    if state.csv_file:
+        try:
+            state.csv_file.close()
+        except Exception as e:
+            print(f"[ERROR] Could not close sensor CSV: {e}")
+    state.csv_file = None
+    state.csv_writer = None
+
+# ---- Pose CSV used by Engine._flush_pose ----
+def open_pose_csv(session_path, state=None, n_keypoints=1):
+    """
+    Opens pose_estimation.csv for appending and installs it as state.pose_csv_writer.
+    A file without data rows gets the header for n_keypoints (re)written.
+    """
+    state = state or shared_states
+    close_pose_csv(state)
+    path = os.path.join(session_path, "pose_estimation.csv")
+    header = pose_csv_header(n_keypoints)
+    has_rows = False
+    if os.path.isfile(path):
+        with open(path, "r", newline="") as f:
+            f.readline()
+            has_rows = bool(f.readline())
+    state.pose_csv_file = open(path, "a" if has_rows else "w", newline="")
+    state.pose_csv_writer = csv.writer(state.pose_csv_file)
+    if not has_rows:
+        state.pose_csv_writer.writerow(header)
+    return path
+
+def close_pose_csv(state=None):
+    state = state or shared_states
+    if state.pose_csv_file:
+        try:
+            state.pose_csv_file.close()
+        except Exception as e:
+            print(f"[ERROR] Could not close pose CSV: {e}")
+    state.pose_csv_file = None
+    state.pose_csv_writer = None
@@ -0,0 +1,323 @@
+# session_loader.py
+"""
+Cached loading of recorded sessions for offline analysis.
+
+A session folder (<mouse>/<sessionN>/, as created by session_files) is parsed
+once from its CSVs (sensor_data.csv, trial_events.csv, pose_estimation.csv)
+and cached as compressed columnar arrays in session_cache.npz next to them.
+The cache stores the mtime and size of every source file and is rebuilt
+automatically when one of them changes. Many sessions load in parallel in a
+process pool.
+
+    from session_loader import find_sessions, load_sessions
+    sessions = load_sessions(find_sessions("/data/mice"))
+    for s in sessions.values():
+        for trial in s.trials():
+            t, v = trial.sensor()
+
+    python session_loader.py <root> [--workers 4] [--rebuild]
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+
+CACHE_NAME = "session_cache.npz"
+CACHE_VERSION = 1
+SOURCE_FILES = ("sensor_data.csv", "trial_events.csv", "pose_estimation.csv")
+
+
+# ---------- CSV parsing ----------
+def _read_numeric_csv(path):
+    """(header, float64 [N, C]) of a numeric CSV with one header row."""
+    with open(path, "r", newline="") as f:
+        header = next(csv.reader([f.readline()]), [])
+        body = f.read()
+    if not body.strip():
+        return header, np.zeros((0, len(header)), dtype=np.float64)
+    data = np.loadtxt(body.splitlines(), delimiter=",", dtype=np.float64, ndmin=2)
+    return header, data
+
+def _read_event_csv(path):
+    t, kinds, details, pc = [], [], [], []
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                t.append(float(row.get("arduino_timestamp")))
+            except (TypeError, ValueError):
+                t.append(np.nan)
+            kinds.append(row.get("event_type") or "")
+            details.append(row.get("details") or "")
+            pc.append(row.get("pc_timestamp") or "")
+    return {
+        "event_t": np.asarray(t, dtype=np.float64),
+        "event_type": np.asarray(kinds, dtype=np.str_),
+        "event_details": np.asarray(details, dtype=np.str_),
+        "event_pc_timestamp": np.asarray(pc, dtype=np.str_),
+    }
+
+def parse_session(session_path):
+    """Parses the session CSVs into a dict of arrays (the cache content)."""
+    arrays = {}
+    sensor_path = os.path.join(session_path, "sensor_data.csv")
+    if os.path.isfile(sensor_path):
+        header, data = _read_numeric_csv(sensor_path)
+        arrays["sensor_t"] = data[:, 0].copy() if data.shape[1] else np.zeros(0)
+        arrays["sensor"] = data[:, 1:].astype(np.int32)
+        arrays["sensor_columns"] = np.asarray(header[1:], dtype=np.str_)
+    event_path = os.path.join(session_path, "trial_events.csv")
+    if os.path.isfile(event_path):
+        arrays.update(_read_event_csv(event_path))
+    pose_path = os.path.join(session_path, "pose_estimation.csv")
+    if os.path.isfile(pose_path):
+        header, data = _read_numeric_csv(pose_path)
+        arrays["pose_t"] = data[:, 0].copy() if data.shape[1] else np.zeros(0)
+        arrays["pose"] = data[:, 1:].astype(np.float32)
+        arrays["pose_columns"] = np.asarray(header[1:], dtype=np.str_)
+    return arrays
+
+
+# ---------- Cache ----------
+def source_signature(session_path):
+    """{file: [mtime_ns, size]} of the session's source files that exist."""
+    sig = {}
+    for name in SOURCE_FILES:
+        path = os.path.join(session_path, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        sig[name] = [st.st_mtime_ns, st.st_size]
+    return sig
+
+def _signature_blob(sig):
+    return np.asarray(json.dumps({"version": CACHE_VERSION, "files": sig}, sort_keys=True))
+
+def read_cache(session_path, sig=None):
+    """Cached arrays, or None if there is no cache or it is stale."""
+    path = os.path.join(session_path, CACHE_NAME)
+    if not os.path.isfile(path):
+        return None
+    sig = source_signature(session_path) if sig is None else sig
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            if str(npz["_signature"]) != str(_signature_blob(sig)):
+                return None
+            return {k: npz[k] for k in npz.files if k != "_signature"}
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[LOADER] Ignoring unreadable cache {path}: {e}")
+        return None
+
+def write_cache(session_path, arrays, sig=None):
+    """Writes the cache atomically (parallel loaders never see a partial file)."""
+    path = os.path.join(session_path, CACHE_NAME)
+    sig = source_signature(session_path) if sig is None else sig
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, _signature=_signature_blob(sig), **arrays)
+        os.replace(tmp, path)
+        return True
+    except OSError as e:
+        print(f"[LOADER] Could not write cache {path}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+
+
+# ---------- Loaded sessions ----------
+class TrialView:
+    """One trial of a session: index slices into the session arrays (no copies)."""
+    def __init__(self, session, index, t_start, t_end):
+        self.session = session
+        self.index = index
+        self.t_start = t_start
+        self.t_end = t_end
+
+    def _slice(self, t):
+        lo, hi = np.searchsorted(t, [self.t_start, self.t_end], side="left")
+        return slice(int(lo), int(hi))
+
+    def sensor(self):
+        s = self._slice(self.session.sensor_t)
+        return self.session.sensor_t[s], self.session.sensor[s]
+
+    def pose(self):
+        s = self._slice(self.session.pose_t)
+        return self.session.pose_t[s], self.session.pose[s]
+
+    def events(self):
+        ev = self.session
+        s = self._slice(ev.event_t)
+        return ev.event_t[s], ev.event_type[s], ev.event_details[s]
+
+    def phase_onsets(self):
+        """{event_type: first time} of the phase events inside this trial."""
+        t, kinds, _ = self.events()
+        onsets = {}
+        for ti, kind in zip(t, kinds):
+            onsets.setdefault(str(kind), float(ti))
+        return onsets
+
+    def __repr__(self):
+        return f"TrialView(#{self.index}, {self.t_start:.3f}-{self.t_end:.3f} s)"
+
+
+def _fill_event_times(event_t, sensor_t):
+    """
+    Event times (file order) with missing ones filled in. Sessions recorded
+    before events fell back to the controller clock log session_start and the
+    first trial_start before the first sensor sample, without a timestamp:
+    such rows take the time of the next timestamped event (at most the first
+    sensor time), rows after the last one the time of the previous one.
+    """
+    event_t = np.array(event_t, dtype=np.float64)
+    missing = ~np.isfinite(event_t)
+    if not missing.any():
+        return event_t
+    first_sample = sensor_t[0] if len(sensor_t) else np.inf
+    stamped = np.flatnonzero(~missing)
+    if not len(stamped):
+        event_t[missing] = first_sample if np.isfinite(first_sample) else np.nan
+        return event_t
+    nxt = np.searchsorted(stamped, np.flatnonzero(missing))
+    filled = np.where(nxt < len(stamped), event_t[stamped[np.minimum(nxt, len(stamped) - 1)]],
+                      event_t[stamped[-1]])
+    leading = nxt == 0
+    filled[leading] = np.minimum(filled[leading], first_sample)
+    event_t[missing] = filled
+    return event_t
+
+
+class SessionData:
+    """Typed arrays of one session. Missing files give empty arrays."""
+    def __init__(self, path, arrays, from_cache=False):
+        self.path = path
+        self.from_cache = from_cache
+        self.sensor_t = arrays.get("sensor_t", np.zeros(0))
+        self.sensor = arrays.get("sensor", np.zeros((0, 0), dtype=np.int32))
+        self.sensor_columns = [str(c) for c in arrays.get("sensor_columns", [])]
+        self.pose_t = arrays.get("pose_t", np.zeros(0))
+        self.pose = arrays.get("pose", np.zeros((0, 0), dtype=np.float32))
+        self.pose_columns = [str(c) for c in arrays.get("pose_columns", [])]
+
+        # events sorted by Engine time; rows without a timestamp get one from their neighbours
+        event_t = _fill_event_times(arrays.get("event_t", np.zeros(0)), self.sensor_t)
+        order = np.argsort(event_t, kind="stable")
+        self.event_t = event_t[order]
+        self.event_type = arrays.get("event_type", np.zeros(0, dtype=np.str_))[order]
+        self.event_details = arrays.get("event_details", np.zeros(0, dtype=np.str_))[order]
+        self.event_pc_timestamp = arrays.get("event_pc_timestamp", np.zeros(0, dtype=np.str_))[order]
+
+    @property
+    def name(self):
+        return os.path.basename(os.path.normpath(self.path))
+
+    @property
+    def mouse(self):
+        return os.path.basename(os.path.dirname(os.path.normpath(self.path)))
+
+    def column(self, name):
+        """Sensor column by header name (e.g. 'sensor3')."""
+        return self.sensor[:, self.sensor_columns.index(name)]
+
+    def events_of(self, event_type):
+        mask = self.event_type == event_type
+        return self.event_t[mask], self.event_details[mask]
+
+    def trials(self):
+        """TrialViews from consecutive trial_start events (the last one ends with the recording)."""
+        starts = self.event_t[(self.event_type == "trial_start") & np.isfinite(self.event_t)]
+        ends_with = [self.sensor_t[-1] if len(self.sensor_t) else -np.inf,
+                     self.pose_t[-1] if len(self.pose_t) else -np.inf]
+        finite_events = self.event_t[np.isfinite(self.event_t)]
+        if len(finite_events):
+            ends_with.append(finite_events[-1])
+        t_last = np.nextafter(max(ends_with), np.inf)
+        bounds = list(starts) + [t_last]
+        return [TrialView(self, i + 1, float(bounds[i]), float(bounds[i + 1])) for i in range(len(starts))]
+
+    def __repr__(self):
+        return (f"SessionData({self.mouse}/{self.name}: {len(self.sensor_t)} samples, "
+                f"{len(self.event_t)} events, {len(self.pose_t)} poses)")
+
+
+def load_session(session_path, use_cache=True, rebuild=False):
+    """Loads one session folder, from the cache when it is up to date."""
+    sig = source_signature(session_path)
+    if not sig:
+        raise FileNotFoundError(f"No session files in {session_path}")
+    if use_cache and not rebuild:
+        arrays = read_cache(session_path, sig)
+        if arrays is not None:
+            return SessionData(session_path, arrays, from_cache=True)
+    arrays = parse_session(session_path)
+    if use_cache:
+        write_cache(session_path, arrays, sig)
+    return SessionData(session_path, arrays)
+
+
+# ---------- Many sessions ----------
+def find_sessions(root):
+    """Session folders below root (a data folder, a mouse folder or a session folder), sorted."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d != "frames" and not d.startswith("."))
+        if any(name in filenames for name in SOURCE_FILES):
+            found.append(dirpath)
+    return found
+
+def _load_worker(args):
+    path, use_cache, rebuild = args
+    try:
+        return path, load_session(path, use_cache=use_cache, rebuild=rebuild), None
+    except Exception as e:
+        return path, None, str(e)
+
+def load_sessions(paths, workers=None, use_cache=True, rebuild=False):
+    """
+    Loads sessions in parallel ({path: SessionData}); sessions that fail to
+    load are reported and left out. workers=1 loads in this process.
+    """
+    paths = list(paths)
+    workers = workers or min(len(paths), os.cpu_count() or 1)
+    jobs = [(p, use_cache, rebuild) for p in paths]
+    pool = None
+    if workers > 1 and len(paths) > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    sessions = {}
+    try:
+        for path, session, error in (pool.map(_load_worker, jobs) if pool else map(_load_worker, jobs)):
+            if error is not None:
+                print(f"[LOADER] Failed to load {path}: {error}")
+            else:
+                sessions[path] = session
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return sessions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load (and cache) recorded sessions.")
+    parser.add_argument("root", help="Data, mouse or session folder")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--rebuild", action="store_true", help="Ignore existing caches")
+    args = parser.parse_args(argv)
+
+    paths = find_sessions(args.root)
+    t0 = time.perf_counter()
+    sessions = load_sessions(paths, workers=args.workers, rebuild=args.rebuild)
+    elapsed = time.perf_counter() - t0
+    for s in sessions.values():
+        print(f"[LOADER] {s!r}, {len(s.trials())} trials{' (cached)' if s.from_cache else ''}")
+    print(f"[LOADER] {len(sessions)}/{len(paths)} sessions loaded in {elapsed:.2f} s")
+    return 0 if len(sessions) == len(paths) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
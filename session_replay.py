@@ -0,0 +1,398 @@
+# session_replay.py
+"""
+Replays a recorded session through the live Engine.
+
+A ReplaySource stands in for the camera/serial reads of Engine._read_live and
+feeds the recorded sensor rows (plus optional frames and trial events) through
+the unchanged processing and writer stages, either at the recorded pace or as
+fast as possible. The rows produced by the processing stage can be compared
+against the originally logged sensor_data.csv.
+
+With --trials a headless TrialController runs on the replay clock (the
+recorded sample times, in lockstep with the source) and gets the recorded
+licks as its lick input. Its commands, TTL edges included (an OutputScheduler
+stepped by the same clock), go to a RecordingDeviceRegistry, so no serial
+port is opened.
+
+Usage:
+    python session_replay.py <session_folder> [--pace fast|recorded] [--speed 2.0]
+                             [--frames] [--trials] [--compare]
+"""
+import argparse
+import csv
+import glob
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import shared_states as S
+from device_registry import RecordingDeviceRegistry
+from engine import Engine
+from output_scheduler import OutputScheduler
+from session_files import find_session_protocol
+
+SENSOR_LOG_NAMES = ("sensor_data.npy", "sensor_data.csv")
+
+
+# ---------- Loaders ----------
+def load_sensor_log(path):
+    """
+    Loads a sensor log as (times, values).
+    Accepts the CSV written by Engine (header + 'timestamp, v1..vN' rows) or a
+    binary .npy array with the same column layout.
+    """
+    if path.endswith(".npy"):
+        data = np.load(path)
+    else:
+        with open(path, "r", newline="") as f:
+            reader = csv.reader(f)
+            next(reader, None)  # header
+            rows = [row for row in reader if row]
+        if not rows:
+            return np.zeros(0), np.zeros((0, S.topology.n_ports), dtype=np.int64)
+        data = np.array(rows, dtype=np.float64)
+    data = np.atleast_2d(data)
+    times = data[:, 0].astype(np.float64)
+    values = data[:, 1:].astype(np.int64)
+    return times, values
+
+def find_sensor_log(session_path):
+    for name in SENSOR_LOG_NAMES:
+        path = os.path.join(session_path, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def load_frame_index(session_path):
+    """Returns [(t_seconds, path)] sorted by time for frames/frame_<ms>.jpg."""
+    index = []
+    for path in glob.glob(os.path.join(session_path, "frames", "frame_*.jpg")):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        try:
+            index.append((int(stem.split("_")[1]) / 1000.0, path))
+        except (IndexError, ValueError):
+            continue
+    index.sort()
+    return index
+
+def load_event_log(session_path):
+    """Returns trial_events.csv rows with a float 't' (Engine clock) where available."""
+    path = os.path.join(session_path, "trial_events.csv")
+    if not os.path.isfile(path):
+        return []
+    events = []
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                row["t"] = float(row.get("arduino_timestamp"))
+            except (TypeError, ValueError):
+                continue
+            events.append(row)
+    events.sort(key=lambda e: e["t"])
+    return events
+
+
+# ---------- Replay clock ----------
+class ReplayClock:
+    """
+    Time source for a TrialController during a replay: now() is the time of
+    the last replayed sample. sleep() returns once the replay has advanced
+    far enough, and advance() waits while the driven thread runs, so the
+    trial loop sees every step of the replayed time even at pace='fast'.
+    """
+    def __init__(self, t0=0.0):
+        self.t = float(t0)
+        self.finished = False
+        self._cond = threading.Condition()
+        self._thread = None     # thread driven by the clock (the trial loop)
+        self._wake_at = None    # its wake-up time while it sleeps, None while it runs
+        self.listeners = []     # called with every new time (e.g. OutputScheduler.run_due)
+
+    def now(self):
+        return self.t
+
+    def drive(self, thread):
+        """Replay steps wait for `thread` from now on (call before the source starts)."""
+        with self._cond:
+            self._thread = thread
+
+    def sleep(self, seconds):
+        with self._cond:
+            self._wake_at = self.t + seconds
+            self._cond.notify_all()
+            while not self.finished and self.t < self._wake_at:
+                self._cond.wait()
+            self._wake_at = None
+
+    def advance(self, t):
+        """Sets the replay time (source thread) and waits until the driven thread sleeps again."""
+        with self._cond:
+            self.t = t
+        for listener in self.listeners:
+            listener(t)
+        with self._cond:
+            self._cond.notify_all()
+            while (not self.finished and self._thread is not None and self._thread.is_alive()
+                   and (self._wake_at is None or self._wake_at <= t)):
+                self._cond.wait(0.05)
+
+    def finish(self):
+        """End of the replay: sleep() returns at once."""
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+
+# ---------- Replay source ----------
+class ReplaySource:
+    """
+    Acquisition source for Engine(source=...).
+
+    pace='recorded' sleeps so samples are delivered at the recorded intervals
+    (divided by speed), pace='fast' delivers them as fast as the pipeline
+    consumes them. Replay is lossless in both modes.
+    """
+    self_paced = True
+    lossless = True
+
+    def __init__(self, session_path, pace="fast", speed=1.0, load_frames=False, on_event=None, clock=None):
+        if pace not in ("fast", "recorded"):
+            raise ValueError(f"Unknown replay pace: {pace}")
+        log_path = find_sensor_log(session_path)
+        if log_path is None:
+            raise FileNotFoundError(f"No sensor log found in {session_path}")
+        self.session_path = session_path
+        self.log_path = log_path
+        self.pace = pace
+        self.speed = float(speed)
+        self.times, self.values = load_sensor_log(log_path)
+        self.frames = load_frame_index(session_path) if load_frames else []
+        self.events = load_event_log(session_path) if on_event else []
+        self.on_event = on_event
+        self.clock = clock      # ReplayClock advanced to every sample (after its events)
+
+        # CSV columns of each board's sensor reply, in topology board order
+        self.columns = [list(cols) for cols in S.topology.sensor_columns]
+        self._idx = 0
+        self._frame_idx = -1
+        self._frame_path = None
+        self._frame = None
+        self._event_idx = 0
+        self._wall_start = None
+        self.max_lag = 0.0  # worst delay behind the recorded schedule (recorded pace)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def recorded_duration(self):
+        return float(self.times[-1] - self.times[0]) if len(self.times) > 1 else 0.0
+
+    def read(self):
+        if self._idx >= len(self.times):
+            return None
+        t = float(self.times[self._idx])
+        row = self.values[self._idx]
+        self._idx += 1
+
+        if self.pace == "recorded":
+            if self._wall_start is None:
+                self._wall_start = time.perf_counter()
+            due = self._wall_start + (t - self.times[0]) / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.max_lag = max(self.max_lag, -delay)
+
+        frame = self._frame_at(t) if self.frames else None
+
+        while self._event_idx < len(self.events) and self.events[self._event_idx]["t"] <= t:
+            self.on_event(self.events[self._event_idx])
+            self._event_idx += 1
+        if self.clock is not None:
+            self.clock.advance(t)
+
+        ts = max(1, int(t * 1000))
+        readings = [(ts, [int(row[c]) for c in cols]) for cols in self.columns]
+        return (t, frame, readings)
+
+    def _frame_at(self, t):
+        # latest frame recorded at or before t
+        while self._frame_idx + 1 < len(self.frames) and self.frames[self._frame_idx + 1][0] <= t:
+            self._frame_idx += 1
+        if self._frame_idx < 0:
+            return None
+        path = self.frames[self._frame_idx][1]
+        if path != self._frame_path:
+            import cv2
+            self._frame = cv2.imread(path)
+            self._frame_path = path
+        return self._frame
+
+
+# ---------- Comparison ----------
+def compare_rows(recorded_times, recorded_values, produced_rows, atol=0):
+    """
+    Compares rows produced by the processing stage with the logged rows.
+    produced_rows: [(tstamp, [v1..vN])] as handed to the CSV writer.
+    """
+    n = min(len(recorded_times), len(produced_rows))
+    mismatched = 0
+    first_mismatch = None
+    max_abs_diff = 0
+    for i in range(n):
+        t, vals = produced_rows[i]
+        rec = recorded_values[i]
+        width = min(len(rec), len(vals))
+        diff = int(np.max(np.abs(np.asarray(vals[:width]) - rec[:width]))) if width else 0
+        max_abs_diff = max(max_abs_diff, diff)
+        if diff > atol or t != recorded_times[i]:
+            mismatched += 1
+            if first_mismatch is None:
+                first_mismatch = i
+    return {
+        "recorded_rows": int(len(recorded_times)),
+        "produced_rows": len(produced_rows),
+        "compared_rows": n,
+        "mismatched_rows": mismatched,
+        "first_mismatch": first_mismatch,
+        "max_abs_diff": max_abs_diff,
+        "match": mismatched == 0 and len(produced_rows) == len(recorded_times),
+    }
+
+
+# ---------- Runner ----------
+def run_replay(session_path, pace="fast", speed=1.0, load_frames=False,
+               run_trials=False, compare=False, target_hz=30):
+    """
+    Runs Engine (and optionally TrialController) on a recorded session and
+    returns a report dict. Shared state touched by the replay is restored.
+    """
+    events_seen = []
+    licks = None
+    controller = None
+    if run_trials:
+        protocol = find_session_protocol(session_path)
+        if protocol is None:
+            print(f"[REPLAY] No Protocol_*.json in {session_path}, trials disabled.")
+        else:
+            from trial_functionality import TrialController
+            from protocol_compiler import compiled_seed
+            try:
+                seed = compiled_seed(session_path)   # same trial schedule as the recording
+            except (OSError, ValueError, KeyError):
+                seed = None
+            licks = deque()
+
+    def on_event(event):
+        events_seen.append(event)
+        if licks is not None and event.get("event_type") == "reward_port_licks":
+            # recorded licks are the controller's lick input ("lick_on_reward_<id>")
+            try:
+                licks.append(int(event.get("details", "").rsplit("_", 1)[1]))
+            except (IndexError, ValueError):
+                pass
+
+    source = ReplaySource(session_path, pace=pace, speed=speed, load_frames=load_frames, on_event=on_event)
+    produced = []
+
+    clock = None
+    if licks is not None:
+        clock = source.clock = ReplayClock(source.times[0] if len(source) else 0.0)
+
+    saved = (S.is_recording, S.current_session_path, S.devices, S.output_scheduler)
+    # keep the processing stage's disk branch active, but never write into the recorded session
+    S.is_recording = True
+    S.current_session_path = None
+    # LED, relay and TTL commands of the replayed trials are recorded, never sent
+    S.devices = registry = RecordingDeviceRegistry(clock=clock.now if clock else None)
+    outputs = None
+
+    if clock is not None:
+        # pulse trains on the replay clock: edges are issued as the replay reaches them
+        S.output_scheduler = outputs = OutputScheduler(S, clock=clock.now)
+        clock.listeners.append(outputs.run_due)
+        controller = TrialController(headless=True, clock=clock.now, sleep=clock.sleep)
+        controller.load_protocol(protocol, seed=seed)
+        controller.lick_input = licks
+
+    engine = Engine(target_hz=target_hz, source=source, row_sink=produced.extend)
+    t_start = time.perf_counter()
+    try:
+        if controller:
+            controller.start_session()
+            clock.drive(controller.thread)
+        engine.start()
+        engine.wait_until_drained()
+        if controller:
+            controller.stop_event.set()
+            clock.finish()
+            if controller.session_running:
+                controller.stop_session()
+    finally:
+        if clock is not None:
+            clock.finish()
+        engine.stop()
+        S.is_recording, S.current_session_path, S.devices, S.output_scheduler = saved
+    wall = time.perf_counter() - t_start
+
+    report = {
+        "session": session_path,
+        "sensor_log": source.log_path,
+        "pace": pace,
+        "samples": len(source),
+        "events": len(events_seen),
+        "recorded_duration_s": source.recorded_duration,
+        "wall_time_s": wall,
+        "samples_per_s": len(source) / wall if wall > 0 else 0.0,
+        "speedup": source.recorded_duration / wall if wall > 0 else 0.0,
+        "max_lag_s": source.max_lag,
+    }
+    if controller:
+        stats = controller.analytics.snapshot()
+        report["trials"] = {
+            "completed": controller.current_trial_index,
+            "licks_fed": sum(1 for e in events_seen if e.get("event_type") == "reward_port_licks"),
+            "rewards_dispensed": stats["rewards_dispensed"],
+            "rewards_withheld": stats["rewards_withheld"],
+            "commands": len(registry.sent),
+            "output_edges": len(outputs.log),
+        }
+    if compare:
+        report["comparison"] = compare_rows(source.times, source.values, produced)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded session through Engine.")
+    parser.add_argument("session", help="Session folder containing sensor_data.csv")
+    parser.add_argument("--pace", choices=["fast", "recorded"], default="fast")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed factor for --pace recorded")
+    parser.add_argument("--frames", action="store_true", help="Replay frames from frames/")
+    parser.add_argument("--trials", action="store_true", help="Run TrialController with the session protocol")
+    parser.add_argument("--compare", action="store_true", help="Compare processed rows against the log")
+    args = parser.parse_args(argv)
+
+    report = run_replay(args.session, pace=args.pace, speed=args.speed, load_frames=args.frames,
+                        run_trials=args.trials, compare=args.compare)
+    print(f"[REPLAY] {report['samples']} samples, {report['events']} events in {report['wall_time_s']:.3f}s "
+          f"({report['samples_per_s']:.0f} samples/s, {report['speedup']:.1f}x recorded pace)")
+    if "trials" in report:
+        tr = report["trials"]
+        print(f"[REPLAY] Trials: {tr['completed']} completed, {tr['licks_fed']} recorded licks fed, "
+              f"{tr['rewards_dispensed']} dispensed / {tr['rewards_withheld']} withheld, "
+              f"{tr['commands']} board commands (recorded, not sent)")
+    if args.compare:
+        cmp = report["comparison"]
+        status = "MATCH" if cmp["match"] else "MISMATCH"
+        print(f"[REPLAY] {status}: {cmp['produced_rows']}/{cmp['recorded_rows']} rows, "
+              f"{cmp['mismatched_rows']} mismatched, max abs diff {cmp['max_abs_diff']}")
+        return 0 if cmp["match"] else 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
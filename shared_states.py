@@ -1,14 +1,23 @@
 # Serial Communication
-import serial
 from collections import deque
+from device_registry import DeviceRegistry, load_arena_config
+from topology import Topology
+from position_tracker import PositionStream
+
+# Devices (ser1, ser2, ...) come from Config/arena.json and are opened on first
+# access of shared_states.<name>, so importing this module never touches a port.
+arena_config = load_arena_config()
+devices = DeviceRegistry.from_config(arena_config)
+# Board/lickport layout: command routing and sensor columns (see topology.py)
+topology = Topology.from_config(arena_config)
+
+def __getattr__(name):
+    if name in devices.configs:
+        return devices.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-ser1 = serial.Serial('COM10', 115200, timeout=1)
-ser2 = serial.Serial('COM11', 115200, timeout=1)
 TARGET_FPS = 60
-sensor_mapping = {
-    "ser1": [1, 2],  # Maps ser1 values to sensors 1 and 2
-    "ser2": [9],     # Maps ser2 values to sensor 9
-}
+sensor_mapping = topology.sensor_mapping()  # e.g. ser1 values -> sensors 1 and 2, ser2 -> sensor 9
 
 remembered_relays = {
     "1": None,  # For Reward 1
@@ -17,8 +26,12 @@ remembered_relays = {
 
 timestamps = {}     
 data_buffers = {}    
-gui_time_buffers = [deque(maxlen=500) for _ in range(16)]
-gui_plot_buffers = [deque(maxlen=500) for _ in range(16)]
+# live plot buffers: the min and max sample of every GUI_PUSH_PERIOD (the last 50 s)
+GUI_PUSH_PERIOD = 0.1
+GUI_BUFFER_LEN = 1000
+gui_time_buffers = [deque(maxlen=GUI_BUFFER_LEN) for _ in range(topology.n_ports)]
+gui_plot_buffers = [deque(maxlen=GUI_BUFFER_LEN) for _ in range(topology.n_ports)]
+sensor_history = {}  # sensor_id -> history_pyramid.HistoryPyramid, filled by the Engine
 
 trial_controller = None
 
@@ -36,7 +49,13 @@ protocol_file_path = None
 pending_protocol_save = None
 csv_file = None
 csv_writer = None
+pose_csv_file = None
+pose_csv_writer = None
 protocol_loaded = False
+output_scheduler = None  # output_scheduler.OutputScheduler, created on first use
+frame_recorder = None    # recording_policy.FrameRecorder of the running Engine
+dashboard = None         # web_dashboard.WebDashboard, if one is serving
+profiler = None          # profiler.SamplingProfiler, created on first use
 # Buffer for sensor CSV writing
 csv_buffer = []
 CSV_FLUSH_EVERY_N = 60  # flush every ~1 sec if running at 30Hz
@@ -85,6 +104,8 @@ import threading
 
 last_camera_frame = None
 camera_lock = threading.Lock()
+# tracked animal position (t, x, y, confidence), filled by the Engine's tracker
+position_stream = PositionStream()
 
 engine_instance = None
 plot_thread = None
@@ -94,6 +115,9 @@ plot_stop_event = threading.Event()
 
 is_recording = False
 
+# startup timings (ms) reported by main_gui once the GUI is interactive
+startup_timings = {}
+
 # GUI stuff
 
 gui_actions = []
@@ -103,11 +127,11 @@ buttons_lickports2 = {}
 active_theme = None
 plots_initialized = False
 frame_counter = 0
-label_table = [[1,2,3,4,5,6,7,8],[9,10,11,12,13,14,15,16]]
+label_table = topology.label_rows()
 trial_labels = [["Reward-Phase", "Intertrial-Phase"]]
 MAX_POINTS = 200
 UPDATE_PLOT_EVERY_N_FRAMES = 3
 # Plot buffering
-plot_update_buffer = [[] for _ in range(16)]  # same indexing as data_buffers
+plot_update_buffer = [[] for _ in range(topology.n_ports)]  # same indexing as data_buffers
 PLOT_UPDATE_INTERVAL = 0.3
 last_plot_update_time = 0
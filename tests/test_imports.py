@@ -0,0 +1,18 @@
+# tests/test_imports.py
+"""Every module that runs without the GUI must import on its own."""
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HEADLESS_MODULES = ["arena", "engine", "headless_session", "session_replay", "trial_functionality",
+                    "logging_setup", "protocol_compiler", "arduino_emulator", "pose_inference",
+                    "web_dashboard", "profiler"]
+
+
+@pytest.mark.parametrize("name", HEADLESS_MODULES)
+def test_module_imports(name):
+    importlib.import_module(name)
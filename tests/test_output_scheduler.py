@@ -0,0 +1,29 @@
+# tests/test_output_scheduler.py
+"""Pulse trains on a stepped (replay) clock."""
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from device_registry import RecordingDeviceRegistry
+from output_scheduler import OutputScheduler
+from protocol_compiler import OutputSpec
+
+
+def test_stepped_clock_issues_every_edge_at_its_replay_time():
+    now = [100.0]
+    state = SimpleNamespace(topology=SimpleNamespace(boards=["ser1"]), arena_config={},
+                            current_session_path=None, devices=RecordingDeviceRegistry(clock=lambda: now[0]))
+    outputs = OutputScheduler(state, clock=lambda: now[0])
+    outputs.start()                                  # no timer thread on a stepped clock
+    assert outputs.trigger("reward_phase", OutputSpec(channel=4, frequency=20.0, pulses=20, width=0.01)) == 20
+    assert not outputs.log
+    while now[0] < 101.0:
+        now[0] = round(now[0] + 0.01, 6)
+        outputs.run_due(now[0])
+    assert len(outputs.log) == 40
+    assert [row[2] for row in list(outputs.log)[:4]] == [1, 0, 1, 0]
+    assert all(0.0 <= issued - scheduled < 0.01 + 1e-9 for _, _, _, scheduled, issued, _ in outputs.log)
+    assert all(acked == issued for *_, issued, acked in outputs.log)
+    assert [data for _, _, data in state.devices.sent[:2]] == [b"T41", b"T40"]
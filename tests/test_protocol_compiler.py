@@ -0,0 +1,22 @@
+# tests/test_protocol_compiler.py
+"""Seeded trial schedules."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol_compiler import compile_protocol, extend_schedule
+
+
+def _protocol(duration):
+    return {"trial_settings": {"mode": "fixed_time", "session_duration": duration},
+            "phase_length_settings": {"phase_length_mode": "position"},
+            "num_rewards": 2, "reward1_probability": 0.5}
+
+
+def test_extended_schedule_continues_the_seeded_streams():
+    short = compile_protocol(_protocol(5), seed=3)
+    long = compile_protocol(_protocol(60), seed=3)
+    tail = extend_schedule(short, 20)
+    assert [plan.index for plan in tail] == list(range(len(short) + 1, len(short) + 21))
+    assert tail == long.schedule[len(short):len(short) + 20]
@@ -0,0 +1,51 @@
+# tests/test_serial_dispatcher.py
+"""Write order of queued board commands."""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serial_dispatcher import BoardDispatcher, SEQ_PREFIX
+
+
+class HeldDevice:
+    """Blocks the first write until released, so later commands queue up."""
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.written = []
+
+    def write(self, data):
+        self.started.set()
+        self.release.wait(2.0)
+        if data[:1] == SEQ_PREFIX:
+            data = data[2:]
+        self.written.append(data)
+
+
+def _write_order(commands):
+    device = HeldDevice()
+    dispatcher = BoardDispatcher("test", device, ack_timeout=10.0)
+    try:
+        dispatcher.submit(b"P1\x80")
+        assert device.started.wait(2.0)
+        for data in commands:
+            dispatcher.submit(data)
+        device.release.set()
+        assert dispatcher.flush(2.0)
+    finally:
+        dispatcher.stop()
+    return device.written[1:]
+
+
+def test_led_mask_is_not_overtaken_by_a_later_reset():
+    assert _write_order([b"B\x01\x00", b"i"]) == [b"B\x01\x00", b"i"]
+
+
+def test_led_is_not_overtaken_by_a_later_reset():
+    assert _write_order([b"L\x01", b"s", b"i"]) == [b"L\x01", b"i", b"s"]
+
+
+def test_classes_without_common_state_keep_their_priority():
+    assert _write_order([b"L\x01", b"s", b"M1\x02"]) == [b"M1\x02", b"s", b"L\x01"]
@@ -0,0 +1,44 @@
+# tests/test_session_loader.py
+"""Loading a synthetic session folder."""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_loader import load_session
+
+
+def _write_session(folder, event_rows):
+    with open(os.path.join(folder, "sensor_data.csv"), "w") as f:
+        f.write("timestamp,sensor1\n")
+        for i in range(50):
+            f.write(f"{100.0 + 0.1 * i:.3f},{i}\n")
+    with open(os.path.join(folder, "trial_events.csv"), "w") as f:
+        f.write("pc_timestamp,arduino_timestamp,event_type,details\n")
+        for t, kind in event_rows:
+            f.write(f"2026-01-01 12:00:00,{t},{kind},\n")
+
+
+def test_first_trial_without_timestamp_is_kept(tmp_path):
+    _write_session(str(tmp_path), [("", "session_start"), ("", "trial_start"), ("101.0", "reward_phase"),
+                                   ("102.0", "trial_start"), ("103.0", "reward_phase")])
+    session = load_session(str(tmp_path), use_cache=False)
+    trials = session.trials()
+    assert len(trials) == 2
+    assert trials[0].t_start == 100.0           # first sensor time, before the next event
+    assert trials[1].t_start == 102.0
+    assert np.isfinite(session.event_t).all()
+    assert list(session.event_type[:2]) == ["session_start", "trial_start"]
+    t, _ = trials[0].sensor()
+    assert len(t) == 20
+
+
+def test_events_without_sensor_data_take_the_next_event_time(tmp_path):
+    with open(os.path.join(str(tmp_path), "trial_events.csv"), "w") as f:
+        f.write("pc_timestamp,arduino_timestamp,event_type,details\n"
+                "x,,trial_start,\nx,5.0,reward_phase,\nx,6.0,trial_start,\nx,,session_end,\n")
+    session = load_session(str(tmp_path), use_cache=False)
+    assert [v.t_start for v in session.trials()] == [5.0, 6.0]
+    assert session.event_t[-1] == 6.0
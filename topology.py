@@ -0,0 +1,99 @@
+# topology.py
+# Board/lickport topology loaded from the "devices" section of Config/arena.json.
+#
+# Each device lists the global lickport numbers it serves ("ports", in local
+# order: the first entry is the board's relay/LED 1) and the lickports whose
+# capacitive sensors appear, in order, in its 'cs:' reply ("sensors").
+# All command bytes and sensor routes are precomputed here so the hot paths
+# only do table lookups.
+import math
+
+MAX_PORTS_PER_BOARD = 8  # firmware addresses relays/LEDs with the digits '1'..'8'
+
+# Used when a device entry has no "ports"/"sensors" (the original 2x8 rig).
+LEGACY_LAYOUT = {
+    "ser1": {"ports": list(range(1, 9)), "sensors": [1, 2]},
+    "ser2": {"ports": list(range(9, 17)), "sensors": [9]},
+}
+
+
+class Topology:
+    def __init__(self, device_cfgs):
+        self.boards = []                 # device names in config order
+        self.board_ports = {}            # board -> [global port]
+        self.board_sensors = {}          # board -> [global port] in reply order
+        self.port_board = {}             # port -> board
+        self.port_local = {}             # port -> 1-based local index
+
+        for name, cfg in device_cfgs.items():
+            legacy = LEGACY_LAYOUT.get(name, {})
+            ports = [int(p) for p in cfg.get("ports", legacy.get("ports", []))]
+            sensors = [int(p) for p in cfg.get("sensors", legacy.get("sensors", []))]
+            if len(ports) > MAX_PORTS_PER_BOARD:
+                raise ValueError(f"{name}: at most {MAX_PORTS_PER_BOARD} ports per board, got {len(ports)}")
+            for local, port in enumerate(ports, start=1):
+                if port in self.port_board:
+                    raise ValueError(f"Port {port} assigned to both {self.port_board[port]} and {name}")
+                self.port_board[port] = name
+                self.port_local[port] = local
+            for port in sensors:
+                if port not in ports:
+                    raise ValueError(f"{name}: sensor port {port} is not one of its ports")
+            self.boards.append(name)
+            self.board_ports[name] = ports
+            self.board_sensors[name] = sensors
+
+        self.ports = sorted(self.port_board)
+        self.n_ports = max(self.ports) if self.ports else 0
+        self.sensor_ports = sorted(p for b in self.boards for p in self.board_sensors[b])
+
+        # --- precomputed command tables (port -> (board, bytes)) ---
+        self.led_on_cmd = {}
+        self.led_off_cmd = {}
+        self.select_cmd = {}
+        for port in self.ports:
+            board = self.port_board[port]
+            digit = str(self.port_local[port])
+            self.led_on_cmd[port] = (board, f"L{digit}".encode())
+            self.led_off_cmd[port] = (board, f"l{digit}".encode())
+            self.select_cmd[port] = (board, digit.encode())
+
+        # --- sensor routing: board index -> 0-based CSV/buffer columns in reply order ---
+        self.sensor_columns = [[p - 1 for p in self.board_sensors[b]] for b in self.boards]
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("devices", {}))
+
+    def has_port(self, port):
+        return port in self.port_board
+
+    def map_command(self, port, reward_group):
+        """(board, b'M<local><group>') for a relay -> reward group assignment."""
+        return self.port_board[port], f"M{self.port_local[port]}{int(reward_group)}".encode()
+
+    def port_masks(self, ports):
+        """{board: bitmask} for a set of ports (bit 0 = the board's relay/LED 1), every board listed."""
+        masks = dict.fromkeys(self.boards, 0)
+        for port in ports:
+            board = self.port_board.get(int(port))
+            if board is not None:
+                masks[board] |= 1 << (self.port_local[int(port)] - 1)
+        return masks
+
+    def sensor_mapping(self):
+        """Legacy {board: [sensor port numbers]} view."""
+        return {b: list(self.board_sensors[b]) for b in self.boards}
+
+    def label_rows(self):
+        """One row of port numbers per board, for the lickport button tables."""
+        return [list(self.board_ports[b]) for b in self.boards if self.board_ports[b]]
+
+    def plot_grid(self):
+        """(rows, cols) for one plot per sensor port."""
+        n = max(1, len(self.sensor_ports))
+        cols = math.ceil(math.sqrt(n))
+        return math.ceil(n / cols), cols
+
+    def csv_header(self):
+        return ["timestamp"] + [f"sensor{i}" for i in range(1, self.n_ports + 1)]
@@ -2,22 +2,35 @@
 import threading
 import time
 import random
-import math
-import csv
 import os
 from typing import Dict, Any, Optional, Tuple, List
 
-import dearpygui.dearpygui as dpg
-
 import shared_states
-from utils import set_led, toggle_lickport_button, toggle_trial_button
+from hardware import set_outputs, send_trial_phase_commands
+from zones import ZoneMap, ZoneTracker
+from live_analytics import SessionAnalytics
+from session_catalog import get_catalog
+from protocol_compiler import compile_protocol, extend_schedule, ProtocolError
+from output_scheduler import get_output_scheduler
+from logging_setup import get_logger, open_csv_log, open_session_log, close_session_log, run_on_writer
 
 # NOTE: do NOT import active_theme, ser1, ser2 at module import time.
 # We'll reference them via shared_states.* at execution time so we always
 # use the up-to-date objects created in build_gui().
+# GUI modules (dearpygui, utils) are only imported lazily when headless=False,
+# so headless runs never load them.
 
 class TrialController:
-    def __init__(self):
+    def __init__(self, headless: bool = False, state=None, clock=None, sleep=None):
+        # state: shared_states module (default) or a per-arena arena.ArenaState;
+        # the GUI paths (headless=False) always use the global shared_states.
+        # clock / sleep: time source of the trial loop (default: perf_counter, the
+        # Engine clock); session_replay.py runs the loop on the replayed sample times.
+        self.headless = headless
+        self.state = state if state is not None else shared_states
+        self.logger = get_logger("trial", self.state)
+        self.clock = clock or time.perf_counter
+        self.sleep = sleep or time.sleep
         self.protocol: Dict[str, Any] = {}
         self.thread: Optional[threading.Thread] = None
         self.stop_event = threading.Event()
@@ -30,135 +43,149 @@ class TrialController:
         self.trial_count_target: Optional[int] = None
         self.session_duration_target: Optional[float] = None  # seconds
         self.session_start_time: Optional[float] = None
+        self.current_phase: Optional[str] = None
 
         # parsed config (defaults)
         self.phase_length_mode = "time"  # or "position"
         self.trial_phase_length = 10.0
         self.intertrial_phase_length = 5.0
         self.num_rewards = 0
-        self.reward1_probability = float(self.protocol.get("reward1_probability", 1.0))
-        self.reward2_probability = float(self.protocol.get("reward2_probability", 1.0))
-        self.reward_prob_enabled = (self.reward1_probability < 1.0 or self.reward2_probability < 1.0)
-        self.remembered_relays = shared_states.remembered_relays  # live reference
+        self.compiled = None  # CompiledProtocol: validated settings + seeded trial schedule
+        self.outputs = None   # OutputScheduler (TTL pulse trains), set at session start
+        self.trial_plan = None  # TrialPlan of the running trial
+        self._schedule_tail = ()  # plans past the compiled schedule (fixed_time sessions that outlast it)
+        self._fixed_seed = None  # seed given to load_protocol or by the protocol (else fresh per session)
+        self._schedule_used = False  # the compiled schedule already ran a session
+        self._reward_licks = [0, 0]  # gated licks per reward in the running trial
+        self.remembered_relays = self.state.remembered_relays  # live reference
         self.led_mode = "single"  # 'single' or 'neighbour' or 'all'
-        self.neighbour_leds_map = getattr(shared_states, "neighbour_leds_map", {})  # optional
+        self.neighbour_leds_map = getattr(self.state, "neighbour_leds_map", {})  # optional
         self.experiment_type = "Open-Field Experiment"
-        self.ymaze_settings = {}
-        self.light_sphere_cfg = {}
         self.trial_mode = "fixed_trials"  # 'fixed_trials' or 'fixed_time'
         self.mock_dlc_mode = "static"  # 'static' or 'random_walk' (for the mock)
         self.mock_mouse_pos = (0.5, 0.5)  # normalized arena coordinates [0..1]
+        self.min_position_confidence = 0.3  # tracker samples below this are ignored
+        self.tracked_mouse_pos: Optional[Tuple[float, float]] = None
+        self.zone_map: Optional[ZoneMap] = None
+        self.zone_tracker: Optional[ZoneTracker] = None
+        self._last_position_t: Optional[float] = None
         self.light_sphere_state = None  # (x, y, size)
-        self.event_log_file = None
-        self.event_log_writer = None
+        self.lick_input = None  # deque of reward ids licked (session replay); None: mock licks
+        self.analytics = SessionAnalytics()  # live per-trial statistics (GUI + session_summary.json)
+        self.event_log = None  # logging_setup.CsvLog of trial_events.csv (written on the LogWriter thread)
         self.event_log_path = None
 
     # ---- Protocol parsing and setup ----
-    def load_protocol(self, protocol: Dict[str, Any]):
+    def load_protocol(self, protocol: Dict[str, Any], seed: Optional[int] = None):
         """
-        Provide a protocol dictionary (the same format you already use).
-        This function extracts the fields relevant to trial control.
+        Validates and compiles a protocol dictionary (see protocol_compiler.py).
+        Raises ProtocolError if it is invalid. seed fixes the trial schedule;
+        without it (and without a "seed" in the protocol) every session draws a new one.
         """
         self.protocol = protocol or {}
-        # experiment type
-        self.experiment_type = self.protocol.get("experiment_type", self.experiment_type)
-
-        # light sphere settings (Open-Field)
-        self.light_sphere_cfg = self.protocol.get("light_sphere", {})
-
-        # LED config
-        self.led_mode = (self.protocol.get("led_configuration", {}).get("mode") or self.led_mode)
-
-        # trial settings
-        trial_settings = self.protocol.get("trial_settings", {})
-        if trial_settings.get("mode") == "fixed_trials":
-            self.trial_mode = "fixed_trials"
-            self.trial_count_target = trial_settings.get("trial_count")
-            self.session_duration_target = None
-        else:
-            self.trial_mode = "fixed_time"
-            self.trial_count_target = None
-            self.session_duration_target = trial_settings.get("session_duration")
-
-        # phase length settings
-        phase_length = self.protocol.get("phase_length_settings", {})
-        self.phase_length_mode = phase_length.get("phase_length_mode", self.phase_length_mode)
-        self.trial_phase_length = float(phase_length.get("trial_phase_length", self.trial_phase_length))
-        self.intertrial_phase_length = float(phase_length.get("intertrial_phase_length", self.intertrial_phase_length))
-
-        # rewards
-        self.num_rewards = int(self.protocol.get("num_rewards", self.num_rewards))
-
-        # y-maze
-        self.ymaze_settings = self.protocol.get("ymaze_settings", {})
+        if seed is None:
+            seed = self.protocol.get("seed")
+        try:
+            compiled = compile_protocol(self.protocol, seed)
+        except ProtocolError as e:
+            self.logger.error("[ERROR] %s", e)
+            raise
+        self._fixed_seed = seed
+        self._schedule_used = False
+        self._apply_compiled(compiled)
 
         # neighbour map fallback (create ring if not set)
         if not self.neighbour_leds_map:
-            self.neighbour_leds_map = self._default_neighbour_map(16)
-
-        # NEW: reward probability gating
-        rp = self.protocol.get("reward_probability", {})
-        self.reward_prob_enabled = bool(rp.get("enabled", False))
-        per_reward = rp.get("per_reward", {})
-        # normalize keys to strings, clamp to [0,1]
-        self.reward_prob_map = {
-            str(k): max(0.0, min(1.0, float(v)))
-            for k, v in per_reward.items()
-        }
-
-        print("[TRIAL] Protocol loaded into TrialController.")
-        print(f"       Experiment type: {self.experiment_type}")
-        print(f"       LED mode: {self.led_mode}, Phase length mode: {self.phase_length_mode}")
-        if self.trial_mode == "fixed_trials":
-            print(f"       Trial count target: {self.trial_count_target}")
+            self.neighbour_leds_map = self._default_neighbour_map(self.state.topology.ports)
+
+        # spatial zones (lickport proximity, Y-maze arms; the light sphere is set per trial)
+        self.zone_map = ZoneMap.from_protocol(self.protocol, self.state.topology.ports)
+        self.zone_tracker = ZoneTracker(self.zone_map)
+
+        c = self.compiled
+        self.logger.info("[TRIAL] Protocol loaded into TrialController.")
+        self.logger.info("       Experiment type: %s", c.experiment_type)
+        self.logger.info("       LED mode: %s, Phase length mode: %s", c.led_mode, c.phase_length_mode)
+        if c.trial_mode == "fixed_trials":
+            self.logger.info("       Trial count target: %s", c.trial_count)
         else:
-            print(f"       Session duration target: {self.session_duration_target}s")
-        if self.reward_prob_enabled:
-            print(f"       Reward probability gating ON: {self.reward_prob_map}")
+            self.logger.info("       Session duration target: %ss", c.session_duration)
+        if c.gating_enabled:
+            self.logger.info("       Reward probability gating ON: %s", c.reward_probabilities[:c.num_rewards])
         else:
-            print("       Reward probability gating OFF")
+            self.logger.info("       Reward probability gating OFF")
+        self.logger.info("       Trial schedule: %s trials, seed %s", len(c), c.seed)
+
+    def _apply_compiled(self, compiled):
+        """Copies the compiled settings used by the trial loop."""
+        self.compiled = compiled
+        self.experiment_type = compiled.experiment_type
+        self.led_mode = compiled.led_mode
+        self.trial_mode = compiled.trial_mode
+        self.trial_count_target = compiled.trial_count
+        self.session_duration_target = compiled.session_duration
+        self.phase_length_mode = compiled.phase_length_mode
+        self.trial_phase_length = compiled.trial_phase_length
+        self.intertrial_phase_length = compiled.intertrial_phase_length
+        self.num_rewards = compiled.num_rewards
 
     @staticmethod
-    def _default_neighbour_map(n_relays: int) -> Dict[int, List[int]]:
+    def _default_neighbour_map(ports: List[int]) -> Dict[int, List[int]]:
+        # ring over the arena's ports in numeric order
         m = {}
-        for i in range(1, n_relays + 1):
-            left = i - 1 if i > 1 else n_relays
-            right = i + 1 if i < n_relays else 1
-            m[i] = [left, right]
+        n = len(ports)
+        for i, port in enumerate(ports):
+            m[port] = [ports[i - 1], ports[(i + 1) % n]]
         return m
 
     # ---- Session control ----
     def start_session(self):
         if self.session_running:
-            print("[TRIAL] Session already running.")
+            self.logger.info("[TRIAL] Session already running.")
             return
         self.stop_event.clear()
         self.session_running = True
-        self.session_start_time = time.time()
+        self.session_start_time = self.clock()
         self.current_trial_index = 0
         self.collected_rewards = set()
+        self.tracked_mouse_pos = None
+        self._last_position_t = None
+        if self.compiled is None:
+            self.load_protocol(self.protocol)
+        elif self._fixed_seed is None and self._schedule_used:
+            # every session gets its own schedule unless the seed is fixed
+            self._apply_compiled(compile_protocol(self.protocol))
+        self._schedule_used = True
+        self._schedule_tail = ()
+        self.trial_plan = None
+        self.zone_tracker.reset()
+        self.analytics.on_session_start(self.clock())
+        self.outputs = get_output_scheduler(self.state)
+        self.outputs.reset_log()
 
         try:
-            session_path = shared_states.current_session_path
+            session_path = self.state.current_session_path
             if session_path and os.path.isdir(session_path):
+                open_session_log(session_path)
                 self.event_log_path = os.path.join(session_path, "trial_events.csv")
-                self.event_log_file = open(self.event_log_path, mode='w', newline='')
-                self.event_log_writer = csv.writer(self.event_log_file)
-                self.event_log_writer.writerow(["pc_timestamp", "arduino_timestamp", "event_type", "details"])
-                print(f"[TRIAL] Event log created: {self.event_log_path}")
+                self.event_log = open_csv_log(self.event_log_path,
+                                              ["pc_timestamp", "arduino_timestamp", "event_type", "details"])
+                self.logger.info("[TRIAL] Event log created: %s", self.event_log_path)
             else:
-                print("[TRIAL] No valid current_session_path found, event logging disabled.")
+                self.logger.info("[TRIAL] No valid current_session_path found, event logging disabled.")
         except Exception as e:
-            print(f"[TRIAL] Could not create event log: {e}")
+            self.logger.error("[TRIAL] Could not create event log: %s", e)
+        self._save_compiled_protocol()
 
-        self.thread = threading.Thread(target=self._trial_loop, daemon=True)
+        self._catalog_session_start()
+        self.thread = threading.Thread(target=self._trial_loop, name="TrialThread", daemon=True)
         self.thread.start()
         self._trigger_output("session_start")
-        print("[TRIAL] Session started.")
+        self.logger.info("[TRIAL] Session started.")
 
     def stop_session(self):
         if not self.session_running:
-            print("[TRIAL] Session is not running.")
+            self.logger.info("[TRIAL] Session is not running.")
             return
         self.stop_event.set()
         if self.thread:
@@ -166,25 +193,96 @@ class TrialController:
         self.session_running = False
         self._cleanup_after_session()
         self._trigger_output("session_stop")
-        from gui_functions import stop_recording_callback
-        shared_states.gui_actions.append(lambda: stop_recording_callback)
-        print("[TRIAL] Session stopped by user or end condition.")
-        if self.event_log_file:
+        self._write_session_summary()
+        self._finish_outputs()
+        if not self.headless:
+            from gui_functions import stop_recording_callback
+            shared_states.gui_actions.append(lambda: stop_recording_callback)
+        self.logger.info("[TRIAL] Session stopped by user or end condition.")
+        self._close_event_log()
+
+    def _write_session_summary(self):
+        self.analytics.on_session_end(self.clock())
+        session_path = self.state.current_session_path
+        if not (session_path and os.path.isdir(session_path)):
+            return
+        # taken now, written on the LogWriter thread
+        summary, snapshot = self.analytics.summary(), self.analytics.snapshot()
+        arena_config = getattr(self.state, "arena_config", None)
+
+        def write():
+            try:
+                path = self.analytics.write_summary(os.path.join(session_path, "session_summary.json"), summary)
+                self.logger.info("[TRIAL] Session summary saved to %s", path)
+            except Exception as e:
+                self.logger.error("[TRIAL] Could not write session summary: %s", e)
             try:
-                self.event_log_file.close()
-                print(f"[TRIAL] Event log saved to {self.event_log_path}")
+                get_catalog(arena_config).record_session_end(session_path, snapshot)
             except Exception as e:
-                print(f"[TRIAL] Error closing event log: {e}")
-            self.event_log_file = None
-            self.event_log_writer = None
+                self.logger.error("[CATALOG] Could not update session entry: %s", e)
+        run_on_writer(write)
 
-    def _cleanup_after_session(self):
-        print("[TRIAL] Cleaning up: turning off LEDs and light sphere.")
-        for led in range(1, 17):
+    def _finish_outputs(self):
+        """Pulls the TTL outputs low and saves their edge timing (output_timing.csv)."""
+        outputs = self.outputs
+        if outputs is None:
+            return
+        outputs.release("session_end")
+        self.state.devices.wait_acked(0.5)
+        session_path = self.state.current_session_path
+        if session_path and os.path.isdir(session_path) and outputs.log:
+            rows = list(outputs.log)
+
+            def write():
+                try:
+                    path = outputs.write_log(session_path, rows)
+                    self.logger.info("[OUTPUT] Output timing saved to %s", path)
+                except OSError as e:
+                    self.logger.error("[OUTPUT] Could not write output timing: %s", e)
+            run_on_writer(write)
+        self.logger.info("%s", outputs.format_summary())
+
+    def _save_compiled_protocol(self):
+        session_path = self.state.current_session_path
+        if not (session_path and os.path.isdir(session_path)):
+            return
+        compiled = self.compiled
+
+        def write():
             try:
-                set_led(None, led, on=False)
-            except Exception:
-                pass
+                path = compiled.save(session_path)
+                self.logger.info("[TRIAL] Trial schedule (seed %s) saved to %s", compiled.seed, path)
+            except Exception as e:
+                self.logger.error("[TRIAL] Could not save trial schedule: %s", e)
+        run_on_writer(write)
+
+    def _catalog_session_start(self):
+        session_path = self.state.current_session_path
+        if not (session_path and os.path.isdir(session_path)):
+            return
+        arena_config = getattr(self.state, "arena_config", None)
+        entry = dict(mouse_file=self.state.current_mouse_file, mouse_data=self.state.current_mouse_data,
+                     protocol=self.protocol, relays=dict(self.remembered_relays or {}))
+
+        def write():
+            try:
+                get_catalog(arena_config).record_session_start(session_path, **entry)
+            except Exception as e:
+                self.logger.error("[CATALOG] Could not add session: %s", e)
+        run_on_writer(write)
+
+    def _close_event_log(self):
+        if self.event_log is not None:
+            self.event_log.close(on_closed=lambda path: self.logger.info("[TRIAL] Event log saved to %s", path))
+            self.event_log = None
+            close_session_log(os.path.dirname(self.event_log_path))
+
+    def _cleanup_after_session(self):
+        self.logger.info("[TRIAL] Cleaning up: turning off LEDs and light sphere.")
+        try:
+            set_outputs(leds=(), relays=(), state=self.state)
+        except Exception as e:
+            self.logger.error("[TRIAL] Failed to switch outputs off: %s", e)
         self.light_sphere_state = None
 
     # ---- Trial loop and phases ----
@@ -194,17 +292,25 @@ class TrialController:
             session_deadline = self.session_start_time + float(self.session_duration_target)
 
         while not self.stop_event.is_set():
-            if session_deadline and time.time() >= session_deadline:
-                print("[TRIAL] Session duration reached.")
+            if session_deadline and self.clock() >= session_deadline:
+                self.logger.info("[TRIAL] Session duration reached.")
                 break
 
             if (self.trial_count_target is not None) and (self.current_trial_index >= self.trial_count_target):
-                print("[TRIAL] Target trial count reached.")
+                self.logger.info("[TRIAL] Target trial count reached.")
                 break
 
+            plan = self._next_plan(self.current_trial_index + 1)
+            if plan is None:
+                self.logger.warning("[WARNING] Trial schedule exhausted after %d trials, session ended early.",
+                                    self.current_trial_index)
+                break
+            self.trial_plan = plan
+            self._reward_licks = [0, 0]
             self.current_trial_index += 1
-            print(f"[TRIAL] Starting Trial #{self.current_trial_index}")
+            self.logger.info("[TRIAL] Starting Trial #%s", self.current_trial_index)
             self._trigger_output("trial_start")
+            self.analytics.on_trial_start(self.clock(), self.current_trial_index)
             self._run_reward_phase()
             if self.stop_event.is_set():
                 break
@@ -213,24 +319,56 @@ class TrialController:
                 break
 
         self.session_running = False
+        self.current_phase = None
         self._cleanup_after_session()
-        print("[TRIAL] Trial loop finished.")
+        if not self.stop_event.is_set():
+            # natural end (trial count / duration); stop_session closes the log otherwise
+            self._trigger_output("session_end")
+            self._write_session_summary()
+            self._finish_outputs()
+            self._close_event_log()
+        self.logger.info("[TRIAL] Trial loop finished.")
+
+    def _enter_phase(self, phase_label: str):
+        """Switches the boards (and the trial buttons, if a GUI is running) to a phase."""
+        self.current_phase = phase_label
+        if self.headless:
+            send_trial_phase_commands(phase_label, self.remembered_relays, state=self.state)
+            return
 
-    def _run_reward_phase(self):
+        import dearpygui.dearpygui as dpg
+        from utils import toggle_trial_button
         # queue the trial-phase button toggle on the main GUI thread (capture tag)
         for tag_key in shared_states.buttons_trials.keys():
             try:
-                if dpg.get_item_label(tag_key) == "Reward-Phase":
+                if dpg.get_item_label(tag_key) == phase_label:
                     shared_states.gui_actions.append(
                         lambda t=tag_key: toggle_trial_button(
-                            t, shared_states.buttons_trials, shared_states.active_theme, shared_states.ser1, shared_states.ser2
+                            t, shared_states.buttons_trials, shared_states.active_theme
                         )
                     )
             except Exception:
                 # Ignore items that are not GUI buttons (defensive)
                 pass
 
+    def _next_plan(self, index):
+        """Plan of trial `index`; fixed_time sessions continue the seeded schedule past its end."""
+        plan = self.compiled.trial(index)
+        if plan is not None or self.compiled.trial_mode == "fixed_trials":
+            return plan
+        offset = index - len(self.compiled) - 1
+        if offset >= len(self._schedule_tail):
+            if not self._schedule_tail:
+                self.logger.warning("[WARNING] Trials are shorter than the schedule assumed; "
+                                    "continuing it past its %d trials.", len(self.compiled))
+            self._schedule_tail = extend_schedule(self.compiled, max(offset + 1, 2 * len(self._schedule_tail),
+                                                                      len(self.compiled)))
+        return self._schedule_tail[offset]
+
+    def _run_reward_phase(self):
+        self._enter_phase("Reward-Phase")
         self._trigger_output("reward_phase")
+        self.analytics.on_reward_phase(self.clock())
         self._activate_rewards()
         self._activate_reward_leds()
 
@@ -238,75 +376,69 @@ class TrialController:
             self._display_ymaze_cues_for_trial()
 
         self.collected_rewards = set()
+        if self.lick_input is not None:
+            self.lick_input.clear()  # licks before the reward phase are not collected
         if self.phase_length_mode == "time":
-            t_end = time.time() + self.trial_phase_length
-            while time.time() < t_end and not self.stop_event.is_set():
-                self._mock_maybe_collect_reward()
-                time.sleep(0.1)
+            t_end = self.clock() + self.trial_phase_length
+            while self.clock() < t_end and not self.stop_event.is_set():
+                self._poll_licks()
+                self._poll_zones()
+                self.sleep(0.1)
         else:
             attempts = 0
             while not self.stop_event.is_set():
-                self._mock_maybe_collect_reward()
+                self._poll_licks()
+                self._poll_zones()
                 if self.num_rewards > 0 and len(self.collected_rewards) >= self.num_rewards:
-                    print("[TRIAL] All rewards collected for this trial.")
+                    self.logger.info("[TRIAL] All rewards collected for this trial.")
                     break
                 attempts += 1
                 if attempts > 10000:
-                    print("[TRIAL] Reward phase stuck; breaking for safety.")
+                    self.logger.info("[TRIAL] Reward phase stuck; breaking for safety.")
                     break
-                time.sleep(0.05)
+                self.sleep(0.05)
 
+        self.analytics.on_reward_phase_end(self.clock())
         self._trigger_output("reward_phase_end")
-        print("[TRIAL] Reward Phase ended.")
+        self.logger.info("[TRIAL] Reward Phase ended.")
 
     def _run_intertrial_phase(self):
-        for tag_key in shared_states.buttons_trials.keys():
-            try:
-                if dpg.get_item_label(tag_key) == "Intertrial-Phase":
-                    shared_states.gui_actions.append(
-                        lambda t=tag_key: toggle_trial_button(
-                            t, shared_states.buttons_trials, shared_states.active_theme, shared_states.ser1, shared_states.ser2
-                        )
-                    )
-            except Exception:
-                pass
-
-        print("[TRIAL] Entering Intertrial Phase.")
+        self._enter_phase("Intertrial-Phase")
+        self.logger.info("[TRIAL] Entering Intertrial Phase.")
         self._trigger_output("intertrial_phase")
+        self.analytics.on_intertrial_phase(self.clock())
 
-        location_mode = self.light_sphere_cfg.get("location_mode", "random")
-        size = float(self.light_sphere_cfg.get("size", 40.0))
-        dwell_threshold = float(self.light_sphere_cfg.get("dwell_time_threshold", 1.0))
-
-        if location_mode == "fixed":
-            sphere_pos = (0.5, 0.5)
-        else:
-            sphere_pos = (random.uniform(0.2, 0.8), random.uniform(0.2, 0.8))
+        plan, c = self.trial_plan, self.compiled
+        size = c.sphere_size
+        dwell_threshold = c.dwell_threshold
+        sphere_pos = (plan.sphere_x, plan.sphere_y)
 
         self.light_sphere_state = (sphere_pos[0], sphere_pos[1], size)
         self._project_light_sphere(sphere_pos, size)
+        self.zone_map.set_circle("light_sphere", sphere_pos[0], sphere_pos[1], c.sphere_radius)
+        self.zone_tracker.forget("light_sphere")
+        self.zone_tracker.dwell_thresholds["light_sphere"] = dwell_threshold
 
         if self.phase_length_mode == "time":
-            t_end = time.time() + self.intertrial_phase_length
-            while time.time() < t_end and not self.stop_event.is_set():
-                time.sleep(0.05)
+            t_end = self.clock() + self.intertrial_phase_length
+            while self.clock() < t_end and not self.stop_event.is_set():
+                self._poll_zones()
+                self.sleep(0.05)
         else:
-            dwell_accum = 0.0
-            check_interval = 0.05
+            # dwell is measured on the position sample timestamps, not on loop sleeps
             while not self.stop_event.is_set():
-                mouse_pos = self._get_mouse_position()
-                if self._is_point_in_sphere(mouse_pos, sphere_pos, size):
-                    dwell_accum += check_interval
-                    if dwell_accum >= dwell_threshold:
-                        print(f"[TRIAL] Dwell threshold reached: {dwell_accum}s >= {dwell_threshold}s.")
-                        self._trigger_output("light_sphere_dwell")
-                        break
-                else:
-                    dwell_accum = 0.0
-                time.sleep(check_interval)
+                self._poll_zones()
+                if "light_sphere" in self.zone_tracker.dwell_fired:
+                    self.logger.info("[TRIAL] Dwell threshold reached: %.2fs >= %ss.",
+                             self.zone_tracker.dwell("light_sphere"), dwell_threshold)
+                    self._trigger_output("light_sphere_dwell")
+                    break
+                self.sleep(0.05)
 
+        self.zone_map.clear("light_sphere")
+        self.zone_tracker.forget("light_sphere")
         self.light_sphere_state = None
-        print("[TRIAL] Intertrial Phase ended.")
+        self.logger.info("[TRIAL] Intertrial Phase ended.")
         self._trigger_output("intertrial_phase_end")
     
     def _activate_reward_leds(self):
@@ -330,13 +462,9 @@ class TrialController:
                     continue
                 relays.append(relay_num)
 
-            # Turn on LEDs/relays
+            # Turn on LEDs (one bulk command per board)
             if self.led_mode == "all":
-                for led in range(1, 17):
-                    try:
-                        set_led(None, led, on=True)
-                    except Exception:
-                        pass
+                to_activate = set(self.state.topology.ports)
             else:
                 to_activate = set()
                 for r in relays:
@@ -346,26 +474,26 @@ class TrialController:
                         for n in neigh:
                             to_activate.add(n)
 
-                for led in sorted(to_activate):
-                    try:
-                        set_led(None, int(led), on=True)
-                        print(f"[TRIAL] LED {led} ON (activated for reward).")
-                    except Exception:
-                        print(f"[TRIAL] Failed to activate LED {led} (mock).")
+            set_outputs(leds=[int(led) for led in to_activate], state=self.state)
+            self.logger.info("[TRIAL] LEDs ON (activated for reward): %s", sorted(to_activate))
         except Exception as e:
-            print(f"[TRIAL] Error activating reward LEDs: {e}")
+            self.logger.error("[TRIAL] Error activating reward LEDs: %s", e)
 
 
     def _deactivate_all_reward_leds(self):
-        for led in range(1, 17):
-            try:
-                set_led(None, led, on=False)
-            except Exception:
-                pass
+        try:
+            set_outputs(leds=(), state=self.state)
+        except Exception as e:
+            self.logger.error("[TRIAL] Failed to switch LEDs off: %s", e)
 
     def _activate_rewards(self):
         # Use remembered_relays dict which stores tags like 'button1_1' and 'button2_2'
         rr = self.remembered_relays or {}
+        if self.headless:
+            set_outputs(relays=[int(t.split("_")[1]) for t in rr.values() if t], state=self.state)
+            return
+
+        from utils import toggle_lickport_button
         for port_str, tag_key in rr.items():
             if not tag_key:
                 continue
@@ -384,8 +512,17 @@ class TrialController:
                 )
 
 
-    # ---- Mock DLC & reward sensing ----
+    # ---- Position & reward sensing ----
     def _get_mouse_position(self) -> Tuple[float, float]:
+        # tracked position from the Engine's PositionTracker; the last confident
+        # sample is kept while the animal is briefly lost
+        sample = self.state.position_stream.latest()
+        if sample is not None and sample[3] >= self.min_position_confidence:
+            self.tracked_mouse_pos = (sample[1], sample[2])
+        if self.tracked_mouse_pos is not None:
+            return self.tracked_mouse_pos
+
+        # no tracker running: mock
         if self.mock_dlc_mode == "static":
             return self.mock_mouse_pos
         x, y = self.mock_mouse_pos
@@ -396,75 +533,116 @@ class TrialController:
         self.mock_mouse_pos = (x, y)
         return (x, y)
 
+    def _poll_licks(self):
+        """Handles the licks fed to lick_input since the last call, or runs the mock without one."""
+        if self.lick_input is None:
+            self._mock_maybe_collect_reward()
+            return
+        while self.lick_input:
+            self._on_reward_lick(self.lick_input.popleft())
+
     def _mock_maybe_collect_reward(self):
         """
         Mock behavior that occasionally 'collects' a reward.
         In the real system, you'd check lick sensors / DLC events.
-
-        With reward-probability gating enabled, each detected lick on reward i
-        only dispenses if random() <= p_i.
         """
         if self.num_rewards <= 0:
             return
 
         # 1% chance per call to detect a lick
         if random.random() < 0.01:
-            reward_id = random.randint(1, max(1, self.num_rewards))
-            # always log the lick event (this is the animal action)
-            self._trigger_output("reward_port_licks", details=f"lick_on_reward_{reward_id}")
-
-            dispense = True
-            if self.reward_prob_enabled:
-                if reward_id == 1:
-                    dispense = (random.random() <= self.reward1_probability)
-                elif reward_id == 2:
-                    dispense = (random.random() <= self.reward2_probability)
-
-            if dispense:
-                # count as collected only if actually dispensed
-                self.collected_rewards.add(reward_id)
-                print(f"[TRIAL] Mock: reward {reward_id} DISPENSED "
-                    f"(collected {len(self.collected_rewards)}/{self.num_rewards}).")
-                self._trigger_output("reward_dispensed", details=f"reward_{reward_id}")
-            else:
-                print(f"[TRIAL] Mock: reward {reward_id} WITHHELD by probability gate.")
-                self._trigger_output("reward_withheld", details=f"reward_{reward_id}")
+            self._on_reward_lick(random.randint(1, max(1, self.num_rewards)))
+
+    def _on_reward_lick(self, reward_id: int):
+        """
+        A lick on reward 1/2. With reward-probability gating enabled, the k-th
+        lick on reward i in a trial dispenses according to the precomputed gate
+        of the trial plan.
+        """
+        if not 1 <= reward_id <= max(1, self.num_rewards):
+            return
+        # always log the lick event (this is the animal action)
+        self._trigger_output("reward_port_licks", details=f"lick_on_reward_{reward_id}")
+        port = self._reward_port(reward_id)
+        self.analytics.on_lick(self.clock(), f"port{port}" if port is not None else f"reward{reward_id}")
+
+        lick_number = self._reward_licks[reward_id - 1]
+        self._reward_licks[reward_id - 1] += 1
+        dispense = self.trial_plan.dispense(reward_id, lick_number)
+
+        if dispense:
+            # count as collected only if actually dispensed
+            self.collected_rewards.add(reward_id)
+            self.analytics.on_reward(self.clock(), dispensed=True)
+            self.logger.info("[TRIAL] Reward %s DISPENSED (collected %d/%d).",
+                     reward_id, len(self.collected_rewards), self.num_rewards)
+            self._trigger_output("reward_dispensed", details=f"reward_{reward_id}")
+        else:
+            self.logger.info("[TRIAL] Reward %s WITHHELD by probability gate.", reward_id)
+            self.analytics.on_reward(self.clock(), dispensed=False)
+            self._trigger_output("reward_withheld", details=f"reward_{reward_id}")
+
+    def _reward_port(self, reward_id: int) -> Optional[int]:
+        """Lickport currently selected for reward 1/2 (from tags like 'button1_3')."""
+        tag = (self.remembered_relays or {}).get(str(reward_id))
+        try:
+            return int(tag.split("_")[1]) if tag else None
+        except (IndexError, ValueError):
+            return None
 
     def _project_light_sphere(self, pos: Tuple[float, float], size: float):
         x, y = pos
-        print(f"[LIGHT] Projecting light sphere at ({x:.2f}, {y:.2f}) size={size} (mock).")
-
-    @staticmethod
-    def _is_point_in_sphere(point: Tuple[float, float], sphere_pos: Tuple[float, float], sphere_size: float) -> bool:
-        px, py = point
-        sx, sy = sphere_pos
-        radius = max(0.01, min(0.4, sphere_size / 200.0))
-        dist = math.hypot(px - sx, py - sy)
-        return dist <= radius
+        self.logger.info("[LIGHT] Projecting light sphere at (%.2f, %.2f) size=%s (mock).", x, y, size)
 
     def _display_ymaze_cues_for_trial(self):
-        ymaze = self.ymaze_settings or {}
-        cue_switch_prob = float(ymaze.get("cue_switch_probability", 0.5))
-        swap = random.random() < cue_switch_prob
-        if swap:
-            print("[YMAZE] Displaying Pattern A -> Right, Pattern B -> Left (swap).")
+        if self.trial_plan.ymaze_swap:
+            self.logger.info("[YMAZE] Displaying Pattern A -> Right, Pattern B -> Left (swap).")
         else:
-            print("[YMAZE] Displaying Pattern A -> Left, Pattern B -> Right (no swap).")
+            self.logger.info("[YMAZE] Displaying Pattern A -> Left, Pattern B -> Right (no swap).")
 
     def _trigger_output(self, event_type: str, details: str = ""):
         ts_pc_str = time.strftime("%Y-%m-%d %H:%M:%S")
         arduino_ts = None
         try:
-            if shared_states.timestamps and shared_states.timestamps[0]:
-                arduino_ts = shared_states.timestamps[0][-1]
+            # newest sample time (Engine clock) of any sensor; session replay feeds events by it
+            arduino_ts = max((buf[-1] for buf in list(self.state.timestamps.values()) if buf), default=None)
         except Exception:
             pass
-
-        print(f"[OUTPUT] ({ts_pc_str}) Would trigger outputs for event '{event_type}'.  [Arduino TS: {arduino_ts}]")
-
-        if self.event_log_writer:
-            try:
-                self.event_log_writer.writerow([ts_pc_str, arduino_ts, event_type, details])
-                self.event_log_file.flush()
-            except Exception as e:
-                print(f"[TRIAL] Failed to log event '{event_type}': {e}")
+        if arduino_ts is None:
+            arduino_ts = self.clock()   # no sample yet (session_start, first trial_start)
+
+        recorder = self.state.frame_recorder
+        if recorder is not None:
+            recorder.trigger(event_type, t=self.clock())     # frames carry Engine (or replay) time
+
+        spec = self.compiled.outputs.get(event_type) if self.compiled is not None else None
+        if spec is not None and self.outputs is not None:
+            pulses = self.outputs.trigger(event_type, spec)
+            self.logger.info("[OUTPUT] (%s) '%s': %d pulse(s) on channel %d.  [Arduino TS: %s]",
+                     ts_pc_str, event_type, pulses, spec.channel, arduino_ts)
+        self._log_event(event_type, details, arduino_ts, ts_pc_str)
+
+    def _log_event(self, event_type: str, details: str, t, ts_pc_str: Optional[str] = None):
+        if self.event_log is not None:
+            self.event_log.write([ts_pc_str or time.strftime("%Y-%m-%d %H:%M:%S"), t, event_type, details])
+
+    # ---- Zones ----
+    def _new_positions(self):
+        """Position samples (t, x, y) since the last call; one mock sample if no tracker runs."""
+        samples = self.state.position_stream.since(self._last_position_t)
+        if samples:
+            self._last_position_t = samples[-1][0]
+            return [(t, x, y) for t, x, y, conf in samples if conf >= self.min_position_confidence]
+        if self._last_position_t is None:
+            x, y = self._get_mouse_position()
+            return [(self.clock(), x, y)]
+        return []
+
+    def _poll_zones(self):
+        """Feeds new positions to the zone tracker and logs enter/exit/dwell events."""
+        for t, x, y in self._new_positions():
+            for ev_t, kind, zone, details in self.zone_tracker.update(t, x, y):
+                self._log_event(f"zone_{kind}", f"{zone} {details}".strip(), ev_t)
+                self.analytics.on_zone(ev_t, kind, zone, float(details) if details else None)
+                if kind == "dwell" and zone == "light_sphere":
+                    self.analytics.on_dwell(ev_t)
@@ -1,138 +1,25 @@
 import dearpygui.dearpygui as dpg
 import ctypes
 import json
-import time
-import serial
-import numpy as np
 
 import shared_states
 from shared_states import (
-    buttons_lickports2, buttons_lickports1, remembered_relays, ser1, ser2, timestamps
+    buttons_lickports2, buttons_lickports1, remembered_relays
 )
+from hardware import select_relay, send_trial_phase_commands
 
 
 
-### Serial connection functions
-
-def initialize_serial_connections():
-    global ser1, ser2
-    try:
-        time.sleep(2)  # Give time for Arduinos to reset
-        for ser in [ser1, ser2]:
-            ready = False
-            start = time.time()
-            while time.time() - start < 5:
-                if ser.in_waiting:
-                    line = ser.readline().decode("utf-8").strip()
-                    if line == "READY":
-                        print(f"[INFO] {ser.port} is ready.")
-                        ready = True
-                        break
-            if not ready:
-                print(f"[ERROR] {ser.port} did not send READY signal.")
-        print("[INFO] Serial connections initialized.")
-    except serial.SerialException as e:
-        print(f"[ERROR] Serial connection failed: {e}")
-        ser1 = None
-        ser2 = None
-
-def clean_serial_line(line):
-    try:
-        return line.strip()
-    except Exception:
-        return ""  # Or str(line).strip()
-    
-def parse_sensor_line(line):
-    """
-    Parses: 'ts:12345 cs:400,1200,...'
-    Returns (timestamp, [sensor_values])
-    """
-    try:
-        parts = line.strip().split()
-        ts = int(parts[0].split(":")[1])
-        values = list(map(int, parts[1].split(":")[1].split(",")))
-        return ts, values
-    except Exception as e:
-        print(f"[Parse error]: {e} | Line: {line}")
-        return None, []
-
-def send_serial_command(serial_obj, command):
-    if serial_obj is None:
-        print(f"[WARNING] Tried to send '{command}' to '{serial_obj.port}' but serial connection is not available.")
-        return
-    try:
-        serial_obj.write(command.encode('utf-8'))
-        #print(f"[INFO] Sent command: {command} to '{serial_obj.port}'")
-    except Exception as e:
-        print(f"[ERROR] Failed to send command to '{serial_obj.port}': {e}")
-
-def set_led(serial_obj, led_number, on=True):
-    """
-    Controls an LED via appropriate Arduino.
-    LED numbers: 1–16
-    """
-    try:
-        if 1 <= led_number <= 8:
-            target_serial = shared_states.ser1
-            local_led = led_number
-        elif 9 <= led_number <= 16:
-            target_serial = shared_states.ser2
-            local_led = led_number - 8
-        else:
-            print(f"[ERROR] Invalid LED number: {led_number}")
-            return
-
-        cmd = 'L' if on else 'l'
-        target_serial.write(f"{cmd}{local_led}".encode())
-    except Exception as e:
-        print(f"[ERROR] Failed to send LED command: {e}")
-
-def push_relay_mappings(mapping: dict):
-    """
-    Send reward group assignment to each Arduino
-    mapping: {relay_num: reward_group}, both 1-based
-    """
-    for relay_num_str, reward_group in mapping.items():
-        relay_num = int(relay_num_str)
-        reward_group = int(reward_group)
-
-        if not (1 <= relay_num <= 16) or reward_group not in [1, 2]:
-            print(f"[WARNING] Invalid mapping: Relay {relay_num} -> Reward {reward_group}")
-            continue
-
-        if relay_num <= 8:
-            serial_obj = shared_states.ser1
-            relay_index = relay_num
-        else:
-            serial_obj = shared_states.ser2
-            relay_index = relay_num - 8
-
-        try:
-            serial_obj.write(f"M{relay_index}{reward_group}".encode())
-        except Exception as e:
-            print(f"[ERROR] Failed to send mapping for relay {relay_num}: {e}")
-
 ### Buttons that trigger serial connection
 
-def set_trial_phase(button_label, ser1, ser2, active_theme):
+def set_trial_phase(button_label, active_theme):
     """Send trial phase command and reactivate remembered relays and UI."""
+    send_trial_phase_commands(button_label, remembered_relays)
 
     if button_label == 'Reward-Phase':
-        send_serial_command(ser1, 'r')
-        send_serial_command(ser2, 'r')
-
         # Re-activate previously selected relays
         for port, tag in remembered_relays.items():
             if tag:
-                # Extract button number from tag
-                relay_number = int(tag.split("_")[1])
-
-                # Re-send appropriate serial command
-                if 1 <= relay_number <= 8:
-                    send_serial_command(ser1, f"{relay_number}")
-                elif 9 <= relay_number <= 16:
-                    send_serial_command(ser2, f"{relay_number - 8}")
-
                 # Visually reactivate the button
                 if port == "1":
                     dpg.set_value(tag, True)
@@ -144,9 +31,6 @@ def set_trial_phase(button_label, ser1, ser2, active_theme):
                     buttons_lickports2[tag]["checked"] = True
 
     elif button_label == 'Intertrial-Phase':
-        send_serial_command(ser1, 'i')
-        send_serial_command(ser2, 'i')
-
         # Clear visuals but keep memory
         for d in [buttons_lickports1, buttons_lickports2]:
             for tag in d:
@@ -154,9 +38,9 @@ def set_trial_phase(button_label, ser1, ser2, active_theme):
                 dpg.bind_item_theme(tag, None)
                 d[tag]["checked"] = False
 
-def toggle_trial_button(sender, button_dict, active_theme, ser1, ser2):
+def toggle_trial_button(sender, button_dict, active_theme):
     label = dpg.get_item_label(sender)
-    set_trial_phase(label, ser1, ser2, active_theme)
+    set_trial_phase(label, active_theme)
 
     for tag, info in button_dict.items():
         if tag != sender:
@@ -191,10 +75,7 @@ def toggle_lickport_button(sender, button_dict, port_label, active_theme):
             remembered_relays[port_label] = tag
 
             # Send command to Arduino
-            if gui_relay_number <= 8:
-                send_serial_command(ser1, f"{gui_relay_number}")
-            else:
-                send_serial_command(ser2, f"{gui_relay_number - 8}")
+            select_relay(gui_relay_number)
 
             # Append relay state with timestamp to current_mouse_data
             if current_mouse_data and current_mouse_file:
@@ -210,12 +91,6 @@ def toggle_lickport_button(sender, button_dict, port_label, active_theme):
                 print(f"Relay state saved: {entry}")
 
 
-### Camera functions 
-
-def get_camera_frame():
-    # Return a dummy black frame if real camera is not available
-    return np.zeros((200, 200, 3), dtype=np.uint8)
-
 ### GUI functions
 def shift_data_window(data_list, max_length):
     """Keep the data list within the maximum number of elements."""
@@ -250,5 +125,8 @@ def check_ready_state():
     protocol_file = dpg.get_value("protocol_file_path")
     ready = mouse_file.endswith(".json") and protocol_file.endswith(".json")
     dpg.configure_item("start_experiment_button", show=ready)
+    if ready:
+        from gui_functions import arm_recording_async
+        arm_recording_async()
 
 
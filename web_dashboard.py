@@ -0,0 +1,377 @@
+# web_dashboard.py
+"""
+Live view of a running session in a browser (standard library only).
+
+    http://127.0.0.1:8765/      page with sensor traces, camera preview, trial state and metrics
+    ws://127.0.0.1:8765/ws      the stream the page reads
+
+A Broadcaster thread builds one update every 1/rate_hz s (the GUI min/max
+buffers, trial phase, analytics snapshot) and a JPEG preview every
+1/jpeg_hz s. Each is encoded once into a WebSocket frame and handed to every
+client. A client only keeps the newest frame of each kind: a viewer that
+cannot keep up skips updates (counted in `dropped`) and never delays the
+Broadcaster, let alone the Engine.
+
+Binds to 127.0.0.1 by default; set host "0.0.0.0" to reach it from the lab
+network (there is no authentication).
+
+Arena config (optional): "dashboard": {"enabled": true, "host": "127.0.0.1", "port": 8765}
+    python headless_session.py ... --dashboard 8765
+"""
+import base64
+import hashlib
+import json
+import math
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import shared_states
+from logging_setup import get_logger
+
+log = get_logger("dashboard")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+RATE_HZ = 5.0
+JPEG_HZ = 1.0
+MAX_POINTS = 300            # points per sensor per update
+PREVIEW_WIDTH = 320
+SEND_TIMEOUT_S = 5.0
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def ws_frame(payload, binary=False):
+    """One unmasked, unfragmented server-to-client WebSocket frame."""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    head = bytes((0x82 if binary else 0x81,))
+    n = len(payload)
+    if n < 126:
+        head += bytes((n,))
+    elif n < 1 << 16:
+        head += bytes((126,)) + struct.pack(">H", n)
+    else:
+        head += bytes((127,)) + struct.pack(">Q", n)
+    return head + payload
+
+def ws_accept(key):
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest()).decode("ascii")
+
+
+class DashboardClient:
+    """One browser: the newest frame per kind, sent by its own connection thread."""
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.slots = {}                 # kind -> newest encoded frame
+        self.cond = threading.Condition()
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+
+    def offer(self, kind, frame):
+        """Non-blocking: replaces an unsent frame of the same kind."""
+        with self.cond:
+            if kind in self.slots:
+                self.dropped += 1
+            self.slots[kind] = frame
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def run(self):
+        self.sock.settimeout(SEND_TIMEOUT_S)
+        try:
+            while True:
+                with self.cond:
+                    while not self.slots and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    frames, self.slots = list(self.slots.values()), {}
+                for frame in frames:
+                    self.sock.sendall(frame)
+                    self.sent += 1
+        except OSError:
+            pass            # viewer went away or stalled beyond SEND_TIMEOUT_S
+        finally:
+            self.closed = True
+
+
+class WebDashboard:
+    def __init__(self, state=None, controller=None, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 rate_hz=RATE_HZ, jpeg_hz=JPEG_HZ, max_points=MAX_POINTS):
+        """
+        state:      shared_states (default) or an arena.ArenaState.
+        controller: TrialController for phase and metrics (default: state.trial_controller).
+        """
+        self.state = state or shared_states
+        self._controller = controller
+        self.host = host
+        self.port = int(port)
+        self.period = 1.0 / float(rate_hz)
+        self.jpeg_period = 1.0 / float(jpeg_hz) if jpeg_hz else None
+        self.max_points = int(max_points)
+        self.clients = []
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._server = None
+        self._threads = []
+        self.updates = 0
+
+    @classmethod
+    def from_config(cls, config, state=None, **kwargs):
+        """WebDashboard from the arena config's "dashboard" section, or None if it is not enabled."""
+        cfg = dict((config or {}).get("dashboard") or {})
+        if not cfg.get("enabled"):
+            return None
+        return cls(state=state, host=cfg.get("host", DEFAULT_HOST), port=cfg.get("port", DEFAULT_PORT),
+                   rate_hz=cfg.get("rate_hz", RATE_HZ), jpeg_hz=cfg.get("jpeg_hz", JPEG_HZ), **kwargs)
+
+    @property
+    def controller(self):
+        return self._controller or getattr(self.state, "trial_controller", None)
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    # ---------- Lifecycle ----------
+    def start(self):
+        if self._server is not None:
+            return self
+        dashboard = self
+
+        class Handler(_DashboardHandler):
+            pass
+        Handler.dashboard = dashboard
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._running.set()
+        self._threads = [threading.Thread(target=self._server.serve_forever, name="DashboardHTTP", daemon=True),
+                         threading.Thread(target=self._broadcast_loop, name="DashboardBroadcast", daemon=True)]
+        for t in self._threads:
+            t.start()
+        log.info("[DASHBOARD] Serving %s", self.url)
+        return self
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._running.clear()
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            client.close()
+        for t in self._threads:
+            t.join(timeout=2.0)
+        self._threads = []
+        self._server = None
+
+    def add_client(self, client):
+        with self._lock:
+            self.clients.append(client)
+        log.info("[DASHBOARD] Viewer connected from %s (%d connected)", client.address[0], len(self.clients))
+
+    def remove_client(self, client):
+        with self._lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    # ---------- Broadcasting ----------
+    def _broadcast_loop(self):
+        next_update = time.perf_counter()
+        next_jpeg = next_update
+        while self._running.is_set():
+            now = time.perf_counter()
+            if now < next_update:
+                time.sleep(next_update - now)
+                continue
+            next_update = max(next_update + self.period, now)
+            with self._lock:
+                clients = [c for c in self.clients if not c.closed]
+                self.clients = clients
+            if not clients:
+                continue
+            try:
+                self._fan_out(clients, "update", ws_frame(json.dumps(self.snapshot(), separators=(",", ":"))))
+                if self.jpeg_period is not None and now >= next_jpeg:
+                    next_jpeg = now + self.jpeg_period
+                    jpeg = self.preview_jpeg()
+                    if jpeg is not None:
+                        self._fan_out(clients, "jpeg", ws_frame(jpeg, binary=True))
+            except Exception as e:
+                log.error("[DASHBOARD] Update failed: %s", e)
+
+    def _fan_out(self, clients, kind, frame):
+        # encoded once, shared by every client
+        for client in clients:
+            client.offer(kind, frame)
+        self.updates += 1
+
+    def snapshot(self):
+        """The JSON update: sensor traces (relative to the newest sample), trial state and metrics."""
+        S = self.state
+        sensors = {}
+        t_last = None
+        for sid in S.topology.sensor_ports:
+            try:
+                times = list(S.gui_time_buffers[sid - 1])
+                values = list(S.gui_plot_buffers[sid - 1])
+            except IndexError:
+                continue
+            n = min(len(times), len(values))
+            if not n:
+                continue
+            step = max(1, math.ceil(n / self.max_points))
+            # keep min/max pairs together when thinning
+            keep = [i for i in range(n) if (i // 2) % step == 0] if step > 1 else range(n)
+            t_end = times[n - 1]
+            t_last = t_end if t_last is None else max(t_last, t_end)
+            sensors[str(sid)] = {"t": [round(times[i] - t_end, 3) for i in keep], "v": [values[i] for i in keep]}
+        update = {"time": time.strftime("%H:%M:%S"), "recording": bool(getattr(S, "is_recording", False)),
+                  "session": getattr(S, "current_session_path", None), "sensors": sensors}
+        controller = self.controller
+        if controller is not None:
+            update["trial"] = {"running": controller.session_running, "index": controller.current_trial_index,
+                               "phase": controller.current_phase}
+            if controller.analytics.t_start is not None:
+                update["metrics"] = controller.analytics.snapshot()
+        return update
+
+    def preview_jpeg(self):
+        S = self.state
+        with S.camera_lock:
+            frame = S.last_camera_frame
+        if frame is None:
+            return None
+        import cv2  # deferred: only needed once a viewer is connected
+        h, w = frame.shape[:2]
+        if w > PREVIEW_WIDTH:
+            frame = cv2.resize(frame, (PREVIEW_WIDTH, max(1, h * PREVIEW_WIDTH // w)), interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        return jpeg.tobytes() if ok else None
+
+    def stats(self):
+        with self._lock:
+            return {"clients": len(self.clients), "updates": self.updates,
+                    "sent": sum(c.sent for c in self.clients), "dropped": sum(c.dropped for c in self.clients)}
+
+
+class _DashboardHandler(BaseHTTPRequestHandler):
+    dashboard = None
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/ws" and self.headers.get("Upgrade", "").lower() == "websocket":
+            self._upgrade()
+        elif self.path in ("/", "/index.html"):
+            body = PAGE.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def _upgrade(self):
+        key = self.headers.get("Sec-WebSocket-Key")
+        if not key:
+            self.send_error(400)
+            return
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", ws_accept(key))
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        client = DashboardClient(self.connection, self.client_address)
+        self.dashboard.add_client(client)
+        try:
+            client.run()        # this connection's thread sends until the viewer leaves
+        finally:
+            self.dashboard.remove_client(client)
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def log_message(self, format, *args):
+        pass    # no console line per request
+
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Multiport live</title>
+<style>
+body { font-family: sans-serif; margin: 12px; background: #111; color: #ddd; }
+#top { display: flex; gap: 16px; align-items: flex-start; }
+#status { white-space: pre; font-family: monospace; font-size: 13px; }
+#plots { display: grid; grid-template-columns: repeat(auto-fill, minmax(300px, 1fr)); gap: 8px; margin-top: 12px; }
+canvas { background: #1b1b1b; width: 100%; height: 120px; }
+img { max-width: 320px; background: #1b1b1b; }
+</style></head>
+<body>
+<div id="top"><img id="camera" alt="camera"><div id="status">connecting...</div></div>
+<div id="plots"></div>
+<script>
+const plots = {};
+function plot(id, t, v) {
+  let c = plots[id];
+  if (!c) {
+    const box = document.createElement("div");
+    box.innerHTML = "<div>Sensor " + id + "</div>";
+    c = document.createElement("canvas"); c.width = 600; c.height = 120;
+    box.appendChild(c); document.getElementById("plots").appendChild(box); plots[id] = c;
+  }
+  const g = c.getContext("2d"); g.clearRect(0, 0, c.width, c.height);
+  if (!t.length) return;
+  const t0 = t[0], dt = (t[t.length - 1] - t0) || 1;
+  const lo = Math.min(...v), hi = Math.max(...v), dv = (hi - lo) || 1;
+  g.strokeStyle = "#4af"; g.beginPath();
+  for (let i = 0; i < t.length; i++) {
+    const x = (t[i] - t0) / dt * c.width, y = c.height - 4 - (v[i] - lo) / dv * (c.height - 8);
+    if (i) g.lineTo(x, y); else g.moveTo(x, y);
+  }
+  g.stroke(); g.fillStyle = "#888"; g.fillText(hi + " / " + lo, 4, 12);
+}
+function connect() {
+  const ws = new WebSocket("ws://" + location.host + "/ws");
+  ws.binaryType = "blob";
+  let url = null;
+  ws.onmessage = (e) => {
+    if (typeof e.data !== "string") {
+      if (url) URL.revokeObjectURL(url);
+      url = URL.createObjectURL(e.data); document.getElementById("camera").src = url; return;
+    }
+    const u = JSON.parse(e.data);
+    const lines = [u.time + (u.recording ? "  RECORDING" : "  not recording"), "session: " + (u.session || "-")];
+    if (u.trial) lines.push("trial " + u.trial.index + "  phase: " + (u.trial.phase || "-") + (u.trial.running ? "" : "  (stopped)"));
+    if (u.metrics) {
+      const m = u.metrics;
+      lines.push("elapsed " + m.elapsed_s.toFixed(0) + " s, trials " + m.trials_completed +
+                 ", rewards " + m.rewards_dispensed + " (+" + m.rewards_withheld + " withheld)");
+      lines.push("licks " + JSON.stringify(m.licks));
+    }
+    document.getElementById("status").textContent = lines.join("\\n");
+    for (const id in u.sensors) plot(id, u.sensors[id].t, u.sensors[id].v);
+  };
+  ws.onclose = () => { document.getElementById("status").textContent = "disconnected, retrying..."; setTimeout(connect, 2000); };
+}
+connect();
+</script></body></html>
+"""
+
+
+def get_dashboard(state=None):
+    return getattr(state or shared_states, "dashboard", None)
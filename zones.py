@@ -0,0 +1,268 @@
+# zones.py
+"""
+Spatial zones as precomputed lookup rasters.
+
+Every zone (light sphere, Y-maze arms, lickport proximity, ...) owns one bit
+of a resolution x resolution uint64 raster covering the normalized arena
+([0..1], x to the right, y down, as delivered by the position tracker).
+A point-in-zone test is a single array lookup; whole position arrays are
+classified with one fancy-indexing call.
+
+ZoneTracker turns a stream of timestamped positions into enter/exit/dwell
+events using the sample timestamps; zone_events() does the same for whole
+arrays offline.
+
+Protocol (optional "zones" section, defaults shown):
+    "zones": {"resolution": 256, "port_radius": 0.06, "port_ring_radius": 0.45,
+              "port_positions": {"1": [x, y], ...},
+              "ymaze": {"center": [0.5, 0.5], "arm_angles": [90, 210, 330], "hub_radius": 0.12}}
+Port positions default to a ring around the arena centre in port order.
+"""
+import math
+
+import numpy as np
+
+MAX_ZONES = 64
+DEFAULT_RESOLUTION = 256
+
+
+def sphere_radius(size):
+    """Light sphere size (protocol units) -> radius in normalized arena units."""
+    return max(0.01, min(0.4, float(size) / 200.0))
+
+
+class ZoneMap:
+    def __init__(self, resolution=DEFAULT_RESOLUTION):
+        self.resolution = int(resolution)
+        self.raster = np.zeros((self.resolution, self.resolution), dtype=np.uint64)
+        self.bits = {}                    # name -> bit index
+        self.names = []                   # bit index -> name
+        # pixel-centre coordinates of the raster
+        self._centres = (np.arange(self.resolution, dtype=np.float32) + 0.5) / self.resolution
+
+    # ---------- Building ----------
+    def _bit(self, name):
+        if name not in self.bits:
+            if len(self.names) >= MAX_ZONES:
+                raise ValueError(f"At most {MAX_ZONES} zones per map")
+            self.bits[name] = len(self.names)
+            self.names.append(name)
+        return np.uint64(1) << np.uint64(self.bits[name])
+
+    def _bbox(self, x0, y0, x1, y1):
+        res = self.resolution
+        c0 = max(0, int(math.floor(x0 * res)))
+        c1 = min(res, int(math.ceil(x1 * res)))
+        r0 = max(0, int(math.floor(y0 * res)))
+        r1 = min(res, int(math.ceil(y1 * res)))
+        return r0, r1, c0, c1
+
+    def _paint(self, name, inside_fn, bbox):
+        """Replaces zone `name` by the cells where inside_fn(x_grid, y_grid) holds within bbox."""
+        bit = self._bit(name)
+        self.raster &= ~bit
+        r0, r1, c0, c1 = self._bbox(*bbox)
+        if r0 >= r1 or c0 >= c1:
+            return
+        xs = self._centres[c0:c1][None, :]
+        ys = self._centres[r0:r1][:, None]
+        inside = inside_fn(xs, ys)
+        self.raster[r0:r1, c0:c1] |= np.where(inside, bit, np.uint64(0))
+
+    def set_circle(self, name, cx, cy, r):
+        self._paint(name, lambda x, y: (x - cx) ** 2 + (y - cy) ** 2 <= r * r,
+                    (cx - r, cy - r, cx + r, cy + r))
+
+    def set_rect(self, name, x0, y0, x1, y1):
+        self._paint(name, lambda x, y: (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1), (x0, y0, x1, y1))
+
+    def set_polygon(self, name, points):
+        """Polygon given as [(x, y), ...] (even-odd rule)."""
+        pts = np.asarray(points, dtype=np.float32)
+
+        def inside_fn(x, y):
+            inside = np.zeros(np.broadcast(x, y).shape, dtype=bool)
+            for (xa, ya), (xb, yb) in zip(pts, np.roll(pts, -1, axis=0)):
+                if ya == yb:
+                    continue
+                crosses = (ya > y) != (yb > y)
+                x_cross = xa + (y - ya) * (xb - xa) / (yb - ya)
+                inside ^= crosses & (x < x_cross)
+            return inside
+
+        self._paint(name, inside_fn, (pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max()))
+
+    def set_sector(self, name, cx, cy, r_in, r_out, angle_from, angle_to):
+        """
+        Annular sector around (cx, cy). Angles in degrees counter-clockwise from
+        +x with y pointing up on screen (so 90 is the top of the image).
+        """
+        a0 = math.radians(angle_from) % (2 * math.pi)
+        span = math.radians(angle_to - angle_from) % (2 * math.pi) or 2 * math.pi
+
+        def inside_fn(x, y):
+            dx, dy = x - cx, cy - y
+            d2 = dx * dx + dy * dy
+            ang = (np.arctan2(dy, dx) - a0) % (2 * math.pi)
+            return (d2 >= r_in * r_in) & (d2 <= r_out * r_out) & (ang <= span)
+
+        self._paint(name, inside_fn, (cx - r_out, cy - r_out, cx + r_out, cy + r_out))
+
+    def clear(self, name):
+        if name in self.bits:
+            self.raster &= ~self._bit(name)
+
+    # ---------- Queries ----------
+    def _cell(self, v):
+        return min(self.resolution - 1, max(0, int(v * self.resolution)))
+
+    def classify(self, x, y):
+        """Bitmask of the zones containing (x, y)."""
+        return int(self.raster[self._cell(y), self._cell(x)])
+
+    def classify_many(self, xs, ys):
+        """Bitmasks for arrays of positions (NaN positions -> 0)."""
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        valid = np.isfinite(xs) & np.isfinite(ys)
+        res = self.resolution
+        cols = np.clip((np.nan_to_num(xs) * res).astype(np.int64), 0, res - 1)
+        rows = np.clip((np.nan_to_num(ys) * res).astype(np.int64), 0, res - 1)
+        return np.where(valid, self.raster[rows, cols], np.uint64(0))
+
+    def contains(self, name, x, y):
+        return name in self.bits and bool((self.classify(x, y) >> self.bits[name]) & 1)
+
+    def zones_at(self, x, y):
+        return self.names_in(self.classify(x, y))
+
+    def names_in(self, mask):
+        return [self.names[i] for i in range(len(self.names)) if (mask >> i) & 1]
+
+    # ---------- Protocol ----------
+    @classmethod
+    def from_protocol(cls, protocol, ports):
+        """Lickport proximity zones (port<n>) and, for Y-maze protocols, arm<i> + ymaze_hub."""
+        cfg = (protocol or {}).get("zones", {})
+        zmap = cls(cfg.get("resolution", DEFAULT_RESOLUTION))
+
+        port_radius = float(cfg.get("port_radius", 0.06))
+        positions = {int(k): v for k, v in (cfg.get("port_positions") or {}).items()}
+        ring = float(cfg.get("port_ring_radius", 0.45))
+        n = len(ports)
+        for i, port in enumerate(ports):
+            if port in positions:
+                px, py = positions[port]
+            else:
+                # evenly spaced clockwise from the top, matching the neighbour ring
+                a = 2 * math.pi * i / max(1, n)
+                px, py = 0.5 + ring * math.sin(a), 0.5 - ring * math.cos(a)
+            zmap.set_circle(f"port{port}", px, py, port_radius)
+
+        if protocol and protocol.get("experiment_type") == "Y-Maze":
+            ym = cfg.get("ymaze", {})
+            cx, cy = ym.get("center", (0.5, 0.5))
+            hub = float(ym.get("hub_radius", 0.12))
+            for i, angle in enumerate(ym.get("arm_angles", (90, 210, 330)), start=1):
+                zmap.set_sector(f"arm{i}", cx, cy, hub, 2.0, angle - 60, angle + 60)
+            zmap.set_circle("ymaze_hub", cx, cy, hub)
+        return zmap
+
+
+class ZoneTracker:
+    """
+    Online enter/exit/dwell events from timestamped positions.
+
+    update() returns a list of (t, kind, zone, details) with kind in
+    'enter', 'exit' (details: visit duration) and 'dwell' (once per visit when
+    the zone's dwell threshold is reached).
+    """
+    def __init__(self, zone_map, dwell_thresholds=None):
+        self.zone_map = zone_map
+        self.dwell_thresholds = dict(dwell_thresholds or {})
+        self.reset()
+
+    def reset(self):
+        self.inside = 0
+        self.enter_t = {}
+        self.dwell_fired = set()
+        self.last_t = None
+
+    def update(self, t, x, y):
+        zmap = self.zone_map
+        mask = zmap.classify(x, y)
+        events = []
+        changed = mask ^ self.inside
+        if changed:
+            for name in zmap.names_in(changed):
+                if (mask >> zmap.bits[name]) & 1:
+                    self.enter_t[name] = t
+                    events.append((t, "enter", name, ""))
+                else:
+                    t_in = self.enter_t.pop(name, t)
+                    self.dwell_fired.discard(name)
+                    events.append((t, "exit", name, f"{t - t_in:.3f}"))
+            self.inside = mask
+        for name, threshold in self.dwell_thresholds.items():
+            t_in = self.enter_t.get(name)
+            if t_in is not None and name not in self.dwell_fired and t - t_in >= threshold:
+                self.dwell_fired.add(name)
+                events.append((t, "dwell", name, f"{t - t_in:.3f}"))
+        self.last_t = t
+        return events
+
+    def forget(self, name):
+        """Drops the state of one zone without events (e.g. after the zone was moved)."""
+        bit = self.zone_map.bits.get(name)
+        if bit is not None:
+            self.inside &= ~(1 << bit)
+        self.enter_t.pop(name, None)
+        self.dwell_fired.discard(name)
+
+    def dwell(self, name, t=None):
+        """Seconds spent in `name` during the current visit (0 if outside)."""
+        t_in = self.enter_t.get(name)
+        if t_in is None:
+            return 0.0
+        return (self.last_t if t is None else t) - t_in
+
+
+# ---------- Offline ----------
+def zone_events(zone_map, t, x, y, dwell_thresholds=None):
+    """
+    Vectorized equivalent of feeding every sample to a ZoneTracker.
+    Returns [(t, kind, zone, details)] sorted by time (visits still open at
+    the end produce no exit event).
+    """
+    t = np.asarray(t, dtype=np.float64)
+    masks = zone_map.classify_many(x, y)
+    thresholds = dwell_thresholds or {}
+    events = []
+    for name, bit in zone_map.bits.items():
+        inside = ((masks >> np.uint64(bit)) & np.uint64(1)).astype(np.int8)
+        edges = np.diff(inside, prepend=np.int8(0))
+        enters = np.flatnonzero(edges == 1)
+        exits = np.flatnonzero(edges == -1)
+        for k, i in enumerate(enters):
+            t_in = t[i]
+            events.append((t_in, "enter", name, ""))
+            j = exits[k] if k < len(exits) else None
+            t_out = t[j] if j is not None else None
+            if name in thresholds:
+                due = np.searchsorted(t, t_in + thresholds[name], side="left")
+                if due < len(t) and (j is None or due < j):
+                    events.append((t[due], "dwell", name, f"{t[due] - t_in:.3f}"))
+            if t_out is not None:
+                events.append((t_out, "exit", name, f"{t_out - t_in:.3f}"))
+    events.sort(key=lambda e: e[0])
+    return events
+
+def zone_occupancy(zone_map, t, x, y):
+    """Seconds spent in each zone, attributing each sample interval to its start sample."""
+    t = np.asarray(t, dtype=np.float64)
+    if len(t) < 2:
+        return {name: 0.0 for name in zone_map.bits}
+    dt = np.diff(t)
+    masks = zone_map.classify_many(x, y)[:-1]
+    return {name: float(dt[((masks >> np.uint64(bit)) & np.uint64(1)) == 1].sum())
+            for name, bit in zone_map.bits.items()}